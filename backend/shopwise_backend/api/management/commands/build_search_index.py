@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from api.search import product_matcher, product_search
+
+
+class Command(BaseCommand):
+    help = 'Create the full-text search and trigram name indexes for the configured database, or rebuild them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rebuild the indexes from the products table even if they exist')
+
+    def handle(self, *args, **options):
+        for index in (product_search(), product_matcher()):
+            with transaction.atomic(), connection.cursor() as cursor:
+                index.ensure_index(cursor, rebuild=options['rebuild'])
+            self.stdout.write(self.style.SUCCESS(
+                f"{type(index).__name__}: index ready on {connection.vendor}"
+            ))
@@ -0,0 +1,26 @@
+from collections import Counter
+from django.core.management.base import BaseCommand
+from api.services.catalog_change_service import CatalogChangeService, CONSUMERS
+
+
+class Command(BaseCommand):
+    help = 'Apply catalog changes written by the scraper since the consumer last ran'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer', choices=sorted(CONSUMERS), default='cache',
+                            help='Consumer whose handler and watermark to use')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Changes read and handled per batch')
+
+    def handle(self, *args, **options):
+        consumer = options['consumer']
+        handler = CONSUMERS[consumer]
+        kinds = Counter()
+
+        def counted_handler(changes):
+            handler(changes)
+            kinds.update(change.change_kind for change in changes)
+
+        consumed = CatalogChangeService.consume(consumer, counted_handler, options['batch_size'])
+        summary = ', '.join(f"{count} {kind}" for kind, count in sorted(kinds.items())) or 'nothing new'
+        self.stdout.write(self.style.SUCCESS(f"{consumer}: applied {consumed} changes ({summary})"))
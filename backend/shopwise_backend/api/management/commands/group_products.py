@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from api.models import CatalogChangeWatermark
+from api.services.catalog_change_service import CatalogChangeService
+from api.services.product_group_service import ProductGroupService
+
+CONSUMER = 'groups'
+
+
+class Command(BaseCommand):
+    help = 'Group the same product across retailers, for products added or changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Group every product from scratch instead of only changed ones')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Catalog changes read and regrouped per batch')
+
+    def handle(self, *args, **options):
+        if options['full'] or not CatalogChangeWatermark.objects.filter(consumer=CONSUMER).exists():
+            products, groups, seq = ProductGroupService.rebuild()
+            CatalogChangeWatermark.objects.update_or_create(consumer=CONSUMER, defaults={'seq': seq})
+            self.stdout.write(self.style.SUCCESS(
+                f"Grouped {products} products into {groups} groups (up to change {seq})"
+            ))
+            return
+
+        consumed = CatalogChangeService.consume(
+            CONSUMER, ProductGroupService.regroup_changes, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Regrouped products of {consumed} catalog changes"))
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.9 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('change_kind', models.CharField(max_length=10)),
+                ('old_price', models.FloatField(blank=True, null=True)),
+                ('new_price', models.FloatField(blank=True, null=True)),
+                ('run_id', models.CharField(blank=True, max_length=36, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'catalog_changes',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='CatalogChangeWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consumer', models.CharField(max_length=100, unique=True)),
+                ('seq', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'catalog_change_watermarks',
+            },
+        ),
+    ]
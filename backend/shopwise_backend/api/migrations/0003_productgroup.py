@@ -0,0 +1,29 @@
+# Generated by Django 5.0.9 on 2026-10-18 18:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_catalogchange_catalogchangewatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductGroup',
+            fields=[
+                ('product', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='group', serialize=False, to='api.products')),
+                ('group_id', models.BigIntegerField(db_index=True)),
+                ('block', models.CharField(db_index=True, max_length=100)),
+                ('tokens', models.CharField(max_length=500)),
+                ('retailer_id', models.BigIntegerField()),
+                ('score', models.FloatField(default=1.0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'product_groups',
+            },
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from accounts.models import User
 
 
@@ -26,6 +28,26 @@ class Retailers(models.Model):
         return self.name
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_latest_price(self):
+        """Annotate latest_price in the same statement.
+
+        The stored current_price is used when the scraper has set it, and the
+        newest prices row otherwise; COALESCE only runs the subquery for
+        products without a stored price.
+        """
+        newest_price = (
+            Prices.objects.filter(product=OuterRef('pk'))
+            .order_by('-created_at', '-id')
+            .values('price')[:1]
+        )
+        return self.annotate(latest_price=Coalesce(F('current_price'), Subquery(newest_price)))
+
+    def for_serializer(self):
+        """Everything ProductSerializer reads, fetched in a single query."""
+        return self.select_related('retailer', 'category').with_latest_price()
+
+
 class Products(models.Model):
     name = models.CharField(max_length=500)
     image_url = models.CharField(max_length=2000)
@@ -34,6 +56,11 @@ class Products(models.Model):
     category = models.ForeignKey(Categories, on_delete=models.CASCADE)
     retailer = models.ForeignKey(Retailers, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Latest price, kept up to date by the scraper when it writes a price
+    current_price = models.FloatField(null=True, blank=True)
+    current_price_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         db_table = 'products'
@@ -103,3 +130,63 @@ class GroceryListItem(models.Model):
 
     def __str__(self):
         return f"{self.grocery_list.name} - {self.product.name} (x{self.quantity})"
+
+
+class CatalogChange(models.Model):
+    """A product or price change appended by the scraper's pipeline, in seq order."""
+    CREATED = 'created'
+    UPDATED = 'updated'
+    PRICE = 'price'
+
+    seq = models.BigAutoField(primary_key=True)
+    product = models.ForeignKey(
+        Products, on_delete=models.DO_NOTHING, related_name='changes')
+    change_kind = models.CharField(max_length=10)
+    old_price = models.FloatField(null=True, blank=True)
+    new_price = models.FloatField(null=True, blank=True)
+    run_id = models.CharField(max_length=36, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'catalog_changes'
+        managed = False
+
+    def __str__(self):
+        return f"#{self.seq} {self.change_kind} {self.product_id}"
+
+
+class CatalogChangeWatermark(models.Model):
+    """Last catalog change seq a consumer has applied."""
+    consumer = models.CharField(max_length=100, unique=True)
+    seq = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'catalog_change_watermarks'
+
+    def __str__(self):
+        return f"{self.consumer} - {self.seq}"
+
+
+class ProductGroup(models.Model):
+    """Canonical group of the same item across retailers, written by the group_products job.
+
+    group_id is the id of the group's first product. Products are compared
+    within a block, the same category and normalized size, and a group holds
+    at most one product per retailer.
+    """
+    # No database constraint: products are deleted by the scraper, outside Django
+    product = models.OneToOneField(
+        Products, on_delete=models.DO_NOTHING, primary_key=True, related_name='group', db_constraint=False)
+    group_id = models.BigIntegerField(db_index=True)
+    block = models.CharField(max_length=100, db_index=True)
+    tokens = models.CharField(max_length=500)
+    retailer_id = models.BigIntegerField()
+    score = models.FloatField(default=1.0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'product_groups'
+
+    def __str__(self):
+        return f"{self.product_id} in group {self.group_id}"
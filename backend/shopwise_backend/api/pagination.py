@@ -0,0 +1,164 @@
+import base64
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from .services.catalog_change_service import CatalogChangeService
+
+
+def product_count(queryset):
+    """Number of products in queryset, and whether it is an estimate.
+
+    The whole catalog on PostgreSQL is estimated from the planner's
+    reltuples once it has PRODUCT_COUNT_ESTIMATE_MIN rows. Other counts are
+    cached per query and catalog version for PRODUCT_COUNT_CACHE_SECONDS.
+    """
+    if connection.vendor == 'postgresql' and not queryset.query.has_filters():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'products'::regclass")
+            estimate = cursor.fetchone()[0]
+        if estimate >= settings.PRODUCT_COUNT_ESTIMATE_MIN:
+            return estimate, True
+
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0, False
+    digest = hashlib.md5(repr((sql, params)).encode()).hexdigest()
+    key = f"product-count:{CatalogChangeService.catalog_version()}:{digest}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.PRODUCT_COUNT_CACHE_SECONDS)
+    return count, False
+
+
+class CachedCountPaginator(Paginator):
+    """Django paginator taking its count from product_count instead of a COUNT(*) per page"""
+
+    estimated = False
+
+    @cached_property
+    def count(self):
+        count, self.estimated = product_count(self.object_list)
+        return count
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # An estimated count may fall short of the real last page
+            if self.estimated and int(number) >= 1:
+                return int(number)
+            raise
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination on (ordering field, id), with opaque next and previous cursors.
+
+    A page is read with a WHERE clause past the cursor's row and a LIMIT, so
+    it costs the same at any depth and no count is run. Pages follow the
+    ordering parameter; search results are paged in that order, not by
+    relevance.
+    """
+
+    cursor_query_param = 'cursor'
+    ordering_param = 'ordering'
+    orderings = ('id', 'created_at', 'name')
+
+    def __init__(self, page_size):
+        self.page_size = page_size
+
+    def get_ordering(self, request):
+        """(field, descending) from the first term of the ordering parameter, id by default"""
+        term = request.query_params.get(self.ordering_param, '').split(',')[0].strip()
+        field = term.lstrip('-')
+        if field not in self.orderings:
+            return 'id', False
+        return field, term.startswith('-')
+
+    def encode_cursor(self, product, previous=False):
+        value = getattr(product, self.field)
+        position = {'v': value.isoformat() if hasattr(value, 'isoformat') else value, 'id': product.id}
+        if previous:
+            position['p'] = 1
+        cursor = base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """(value, id, previous) of the cursor parameter, or None on the first page"""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return position['v'], int(position['id']), bool(position.get('p'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.field, descending = self.get_ordering(request)
+        position = self.decode_cursor(request)
+        previous = position is not None and position[2]
+        # Reading backwards from a previous cursor flips both the comparison and the order
+        backwards = descending != previous
+        order = ['id'] if self.field == 'id' else [self.field, 'id']
+        queryset = queryset.order_by(*(f"-{key}" if backwards else key for key in order))
+
+        if position is not None:
+            value, last_id, _ = position
+            lookup = 'lt' if backwards else 'gt'
+            after = Q(**{f"id__{lookup}": last_id})
+            if self.field != 'id':
+                after = Q(**{f"{self.field}__{lookup}": value}) | (Q(**{self.field: value}) & after)
+            queryset = queryset.filter(after)
+
+        products = list(queryset[:self.page_size + 1])
+        more = len(products) > self.page_size
+        products = products[:self.page_size]
+        if previous:
+            products.reverse()
+            self.has_next, self.has_previous = True, more
+        else:
+            self.has_next, self.has_previous = more, position is not None
+        self.page = products
+        return products
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.encode_cursor(self.page[-1]) if self.has_next and self.page else None,
+            'previous': self.encode_cursor(self.page[0], previous=True) if self.has_previous and self.page else None,
+            'results': data,
+        })
+
+
+class ProductPagination(PageNumberPagination):
+    """Page numbers with a cached or estimated count, or keyset pages with ?cursor= or ?pagination=cursor"""
+
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    django_paginator_class = CachedCountPaginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (KeysetPagination.cursor_query_param in request.query_params
+                or request.query_params.get('pagination') == 'cursor'):
+            self.keyset = KeysetPagination(self.get_page_size(request))
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
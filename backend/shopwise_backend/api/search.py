@@ -0,0 +1,286 @@
+import re
+import weakref
+from collections import defaultdict
+
+import numpy as np
+from django.db import connection
+from django.db.models import BooleanField, F, FloatField, Max, Q, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Products
+from .services.catalog_change_service import CatalogChangeService
+
+
+class PostgresProductSearch:
+    """Full-text search over a generated tsvector column with a GIN index.
+
+    search_vector weights the name above the description and is recomputed
+    by PostgreSQL whenever a product row is written, whoever writes it.
+    """
+
+    CONFIG = 'english'
+    TSQUERY = f"websearch_to_tsquery('{CONFIG}', %s)"
+
+    def ensure_index(self, cursor, rebuild=False):
+        # A generated column is filled for existing rows when it is added
+        cursor.execute(f"""
+            ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('{self.CONFIG}', coalesce(name, '')), 'A') ||
+                setweight(to_tsvector('{self.CONFIG}', coalesce(description, '')), 'B')
+            ) STORED
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS products_search_vector ON products USING GIN (search_vector)")
+        if rebuild:
+            cursor.execute("REINDEX INDEX products_search_vector")
+
+    def search(self, queryset, term):
+        return queryset.annotate(
+            search_rank=RawSQL(f"ts_rank(products.search_vector, {self.TSQUERY})", [term],
+                               output_field=FloatField())
+        ).filter(
+            RawSQL(f"products.search_vector @@ {self.TSQUERY}", [term], output_field=BooleanField())
+        )
+
+
+class SQLiteProductSearch:
+    """Full-text search through an FTS5 table kept in step with products by triggers.
+
+    Used for local development and tests. The table and its triggers are
+    created the first time a database is searched.
+    """
+
+    # bm25 weights of the name and description columns
+    RANK = "-bm25(products_fts, 10.0, 1.0)"
+
+    def __init__(self):
+        self.ready = set()
+
+    def ensure_index(self, cursor, rebuild=False):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+        created = cursor.fetchone() is None
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, description, content='products', content_rowid='id',
+                tokenize='porter unicode61'
+            )
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+                INSERT INTO products_fts (rowid, name, description)
+                VALUES (new.id, new.name, new.description);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+                INSERT INTO products_fts (products_fts, rowid, name, description)
+                VALUES ('delete', old.id, old.name, old.description);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description ON products BEGIN
+                INSERT INTO products_fts (products_fts, rowid, name, description)
+                VALUES ('delete', old.id, old.name, old.description);
+                INSERT INTO products_fts (rowid, name, description)
+                VALUES (new.id, new.name, new.description);
+            END
+        """)
+        if created or rebuild:
+            cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+    @staticmethod
+    def match_expression(term):
+        """Quote every word, so FTS5 operators in the search term are matched as text"""
+        return ' '.join('"' + word.replace('"', '""') + '"' for word in term.split())
+
+    def search(self, queryset, term):
+        database = connection.settings_dict['NAME']
+        if database not in self.ready:
+            with connection.cursor() as cursor:
+                self.ensure_index(cursor)
+            self.ready.add(database)
+
+        # Joined rather than a correlated subquery, so the MATCH runs once for all rows
+        return queryset.extra(
+            select={'search_rank': self.RANK},
+            tables=['products_fts'],
+            where=['products_fts.rowid = products.id', 'products_fts MATCH %s'],
+            params=[self.match_expression(term)],
+        )
+
+
+class IContainsProductSearch:
+    """Fallback for databases without a search index: substring match, no ranking"""
+
+    def ensure_index(self, cursor, rebuild=False):
+        pass
+
+    def search(self, queryset, term):
+        condition = Q()
+        for word in term.split():
+            condition &= Q(name__icontains=word) | Q(description__icontains=word)
+        return queryset.filter(condition).annotate(search_rank=RawSQL("0", [], output_field=FloatField()))
+
+
+SEARCH_BACKENDS = {
+    'postgresql': PostgresProductSearch(),
+    'sqlite': SQLiteProductSearch(),
+}
+
+
+def product_search():
+    """Search implementation for the database Django is connected to"""
+    return SEARCH_BACKENDS.get(connection.vendor) or IContainsProductSearch()
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """Filter products by the `search` query parameter through the full-text index, most relevant first"""
+
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        # Explicit ?ordering= from OrderingFilter still takes precedence
+        return product_search().search(queryset, term).order_by('-search_rank', 'id')
+
+
+# Words as pg_trgm splits them: runs of letters and digits
+WORD = re.compile(r'[^\W_]+')
+
+
+def trigrams(text):
+    """pg_trgm's trigrams of text: every lower-cased word padded with two spaces before and one after"""
+    grams = set()
+    for word in WORD.findall(text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """In-memory trigram index of product names, scored like pg_trgm's similarity().
+
+    Similarity is the number of trigrams shared by the term and a name over
+    the number in either. A lookup counts shared trigrams for every product
+    at once with a bincount over the term's posting lists.
+    """
+
+    def __init__(self, rows):
+        # rows are (product id, retailer id, name)
+        postings = defaultdict(list)
+        ids, retailers, sizes = [], [], []
+        for row, (product_id, retailer_id, name) in enumerate(rows):
+            grams = trigrams(name)
+            for gram in grams:
+                postings[gram].append(row)
+            ids.append(product_id)
+            retailers.append(retailer_id)
+            sizes.append(len(grams))
+        self.ids = np.array(ids, dtype=np.int64)
+        self.retailers = np.array(retailers, dtype=np.int64)
+        self.sizes = np.array(sizes, dtype=np.int32)
+        self.postings = {gram: np.array(members, dtype=np.int32) for gram, members in postings.items()}
+
+    def match(self, term, threshold, top_k):
+        """(product id, similarity) of the top_k products of each retailer at or above threshold, most similar first"""
+        grams = trigrams(term)
+        hits = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not hits:
+            return []
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.ids))
+        rows = np.flatnonzero(shared)
+        similarity = shared[rows] / (len(grams) + self.sizes[rows] - shared[rows])
+        keep = similarity >= threshold
+        rows, similarity = rows[keep], similarity[keep]
+
+        # Most similar first, then by id; a stable sort by retailer then numbers each retailer's matches
+        order = np.lexsort((self.ids[rows], -similarity))
+        retailers = self.retailers[rows[order]]
+        by_retailer = np.argsort(retailers, kind='stable')
+        grouped = retailers[by_retailer]
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[by_retailer] = np.arange(len(order)) - np.searchsorted(grouped, grouped)
+        top = order[rank < top_k]
+        return [(int(product_id), float(score)) for product_id, score in zip(self.ids[rows[top]], similarity[top])]
+
+
+class PostgresTrigramMatch:
+    """Fuzzy product name matching with pg_trgm over a GIN index on the name.
+
+    The % operator finds candidates through the index at the session's
+    pg_trgm.similarity_threshold, which is set to the threshold asked for
+    once per connection.
+    """
+
+    def __init__(self):
+        self.thresholds = weakref.WeakKeyDictionary()
+
+    def ensure_index(self, cursor, rebuild=False):
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute("CREATE INDEX IF NOT EXISTS products_name_trgm ON products USING GIN (name gin_trgm_ops)")
+        if rebuild:
+            cursor.execute("REINDEX INDEX products_name_trgm")
+
+    def match(self, queryset, term, threshold, top_k):
+        connection.ensure_connection()
+        if self.thresholds.get(connection.connection) != threshold:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, false)", [str(threshold)])
+            self.thresholds[connection.connection] = threshold
+
+        return list(
+            queryset.annotate(
+                similarity=RawSQL("similarity(products.name, %s)", [term], output_field=FloatField())
+            ).filter(
+                RawSQL("products.name %% %s", [term], output_field=BooleanField()),
+                similarity__gte=threshold,
+            ).annotate(
+                retailer_rank=Window(RowNumber(), partition_by=F('retailer_id'),
+                                     order_by=[F('similarity').desc(), F('id').asc()])
+            ).filter(retailer_rank__lte=top_k).order_by('-similarity', 'id')
+        )
+
+
+class TrigramIndexMatch:
+    """Fuzzy product name matching through a TrigramIndex, for databases without pg_trgm.
+
+    The index holds every product name in memory. It is rebuilt when the
+    catalog version or the highest product id has changed since it was
+    built. Deleted products drop out when the matches are read back.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.key = None
+
+    def ensure_index(self, cursor, rebuild=False):
+        if rebuild:
+            self.index = None
+
+    def match(self, queryset, term, threshold, top_k):
+        last_id = Products.objects.aggregate(last_id=Max('id'))['last_id']
+        key = (connection.settings_dict['NAME'], CatalogChangeService.catalog_version(), last_id)
+        if self.index is None or self.key != key:
+            self.index = TrigramIndex(Products.objects.values_list('id', 'retailer_id', 'name').iterator())
+            self.key = key
+
+        similarity = dict(self.index.match(term, threshold, top_k))
+        matches = list(queryset.filter(id__in=list(similarity)))
+        for product in matches:
+            product.similarity = similarity[product.id]
+        return sorted(matches, key=lambda product: (-product.similarity, product.id))
+
+
+TRIGRAM_MATCHERS = {
+    'postgresql': PostgresTrigramMatch(),
+}
+INDEX_TRIGRAM_MATCH = TrigramIndexMatch()
+
+
+def product_matcher():
+    """Fuzzy name matching for the database Django is connected to"""
+    return TRIGRAM_MATCHERS.get(connection.vendor, INDEX_TRIGRAM_MATCH)
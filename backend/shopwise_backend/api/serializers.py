@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Products, Categories, Retailers, Prices, Favourite, GroceryListItem, GroceryList
+from .models import Products, Categories, Retailers, Favourite, GroceryListItem, GroceryList
 from drf_spectacular.utils import extend_schema_serializer, OpenApiExample
 
 @extend_schema_serializer(
@@ -38,8 +38,8 @@ class ProductSerializer(serializers.ModelSerializer):
                  'retailer_name', 'current_price']
 
     def get_current_price(self, obj):
-        latest_price = Prices.objects.filter(product=obj).order_by('-created_at').first()
-        return latest_price.price if latest_price else None
+        # Annotated by Products.objects.with_latest_price() when the view used it
+        return getattr(obj, 'latest_price', obj.current_price)
 
 @extend_schema_serializer(
     examples=[
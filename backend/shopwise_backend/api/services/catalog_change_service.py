@@ -0,0 +1,99 @@
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+from django.views.decorators.cache import cache_page
+from ..models import CatalogChange, CatalogChangeWatermark
+from .product_group_service import ProductGroupService
+
+
+class CatalogChangeService:
+    """Read the catalog_changes feed the scraper appends to, after a seq watermark."""
+
+    VERSION_KEY = 'catalog_changes:version'
+    CHECKED_KEY = 'catalog_changes:checked'
+
+    @staticmethod
+    def read_changes(after, limit=1000):
+        """Return changes with seq above after, in seq order, and the watermark to read from next.
+
+        Sequence values are handed out before their transaction commits, so a
+        gap may still be filled by a slower scraper transaction. Reading stops
+        at a gap until the change after it is CATALOG_CHANGES_SETTLE_SECONDS
+        old; gaps left by rolled back transactions are then skipped.
+        """
+        settled_at = timezone.now() - timedelta(seconds=settings.CATALOG_CHANGES_SETTLE_SECONDS)
+        changes = []
+        watermark = after
+        for change in CatalogChange.objects.filter(seq__gt=after).order_by('seq')[:limit]:
+            if change.seq != watermark + 1 and change.created_at > settled_at:
+                break
+            changes.append(change)
+            watermark = change.seq
+        return changes, watermark
+
+    @staticmethod
+    def catalog_version():
+        """Seq of the latest change this process knows about, re-read every CATALOG_CHANGES_POLL_SECONDS."""
+        version = cache.get(CatalogChangeService.VERSION_KEY)
+        if version is not None and cache.get(CatalogChangeService.CHECKED_KEY):
+            return version
+
+        if version is None:
+            version = CatalogChange.objects.aggregate(latest=Max('seq'))['latest'] or 0
+        else:
+            while True:
+                changes, watermark = CatalogChangeService.read_changes(version)
+                if not changes:
+                    break
+                version = watermark
+
+        cache.set(CatalogChangeService.VERSION_KEY, version, None)
+        cache.set(CatalogChangeService.CHECKED_KEY, True, settings.CATALOG_CHANGES_POLL_SECONDS)
+        return version
+
+    @staticmethod
+    def invalidate_caches(changes):
+        """Move the catalog version past changes, retiring every page cached before them."""
+        latest = max(change.seq for change in changes)
+        version = cache.get(CatalogChangeService.VERSION_KEY) or 0
+        if latest > version:
+            cache.set(CatalogChangeService.VERSION_KEY, latest, None)
+
+    @staticmethod
+    def consume(consumer, handler, batch_size=1000):
+        """Pass changes after the consumer's watermark to handler, one batch at a time.
+
+        The watermark is saved after each batch the handler returns from, so
+        an interrupted run resumes with the batch that failed.
+        """
+        watermark, _ = CatalogChangeWatermark.objects.get_or_create(consumer=consumer)
+        consumed = 0
+        while True:
+            changes, seq = CatalogChangeService.read_changes(watermark.seq, batch_size)
+            if not changes:
+                return consumed
+            handler(changes)
+            watermark.seq = seq
+            watermark.save(update_fields=['seq', 'updated_at'])
+            consumed += len(changes)
+
+
+# Handlers the consume_catalog_changes command can run, by consumer name
+CONSUMERS = {
+    'cache': CatalogChangeService.invalidate_caches,
+    'groups': ProductGroupService.regroup_changes,
+}
+
+
+def catalog_cache_page(timeout):
+    """cache_page keyed by the catalog version, so pages cached before a catalog change are not served"""
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapped_view(request, *args, **kwargs):
+            key_prefix = f"catalog-{CatalogChangeService.catalog_version()}"
+            return cache_page(timeout, key_prefix=key_prefix)(view_func)(request, *args, **kwargs)
+        return wrapped_view
+    return decorator
@@ -0,0 +1,158 @@
+import re
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from ..models import CatalogChange, Products, ProductGroup
+
+# A pack size such as "410g", "2 L" or "6 x 330ml", with the unit it is normalized to
+SIZE = re.compile(
+    r'(?:(\d+)\s*x\s*)?(\d+(?:[.,]\d+)?)\s*(kg|g|ml|l|lt|ltr|litres?|liters?)(?![a-z])')
+UNITS = {
+    'kg': ('g', 1000), 'g': ('g', 1),
+    'l': ('ml', 1000), 'lt': ('ml', 1000), 'ltr': ('ml', 1000), 'litre': ('ml', 1000),
+    'litres': ('ml', 1000), 'liter': ('ml', 1000), 'liters': ('ml', 1000), 'ml': ('ml', 1),
+}
+WORD = re.compile(r'[a-z0-9]+')
+STOPWORDS = {'a', 'and', 'for', 'in', 'of', 'the', 'with'}
+
+
+def normalize_name(name):
+    """The (size, tokens) of a product name: its first pack size in g or ml, and its other words"""
+    text = name.lower().replace('&', ' and ')
+    size = ''
+    match = SIZE.search(text)
+    if match:
+        count, amount, unit = match.groups()
+        base_unit, factor = UNITS[unit]
+        size = f"{float(amount.replace(',', '.')) * factor:g}{base_unit}"
+        if count and int(count) > 1:
+            size = f"{count}x{size}"
+        text = text[:match.start()] + ' ' + text[match.end():]
+    return size, set(WORD.findall(text)) - STOPWORDS
+
+
+class BlockIndex:
+    """Grouped products of one block, indexed by name token.
+
+    The tokens a product shares with each candidate are counted from the
+    postings of its own tokens, so candidates are scored without comparing
+    token sets. Entries are ProductGroup rows, or anything with their
+    group_id, tokens and retailer_id.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.sizes = []
+        self.postings = defaultdict(list)
+        self.group_retailers = defaultdict(set)
+
+    def add(self, entry):
+        position = len(self.entries)
+        tokens = entry.tokens.split()
+        self.entries.append(entry)
+        self.sizes.append(len(tokens))
+        for token in tokens:
+            self.postings[token].append(position)
+        self.group_retailers[entry.group_id].add(entry.retailer_id)
+
+    def place(self, entry):
+        """Put entry in the group of its most similar product it may join, or a group of its own, and add it"""
+        tokens = entry.tokens.split()
+        shared = Counter()
+        for token in tokens:
+            shared.update(self.postings.get(token, ()))
+
+        entry.group_id, entry.score = entry.product_id, 1.0
+        threshold = settings.PRODUCT_GROUP_MIN_SIMILARITY
+        # Products sharing fewer tokens are below the threshold however many tokens they have
+        needed = threshold * len(tokens) - 1e-9
+        best = 0.0
+        for position in [position for position, count in shared.items() if count >= needed]:
+            count = shared[position]
+            score = count / (len(tokens) + self.sizes[position] - count)
+            if score < threshold or score <= best:
+                continue
+            candidate = self.entries[position]
+            if entry.retailer_id not in self.group_retailers[candidate.group_id]:
+                entry.group_id, entry.score = candidate.group_id, score
+                best = score
+        self.add(entry)
+
+
+class ProductGroupService:
+    """Link the same item at different retailers ahead of time, in product_groups.
+
+    Products are only compared with others in their block: the same category
+    and normalized pack size. Within it, a product joins the group of the
+    most similar product whose group has no product from its retailer yet,
+    if they are at least PRODUCT_GROUP_MIN_SIMILARITY alike (the share of
+    name words they have in common), and starts its own group otherwise.
+    """
+
+    @staticmethod
+    def entry(product_id, name, category_id, retailer_id):
+        size, tokens = normalize_name(name)
+        return ProductGroup(product_id=product_id, block=f"{category_id}|{size}",
+                            tokens=' '.join(sorted(tokens))[:500], retailer_id=retailer_id)
+
+    @staticmethod
+    def rebuild(batch_size=5000):
+        """Group every product from scratch.
+
+        Returns the number of products and groups, and the catalog change seq
+        the grouping is current up to; later changes are applied by
+        regroup_changes.
+        """
+        seq = CatalogChange.objects.aggregate(latest=Max('seq'))['latest'] or 0
+        blocks = defaultdict(BlockIndex)
+        entries = []
+        for row in Products.objects.values_list('id', 'name', 'category_id', 'retailer_id').order_by('id').iterator():
+            entry = ProductGroupService.entry(*row)
+            blocks[entry.block].place(entry)
+            entries.append(entry)
+
+        with transaction.atomic():
+            ProductGroup.objects.all().delete()
+            ProductGroup.objects.bulk_create(entries, batch_size=batch_size)
+        groups = sum(len(block.group_retailers) for block in blocks.values())
+        return len(entries), groups, seq
+
+    @staticmethod
+    def regroup(product_ids):
+        """Group the given products again, after they were added, renamed or deleted"""
+        product_ids = sorted(set(product_ids))
+        rows = (Products.objects.filter(id__in=product_ids)
+                .values_list('id', 'name', 'category_id', 'retailer_id').order_by('id'))
+        with transaction.atomic():
+            ProductGroupService._leave_groups(product_ids)
+            entries = [ProductGroupService.entry(*row) for row in rows]
+            # Each block is read once, with the products already grouped in it
+            blocks = defaultdict(BlockIndex)
+            grouped = (ProductGroup.objects.filter(block__in={entry.block for entry in entries})
+                       .values_list('block', 'group_id', 'tokens', 'retailer_id', named=True).order_by('product_id'))
+            for row in grouped.iterator():
+                blocks[row.block].add(row)
+            for entry in entries:
+                blocks[entry.block].place(entry)
+            ProductGroup.objects.bulk_create(entries)
+
+    @staticmethod
+    def _leave_groups(product_ids):
+        """Remove products from their groups; a group one was canonical for moves to its next product"""
+        leaving = dict(ProductGroup.objects.filter(product_id__in=product_ids).values_list('product_id', 'group_id'))
+        ProductGroup.objects.filter(product_id__in=product_ids).delete()
+        for product_id, group_id in leaving.items():
+            if product_id != group_id:
+                continue
+            successor = (ProductGroup.objects.filter(group_id=group_id).order_by('product_id')
+                         .values_list('product_id', flat=True).first())
+            if successor:
+                ProductGroup.objects.filter(group_id=group_id).update(group_id=successor)
+
+    @staticmethod
+    def regroup_changes(changes):
+        """Catalog change consumer: regroup products created or updated; price changes leave names alone"""
+        product_ids = {change.product_id for change in changes if change.change_kind != CatalogChange.PRICE}
+        if product_ids:
+            ProductGroupService.regroup(product_ids)
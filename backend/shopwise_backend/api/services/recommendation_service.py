@@ -52,7 +52,7 @@ class RecommendationService:
             return Products.objects.none()
 
         # Create feature vectors from product attributes
-        all_products = Products.objects.all()
+        all_products = Products.objects.select_related('category')
         
         # Combine text features
         product_texts = [
@@ -114,4 +114,4 @@ class RecommendationService:
         
         # Get top N recommendations
         recommended_ids = [p[0] for p in sorted_products[:limit]]
-        return Products.objects.filter(id__in=recommended_ids)
+        return Products.objects.for_serializer().filter(id__in=recommended_ids)
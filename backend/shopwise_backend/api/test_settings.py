@@ -1,4 +1,4 @@
-from api.models import Products, Categories, Retailers, Prices
+from api.models import Products, Categories, Retailers, Prices, CatalogChange, Favourite
 from accounts.models import User
 
 # Override managed settings for testing
@@ -6,4 +6,6 @@ Products._meta.managed = True
 Categories._meta.managed = True
 Retailers._meta.managed = True
 Prices._meta.managed = True
+CatalogChange._meta.managed = True
+Favourite._meta.managed = True
 User._meta.managed = True
\ No newline at end of file
@@ -1,8 +1,17 @@
-from django.test import TransactionTestCase
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import Products, Categories, Retailers
+from accounts.models import User
+from .models import Products, Categories, Retailers, Prices, Favourite, CatalogChange, CatalogChangeWatermark, ProductGroup
+from .services.catalog_change_service import CatalogChangeService
+from .services.product_group_service import ProductGroupService, normalize_name
+from .search import TrigramIndex
 from .test_settings import *
 from accounts.test_settings import *
 
@@ -148,8 +157,8 @@ class TestProductListViews(TransactionTestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_product_list_view_optimized_queries(self):
-        """Test optimized queries with select_related and prefetch_related."""
-        with self.assertNumQueries(3):
+        """Test optimized queries with select_related and the stored current price."""
+        with self.assertNumQueries(2):
             response = self.client.get(self.product_list_url)
             self.assertEqual(response.status_code, status.HTTP_200_OK)
 
@@ -161,3 +170,423 @@ class TestProductListViews(TransactionTestCase):
         response2 = self.client.get(self.product_list_url)
         self.assertEqual(response2.status_code, status.HTTP_200_OK)
         self.assertEqual(response1.content, response2.content)
+
+
+class TestProductQueryCounts(TransactionTestCase):
+    """Test suite for the number of queries product endpoints run."""
+
+    def setUp(self):
+        """Set up test data."""
+        cache.clear()
+        self.retailer = Retailers.objects.create(name="Test Retailer")
+        self.category = Categories.objects.create(name="Test Category")
+        for i in range(30):
+            Products.objects.create(
+                name=f"Test Product {i}", retailer=self.retailer, category=self.category,
+                current_price=float(i), current_price_at=timezone.now()
+            )
+        self.client = APIClient()
+        # The catalog version is read once per poll interval, not per request
+        CatalogChangeService.catalog_version()
+
+    def test_product_list_query_count_independent_of_page_size(self):
+        """Test that a page costs the same queries however many products it holds."""
+        for page_size in (5, 25):
+            # Start each page from an uncached count
+            cache.clear()
+            CatalogChangeService.catalog_version()
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('product-list'), {'page_size': page_size})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), page_size)
+            self.assertEqual(response.data['results'][0]['current_price'], 0.0)
+
+    def test_product_detail_query_count(self):
+        """Test that a product is read with its retailer, category and price in one query."""
+        product = Products.objects.first()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('product-detail', kwargs={'pk': product.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['retailer_name'], self.retailer.name)
+
+    def test_latest_price_used_without_stored_price(self):
+        """Test that products the scraper has not set a current price on use their newest price."""
+        product = Products.objects.create(
+            name="Unpriced Product", retailer=self.retailer, category=self.category
+        )
+        Prices.objects.create(product=product, price=5.0)
+        Prices.objects.create(product=product, price=7.5)
+
+        response = self.client.get(reverse('product-detail', kwargs={'pk': product.pk}))
+
+        self.assertEqual(response.data['current_price'], 7.5)
+
+    def test_product_compare_query_count(self):
+        """Test that comparing products runs the same queries however many match."""
+        # The first comparison builds the in-memory trigram index used on SQLite
+        self.client.get(reverse('product-compare'), {'search': 'Test Product'})
+        # One query checks the index is current and one reads the matches
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('product-compare'), {'search': 'Test Product'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data[self.retailer.name]), settings.COMPARE_TOP_K)
+
+    def test_product_recommendation_query_count(self):
+        """Test that recommendations run the same queries however many favourites there are."""
+        users = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='TestPass123!')
+            for i in range(3)
+        ]
+        products = list(Products.objects.order_by('id'))
+        self.client.force_authenticate(users[0])
+
+        for favourites in (2, 8):
+            Favourite.objects.all().delete()
+            for i, product in enumerate(products[:favourites]):
+                Favourite.objects.create(user=users[i % 3], product=product)
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('product-recommendation'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TestCatalogChanges(TransactionTestCase):
+    """Test suite for reading the catalog change feed."""
+
+    def setUp(self):
+        """Set up test data."""
+        cache.clear()
+        retailer = Retailers.objects.create(name="Test Retailer")
+        category = Categories.objects.create(name="Test Category")
+        self.product = Products.objects.create(
+            name="Test Product", retailer=retailer, category=category
+        )
+
+    def _change(self, seq, age_seconds=0, kind=CatalogChange.PRICE):
+        """Helper method to append a change with the given seq and age."""
+        change = CatalogChange.objects.create(
+            seq=seq, product=self.product, change_kind=kind, old_price=1.0, new_price=2.0
+        )
+        created_at = timezone.now() - timedelta(seconds=age_seconds)
+        CatalogChange.objects.filter(seq=seq).update(created_at=created_at)
+        return change
+
+    def test_read_changes_after_watermark(self):
+        """Test reading contiguous changes after a watermark."""
+        for seq in (1, 2, 3):
+            self._change(seq)
+
+        changes, watermark = CatalogChangeService.read_changes(1)
+
+        self.assertEqual([change.seq for change in changes], [2, 3])
+        self.assertEqual(watermark, 3)
+
+    def test_read_changes_waits_at_recent_gap(self):
+        """Test that a gap which may still be committing stops the read."""
+        self._change(1)
+        self._change(3)
+
+        changes, watermark = CatalogChangeService.read_changes(0)
+
+        self.assertEqual([change.seq for change in changes], [1])
+        self.assertEqual(watermark, 1)
+
+    def test_read_changes_skips_settled_gap(self):
+        """Test that an old gap is treated as a rolled back transaction."""
+        self._change(1, age_seconds=3600)
+        self._change(3, age_seconds=3600)
+
+        changes, watermark = CatalogChangeService.read_changes(0)
+
+        self.assertEqual([change.seq for change in changes], [1, 3])
+        self.assertEqual(watermark, 3)
+
+    def test_consume_advances_watermark(self):
+        """Test that each consumer only sees changes once."""
+        self._change(1)
+        self._change(2)
+        seen = []
+
+        self.assertEqual(CatalogChangeService.consume('test', seen.extend, batch_size=1), 2)
+        self._change(3)
+        self.assertEqual(CatalogChangeService.consume('test', seen.extend), 1)
+
+        self.assertEqual([change.seq for change in seen], [1, 2, 3])
+        self.assertEqual(CatalogChangeWatermark.objects.get(consumer='test').seq, 3)
+
+    def test_product_list_cache_invalidated_by_change(self):
+        """Test that a catalog change retires cached product list pages."""
+        product_list_url = reverse('product-list')
+        self.client.get(product_list_url)
+        self.product.name = "Renamed Product"
+        self.product.save()
+
+        CatalogChangeService.invalidate_caches([self._change(1, kind=CatalogChange.UPDATED)])
+        response = self.client.get(product_list_url)
+
+        self.assertContains(response, "Renamed Product")
+
+
+class TestProductSearch(TransactionTestCase):
+    """Test suite for full-text product search."""
+
+    def setUp(self):
+        """Set up test data."""
+        cache.clear()
+        self.retailer = Retailers.objects.create(name="Test Retailer")
+        self.other_retailer = Retailers.objects.create(name="Other Retailer")
+        self.category = Categories.objects.create(name="Test Category")
+        self.described = Products.objects.create(
+            name="Farm Butter", description="Churned from fresh milk",
+            retailer=self.retailer, category=self.category
+        )
+        self.named = Products.objects.create(
+            name="Full Cream Milk", description="Fresh from the farm",
+            retailer=self.retailer, category=self.category
+        )
+        self.other = Products.objects.create(
+            name="Low Fat Milk", description="Fresh from the farm",
+            retailer=self.other_retailer, category=self.category
+        )
+        self.client = APIClient()
+
+    def _search(self, term, **params):
+        response = self.client.get(reverse('product-list'), {'search': term, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [product['id'] for product in response.data['results']]
+
+    def test_search_ranks_name_matches_first(self):
+        """Test that products named after the term come before those only describing it."""
+        results = self._search('milk')
+        self.assertEqual(results[-1], self.described.id)
+        self.assertCountEqual(results[:2], [self.named.id, self.other.id])
+
+    def test_search_matches_word_forms(self):
+        """Test that the search matches other forms of a word and needs every word."""
+        self.assertEqual(self._search('creamy milks'), [])
+        self.assertEqual(self._search('cream milks'), [self.named.id])
+
+    def test_search_combined_with_filter(self):
+        """Test that search results are filtered by retailer."""
+        self.assertEqual(self._search('milk', retailer=self.other_retailer.id), [self.other.id])
+
+    def test_search_index_follows_product_changes(self):
+        """Test that renamed and deleted products are found under their current name only."""
+        self._search('milk')
+        self.named.name = "Double Cream"
+        self.named.save()
+        # Deleted as the scraper would, outside the ORM's cascade
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM products WHERE id = %s", [self.other.id])
+        cache.clear()
+
+        self.assertEqual(self._search('milk'), [self.described.id])
+        self.assertEqual(self._search('double'), [self.named.id])
+
+    def test_search_treats_operators_as_text(self):
+        """Test that search syntax in the term neither errors nor widens the match."""
+        self.assertEqual(self._search('milk" OR "butter'), [])
+        self.assertEqual(self._search('"farm butter"'), [self.described.id])
+
+
+class TestProductCompare(TransactionTestCase):
+    """Test suite for trigram matching in product comparison."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.retailer = Retailers.objects.create(name="Test Retailer")
+        self.other_retailer = Retailers.objects.create(name="Other Retailer")
+        self.category = Categories.objects.create(name="Test Category")
+        self.cola = Products.objects.create(
+            name="Coca-Cola 2 L", retailer=self.retailer, category=self.category
+        )
+        self.cola_can = Products.objects.create(
+            name="Coca-Cola Can 330ml", retailer=self.retailer, category=self.category
+        )
+        self.other_cola = Products.objects.create(
+            name="Coca Cola Original 2L", retailer=self.other_retailer, category=self.category
+        )
+        Products.objects.create(name="Fanta Orange 2 L", retailer=self.retailer, category=self.category)
+        self.client = APIClient()
+
+    def _compare(self, term):
+        response = self.client.get(reverse('product-compare'), {'search': term})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {retailer: [product['id'] for product in products] for retailer, products in response.data.items()}
+
+    def test_similarity_matches_pg_trgm(self):
+        """Test that the in-memory index scores names like pg_trgm's similarity()."""
+        index = TrigramIndex([(1, 1, 'two words'), (2, 1, 'word'), (3, 1, 'sentence')])
+        self.assertEqual(
+            [(product_id, round(score, 4)) for product_id, score in index.match('word', 0.3, 5)],
+            [(2, 1.0), (1, 0.3636)]
+        )
+
+    def test_compare_finds_near_spellings(self):
+        """Test that differently punctuated and spaced names match, most similar first."""
+        self.assertEqual(self._compare('coca cola 2l'), {
+            self.retailer.name: [self.cola.id, self.cola_can.id],
+            self.other_retailer.name: [self.other_cola.id],
+        })
+
+    @override_settings(COMPARE_TOP_K=1)
+    def test_compare_limits_matches_per_retailer(self):
+        """Test that at most COMPARE_TOP_K products are returned for each retailer."""
+        self.assertEqual(self._compare('coca cola 2l'), {
+            self.retailer.name: [self.cola.id],
+            self.other_retailer.name: [self.other_cola.id],
+        })
+
+    @override_settings(COMPARE_SIMILARITY_THRESHOLD=0.9)
+    def test_compare_drops_matches_below_threshold(self):
+        """Test that names less similar than the threshold are left out."""
+        self.assertEqual(self._compare('coca-cola 2 l'), {self.retailer.name: [self.cola.id]})
+        response = self.client.get(reverse('product-compare'), {'search': 'coca cola 2l'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_compare_sees_new_products(self):
+        """Test that products added after the index was built are matched."""
+        self._compare('coca cola 2l')
+        added = Products.objects.create(
+            name="Coca-Cola 2L", retailer=self.other_retailer, category=self.category
+        )
+        self.assertEqual(self._compare('coca cola 2l')[self.other_retailer.name][0], added.id)
+
+
+class TestProductGroups(TransactionTestCase):
+    """Test suite for cross-retailer product groups."""
+
+    def setUp(self):
+        """Set up test data."""
+        self.checkers = Retailers.objects.create(name="Checkers")
+        self.shoprite = Retailers.objects.create(name="Shoprite")
+        self.drinks = Categories.objects.create(name="Drinks")
+        self.cola = self._product("Coca-Cola 2 L", self.checkers, 25.0)
+        self.other_cola = self._product("Coca Cola Original 2L", self.shoprite, 22.0)
+        self.cola_can = self._product("Coca-Cola Can 330ml", self.shoprite, 9.0)
+        self.client = APIClient()
+
+    def _product(self, name, retailer, price):
+        return Products.objects.create(
+            name=name, retailer=retailer, category=self.drinks,
+            current_price=price, current_price_at=timezone.now()
+        )
+
+    def _change(self, product, kind):
+        return CatalogChange.objects.create(product=product, change_kind=kind)
+
+    def _group(self, product):
+        return ProductGroup.objects.get(product=product).group_id
+
+    def test_normalize_name(self):
+        """Test that pack sizes are normalized and split from the name's words."""
+        self.assertEqual(normalize_name("Coca-Cola 2 L"), ('2000ml', {'coca', 'cola'}))
+        self.assertEqual(normalize_name("Castle Lager 6 x 340ml"), ('6x340ml', {'castle', 'lager'}))
+        self.assertEqual(normalize_name("Bread & Butter 1,5kg"), ('1500g', {'bread', 'butter'}))
+
+    def test_rebuild_groups_same_item_across_retailers(self):
+        """Test that the same item and size is grouped across retailers, other sizes are not."""
+        products, groups, _ = ProductGroupService.rebuild()
+
+        self.assertEqual((products, groups), (3, 2))
+        self.assertEqual(self._group(self.cola), self.cola.id)
+        self.assertEqual(self._group(self.other_cola), self.cola.id)
+        self.assertEqual(self._group(self.cola_can), self.cola_can.id)
+
+    def test_group_holds_one_product_per_retailer(self):
+        """Test that a second product from the same retailer starts its own group."""
+        duplicate = self._product("Coca-Cola 2L", self.checkers, 24.0)
+        ProductGroupService.rebuild()
+        self.assertEqual(self._group(duplicate), duplicate.id)
+
+    def test_group_compare_returns_price_table_in_one_query(self):
+        """Test that the group's products are listed by retailer, cheapest first, in one query."""
+        ProductGroupService.rebuild()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('product-group-compare', kwargs={'pk': self.cola.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data), [self.shoprite.name, self.checkers.name])
+        self.assertEqual(response.data[self.shoprite.name][0]['id'], self.other_cola.id)
+
+    def test_group_compare_ungrouped_product(self):
+        """Test that a product the job has not grouped yet is not found."""
+        response = self.client.get(reverse('product-group-compare', kwargs={'pk': self.cola.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_regroup_changes_only_touches_changed_products(self):
+        """Test that created and renamed products are regrouped from the catalog change feed."""
+        ProductGroupService.rebuild()
+        added = self._product("Coca Cola Can 330 ml", self.checkers, 10.0)
+        self.cola.name = "Sprite 2 L"
+        self.cola.save()
+
+        ProductGroupService.regroup_changes([
+            self._change(added, CatalogChange.CREATED),
+            self._change(self.cola, CatalogChange.UPDATED),
+            self._change(self.other_cola, CatalogChange.PRICE),
+        ])
+
+        self.assertEqual(self._group(added), self.cola_can.id)
+        self.assertEqual(self._group(self.cola), self.cola.id)
+        # The renamed product's group moved to its remaining product
+        self.assertEqual(self._group(self.other_cola), self.other_cola.id)
+
+
+class TestProductPagination(TransactionTestCase):
+    """Test suite for product list pagination."""
+
+    def setUp(self):
+        """Set up test data."""
+        cache.clear()
+        retailer = Retailers.objects.create(name="Test Retailer")
+        category = Categories.objects.create(name="Test Category")
+        # Repeated names, so pages must be broken within equal values by id
+        for i in range(23):
+            Products.objects.create(name=f"Product {i % 5}", retailer=retailer, category=category)
+        self.client = APIClient()
+        CatalogChangeService.catalog_version()
+
+    def _walk(self, url, params):
+        """Follow next links from the first page, returning each page's product ids"""
+        pages = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([product['id'] for product in response.data['results']])
+            if not response.data['next']:
+                return pages, response
+            with self.assertNumQueries(1):
+                response = self.client.get(response.data['next'])
+
+    def test_page_count_cached_per_filter(self):
+        """Test that the count is run once for the pages of the same filters."""
+        self.client.get(reverse('product-list'), {'page': 1})
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('product-list'), {'page': 2})
+        self.assertEqual(response.data['count'], 23)
+
+    def test_cursor_pages_cover_catalog_in_order(self):
+        """Test that cursor pages return every product once, in (ordering field, id) order."""
+        for ordering in ('name', '-name', '-id'):
+            pages, _ = self._walk(reverse('product-list'), {'pagination': 'cursor', 'ordering': ordering, 'page_size': 4})
+            expected = list(Products.objects.order_by(ordering, '-id' if ordering.startswith('-') else 'id')
+                            .values_list('id', flat=True))
+            self.assertEqual([product_id for page in pages for product_id in page], expected)
+            self.assertEqual(len(pages), 6)
+
+    def test_cursor_previous_page(self):
+        """Test that the previous link of a page returns the page before it."""
+        url = reverse('product-list')
+        first = self.client.get(url, {'pagination': 'cursor', 'ordering': 'name', 'page_size': 4})
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+
+        self.assertEqual(back.data['results'], first.data['results'])
+        self.assertIsNone(back.data['previous'])
+        self.assertEqual(back.data['next'], first.data['next'])
+
+    def test_invalid_cursor(self):
+        """Test that a cursor that does not decode is not found."""
+        response = self.client.get(reverse('product-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
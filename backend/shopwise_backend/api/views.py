@@ -1,21 +1,19 @@
 from rest_framework import generics, status
 from rest_framework import filters as drf_filters
-from rest_framework.pagination import PageNumberPagination
 from django_filters import rest_framework as filters
 from .serializers import ProductSerializer, RetailerSerializer, CategorySerializer, FavouriteSerializer, GroceryListSerializer
-from .models import Products, Categories, Retailers, Favourite, GroceryList, GroceryListItem
+from .models import Products, Categories, Retailers, Favourite, GroceryList, GroceryListItem, ProductGroup
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiTypes, OpenApiResponse, OpenApiExample
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
+from django.conf import settings
+from django.db.models import F, Subquery
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from .services.recommendation_service import RecommendationService
-
-class ProductPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+from .services.catalog_change_service import catalog_cache_page
+from .search import ProductSearchFilter, product_matcher
+from .pagination import ProductPagination
 
 class ProductFilter(filters.FilterSet):
     retailer = filters.ModelChoiceFilter(queryset=Retailers.objects.all())
@@ -30,7 +28,7 @@ class ProductFilter(filters.FilterSet):
     parameters=[
         OpenApiParameter(
             name='search',
-            description='Search in product name and description',
+            description='Full-text search in product name and description, most relevant first',
             required=False,
             type=str
         ),
@@ -57,26 +55,35 @@ class ProductFilter(filters.FilterSet):
             description='Number of results per page',
             required=False,
             type=OpenApiTypes.INT
+        ),
+        OpenApiParameter(
+            name='pagination',
+            description='Set to "cursor" to page with next/previous cursors instead of page numbers',
+            required=False,
+            type=str
+        ),
+        OpenApiParameter(
+            name='cursor',
+            description='Cursor from the next or previous link of a cursor-paginated page',
+            required=False,
+            type=str
         )
     ],
     responses=ProductSerializer(many=True)
 )
-@method_decorator(cache_page(60*15), name='dispatch')
+@method_decorator(catalog_cache_page(60*15), name='dispatch')
 class ProductListView(generics.ListAPIView):
     queryset = (
-        Products.objects.select_related('retailer', 'category')
-        .prefetch_related('prices')
-        .all()
-        .order_by('id')  
+        Products.objects.for_serializer()
+        .order_by('id')
     )
     serializer_class = ProductSerializer
     filterset_class = ProductFilter
     filter_backends = (
         filters.DjangoFilterBackend,
-        drf_filters.SearchFilter,
+        ProductSearchFilter,
         drf_filters.OrderingFilter
     )
-    search_fields = ['name', 'description']
     ordering_fields = ['created_at', 'name', 'id'] 
     pagination_class = ProductPagination
     
@@ -102,7 +109,7 @@ class RetailerListView(generics.ListAPIView):
     responses=ProductSerializer
 )
 class ProductDetailView(generics.RetrieveAPIView):
-    queryset = Products.objects.all()
+    queryset = Products.objects.for_serializer()
     serializer_class = ProductSerializer
 
 @extend_schema(
@@ -127,7 +134,7 @@ class RetailerDetailView(generics.RetrieveAPIView):
     parameters=[
         OpenApiParameter(
             name='search',
-            description='Product name to search and compare (case-insensitive)',
+            description='Product name to compare, matched by trigram similarity so near spellings are found',
             required=True,
             type=str,
             location=OpenApiParameter.QUERY
@@ -148,13 +155,13 @@ class ProductsCompareView(generics.GenericAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Search products case-insensitively
-        similar_products = (
-            Products.objects.filter(name__icontains=search_term)
-            .select_related('retailer', 'category') 
+        # Closest names first, at most COMPARE_TOP_K per retailer
+        similar_products = product_matcher().match(
+            Products.objects.for_serializer(), search_term,
+            settings.COMPARE_SIMILARITY_THRESHOLD, settings.COMPARE_TOP_K
         )
 
-        if not similar_products.exists():
+        if not similar_products:
             return Response(
                 {"message": "No products found matching your search"}, 
                 status=status.HTTP_404_NOT_FOUND
@@ -162,6 +169,49 @@ class ProductsCompareView(generics.GenericAPIView):
 
         comparison = {}
         for product in similar_products:
+            retailer_name = product.retailer.name
+            if retailer_name not in comparison:
+                comparison[retailer_name] = []
+            comparison[retailer_name].append(
+                dict(ProductSerializer(product).data, similarity=round(product.similarity, 3))
+            )
+
+        return Response(comparison, status=status.HTTP_200_OK)
+
+@extend_schema(
+    description='Compare prices of a product with the same item at other retailers, as grouped by the group_products job',
+    parameters=[
+        OpenApiParameter(
+            name='pk',
+            location=OpenApiParameter.PATH,
+            description='Product ID',
+            required=True,
+            type=OpenApiTypes.INT
+        ),
+    ],
+    responses=ProductSerializer(many=True)
+)
+class ProductGroupCompareView(generics.GenericAPIView):
+    queryset = Products.objects.all()
+    serializer_class = ProductSerializer
+
+    def get(self, request, pk):
+        # The product's group and its members, cheapest first, in one query through the group_id index
+        group_id = ProductGroup.objects.filter(product_id=pk).values('group_id')
+        group_products = list(
+            Products.objects.for_serializer()
+            .filter(group__group_id=Subquery(group_id))
+            .order_by(F('latest_price').asc(nulls_last=True), 'id')
+        )
+
+        if not group_products:
+            return Response(
+                {"error": "Product not found or not grouped yet"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        comparison = {}
+        for product in group_products:
             retailer_name = product.retailer.name
             if retailer_name not in comparison:
                 comparison[retailer_name] = []
@@ -0,0 +1,80 @@
+"""
+Latency and recall of product comparison with trigram matching against icontains.
+
+Loads the synthetic catalog of benchmarks.search_latency and times
+api/products/compare/'s lookup for the substring filter it used before and
+for product_matcher(). Terms are written the way shoppers type them, so the
+match counts also show which spellings the substring filter misses. On SQLite
+the in-memory trigram index is built once before timing; PostgreSQL needs the
+pg_trgm extension.
+
+Usage (from the backend/shopwise_backend directory):
+    python -m benchmarks.compare_latency --products 200000
+    python -m benchmarks.compare_latency --products 200000 --dsn "dbname=shopwise host=localhost user=postgres"
+"""
+import argparse
+import os
+import statistics
+import time
+
+from benchmarks.search_latency import SCHEMA, configure, load_catalog
+
+QUERIES = ['peanut butter 410g', 'Glenryck Pilchards', 'glenryk pilchards 410g', 'peanutbutter', 'Black-Cat smooth peanut butter',
+           'Lucky Star pilchards in tomato', 'avocado']
+
+
+def time_lookup(lookup, repeat):
+    """Median milliseconds of lookup() and the number of products it returned"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        products = lookup()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), len(products)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--dsn', help='libpq connection string of a PostgreSQL database to use instead of SQLite')
+    args = parser.parse_args()
+
+    configure(args.dsn)
+    from django.conf import settings
+    from django.db import connection
+    from api.models import Products
+    from api.search import product_matcher
+
+    try:
+        load_catalog(args.products)
+        matcher = product_matcher()
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            matcher.ensure_index(cursor)
+        matcher.match(Products.objects.for_serializer(), 'warm up', 1.0, 1)
+        print(f"{args.products} products on {connection.vendor}, trigram index ready in "
+              f"{time.perf_counter() - started:.1f}s")
+
+        for term in QUERIES:
+            scan_ms, scan_total = time_lookup(
+                lambda: list(Products.objects.for_serializer().filter(name__icontains=term)), args.repeat
+            )
+            trigram_ms, trigram_total = time_lookup(
+                lambda: matcher.match(Products.objects.for_serializer(), term,
+                                      settings.COMPARE_SIMILARITY_THRESHOLD, settings.COMPARE_TOP_K),
+                args.repeat
+            )
+            print(f"{term!r:>34}: icontains {scan_ms:8.1f}ms ({scan_total:6d} products), "
+                  f"trigram {trigram_ms:8.1f}ms ({trigram_total:3d} products)")
+    finally:
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        else:
+            connection.close()
+            os.remove(connection.settings_dict['NAME'])
+
+
+if __name__ == '__main__':
+    main()
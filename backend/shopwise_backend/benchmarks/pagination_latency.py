@@ -0,0 +1,97 @@
+"""
+Latency of deep product list pages with OFFSET against keyset cursors.
+
+Loads the synthetic catalog of benchmarks.search_latency and times
+ProductPagination for page N of api/products/?ordering=name: by page number
+with the count run every time (as before), by page number with the count
+cached, and by a cursor positioned at the same row. The cursor of each page
+is read from the database before timing, as a client following next links
+would already hold it.
+
+Usage (from the backend/shopwise_backend directory):
+    python -m benchmarks.pagination_latency --products 200000
+    python -m benchmarks.pagination_latency --products 200000 --dsn "dbname=shopwise host=localhost user=postgres"
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import time
+
+from benchmarks.search_latency import SCHEMA, configure, load_catalog
+
+PAGES = [1, 100, 1000, 10000]
+PAGE_SIZE = 20
+
+
+def time_page(paginate, repeat, before=None):
+    """Median milliseconds of paginate(), calling before() untimed ahead of each run"""
+    timings = []
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        paginate()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--dsn', help='libpq connection string of a PostgreSQL database to use instead of SQLite')
+    args = parser.parse_args()
+
+    configure(args.dsn)
+    from django.core.cache import cache
+    from django.db import connection
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from api.models import Products
+    from api.pagination import ProductPagination
+
+    factory = APIRequestFactory()
+
+    def paginate(params):
+        request = Request(factory.get('/api/products/', params, HTTP_HOST='localhost'))
+        return ProductPagination().paginate_queryset(Products.objects.for_serializer().order_by('name', 'id'), request)
+
+    def cursor_at(position):
+        """Cursor of the row just before position in (name, id) order"""
+        name, product_id = Products.objects.order_by('name', 'id').values_list('name', 'id')[position - 1]
+        return base64.urlsafe_b64encode(json.dumps({'v': name, 'id': product_id}).encode()).decode()
+
+    try:
+        load_catalog(args.products)
+        # The index the scraper creates for name ordering, and fresh planner statistics
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE INDEX products_name_id ON products (name, id)")
+            if connection.vendor == 'postgresql':
+                cursor.execute("ANALYZE products")
+        print(f"{args.products} products on {connection.vendor}, {PAGE_SIZE} per page")
+
+        for page in PAGES:
+            if (page - 1) * PAGE_SIZE >= args.products:
+                break
+            params = {'ordering': 'name', 'page': page, 'page_size': PAGE_SIZE}
+            uncached_ms = time_page(lambda: paginate(params), args.repeat, before=cache.clear)
+            cached_ms = time_page(lambda: paginate(params), args.repeat)
+            cursor = {'ordering': 'name', 'page_size': PAGE_SIZE, 'pagination': 'cursor'}
+            if page > 1:
+                cursor['cursor'] = cursor_at((page - 1) * PAGE_SIZE)
+            cursor_ms = time_page(lambda: paginate(cursor), args.repeat)
+            print(f"page {page:>6}: offset {uncached_ms:8.1f}ms, offset with cached count {cached_ms:8.1f}ms, "
+                  f"cursor {cursor_ms:8.1f}ms")
+    finally:
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        else:
+            connection.close()
+            os.remove(connection.settings_dict['NAME'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Latency of product search with the full-text index against icontains scans.
+
+Loads a synthetic catalog into a scratch database and times the two queries a
+page of api/products/?search= runs, the count and the first page, for the
+substring filter DRF's SearchFilter applied and for ProductSearchFilter. The
+catalog goes into a temporary SQLite file, or with --dsn into a scratch schema
+of a PostgreSQL database that is dropped afterwards.
+
+Usage (from the backend/shopwise_backend directory):
+    python -m benchmarks.search_latency --products 200000
+    python -m benchmarks.search_latency --products 200000 --dsn "dbname=shopwise host=localhost user=postgres"
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shopwise_backend.settings')
+
+SCHEMA = 'shopwise_bench'
+
+BRANDS = ['Clover', 'Albany', 'Koo', 'Jungle', 'Tastic', 'Lucky Star', 'Ouma', 'Black Cat', 'Sasko',
+          'Fattis', 'Rhodes', 'Nestle', 'Simba', 'Willards', 'Huletts', 'Selati', 'Spekko', 'Iwisa',
+          'Ace', 'Purity', 'Glenryck', 'Bokomo', 'Lancewood', 'Parmalat', 'Douglasdale', 'Nola']
+PRODUCTS = ['milk', 'bread', 'rice', 'oats', 'beans', 'pilchards', 'rusks', 'peanut butter', 'pasta',
+            'maize meal', 'sugar', 'cheese', 'yoghurt', 'butter', 'chips', 'cereal', 'tea', 'coffee',
+            'mayonnaise', 'juice', 'flour', 'eggs', 'cream', 'custard', 'jam', 'soup', 'biscuits']
+VARIANTS = ['full cream', 'low fat', 'original', 'wholewheat', 'white', 'brown', 'long grain', 'crunchy',
+            'smooth', 'salted', 'unsalted', 'tomato', 'chutney', 'mild', 'strong', 'organic', 'family pack']
+SIZES = ['100g', '250g', '410g', '500g', '1kg', '2kg', '5kg', '1l', '2l', '6 x 330ml']
+WORDS = ['fresh', 'quality', 'local', 'farm', 'selected', 'ingredients', 'natural', 'taste', 'family',
+         'breakfast', 'lunch', 'recipe', 'pantry', 'value', 'store', 'cool', 'dry', 'place', 'rich',
+         'source', 'fibre', 'protein', 'energy', 'classic', 'favourite', 'since', 'traditional']
+
+# Rare brand, common product, two-word phrase, term in descriptions only, no matches
+QUERIES = ['glenryck', 'milk', 'peanut butter', 'pantry', 'nola chutney', 'avocado']
+
+
+def configure(dsn):
+    from django.conf import settings
+    if dsn:
+        from psycopg2.extensions import parse_dsn
+        params = parse_dsn(dsn)
+        settings.DATABASES['default'] = {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': params.get('dbname', ''),
+            'USER': params.get('user', ''),
+            'PASSWORD': params.get('password', ''),
+            'HOST': params.get('host', ''),
+            'PORT': params.get('port', ''),
+            'OPTIONS': {'options': f'-csearch_path={SCHEMA}'},
+        }
+    else:
+        settings.DATABASES['default'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(tempfile.mkdtemp(), 'search_bench.sqlite3'),
+        }
+    django.setup()
+
+
+def load_catalog(count, seed=1):
+    from django.db import connection
+    from api.models import CatalogChange, Categories, Prices, Products, Retailers
+    from api.search import product_search
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    with connection.schema_editor() as editor:
+        for model in (Categories, Retailers, Products, Prices, CatalogChange):
+            editor.create_model(model)
+
+    rng = random.Random(seed)
+    categories = Categories.objects.bulk_create(Categories(name=name) for name in ('Food', 'Drinks', 'Pantry'))
+    retailers = Retailers.objects.bulk_create(Retailers(name=name) for name in ('Checkers', 'Woolworths', 'Pick n Pay'))
+    for start in range(0, count, 5000):
+        Products.objects.bulk_create(
+            Products(
+                name=f"{rng.choice(BRANDS)} {rng.choice(VARIANTS)} {rng.choice(PRODUCTS)} {rng.choice(SIZES)}",
+                description=' '.join(rng.choices(WORDS, k=12)),
+                image_url='', product_url=f"https://example.com/p/{start + i}",
+                category=rng.choice(categories), retailer=rng.choice(retailers),
+                current_price=round(rng.uniform(5, 200), 2),
+            )
+            for i in range(min(5000, count - start))
+        )
+
+    started = time.perf_counter()
+    with connection.cursor() as cursor:
+        product_search().ensure_index(cursor)
+    return time.perf_counter() - started
+
+
+def time_query(queryset, repeat):
+    """Median milliseconds to count the matches and fetch the first page of 10"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        total = queryset.count()
+        list(queryset[:10])
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--dsn', help='libpq connection string of a PostgreSQL database to use instead of SQLite')
+    args = parser.parse_args()
+
+    configure(args.dsn)
+    from django.db import connection
+    from django.db.models import Q
+    from api.models import Products
+    from api.search import product_search
+
+    try:
+        index_seconds = load_catalog(args.products)
+        print(f"{args.products} products on {connection.vendor}, search index built in {index_seconds:.1f}s")
+        for term in QUERIES:
+            scan = Products.objects.for_serializer().filter(
+                Q(name__icontains=term) | Q(description__icontains=term)
+            ).order_by('id')
+            indexed = product_search().search(Products.objects.for_serializer(), term).order_by('-search_rank', 'id')
+            scan_ms, scan_total = time_query(scan, args.repeat)
+            indexed_ms, indexed_total = time_query(indexed, args.repeat)
+            print(f"{term!r:>16}: icontains {scan_ms:8.1f}ms ({scan_total:6d} matches), "
+                  f"full-text {indexed_ms:8.1f}ms ({indexed_total:6d} matches), "
+                  f"{scan_ms / indexed_ms if indexed_ms else 0:6.1f}x")
+    finally:
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        else:
+            connection.close()
+            os.remove(connection.settings_dict['NAME'])
+
+
+if __name__ == '__main__':
+    main()
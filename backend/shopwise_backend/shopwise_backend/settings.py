@@ -182,3 +182,28 @@ CACHES = {
         'LOCATION': 'unique-snowflake',
     }
 }
+
+# Catalog change feed written by the scraper (catalog_changes table).
+# Cached product list pages are keyed by the latest change seq, which each
+# process re-reads at most every CATALOG_CHANGES_POLL_SECONDS. A gap in seq may
+# be a scraper transaction that has not committed yet, so readers wait for it
+# until the change after it is CATALOG_CHANGES_SETTLE_SECONDS old.
+CATALOG_CHANGES_POLL_SECONDS = 30
+CATALOG_CHANGES_SETTLE_SECONDS = 60
+
+# Product comparison (api/products/compare/). Names are matched by trigram
+# similarity, from 0 to 1; matches below COMPARE_SIMILARITY_THRESHOLD are
+# dropped and at most COMPARE_TOP_K are returned per retailer.
+COMPARE_SIMILARITY_THRESHOLD = 0.3
+COMPARE_TOP_K = 5
+
+# Cross-retailer product groups (product_groups table, group_products command).
+# Products of the same category and pack size are grouped when at least this
+# share of their name words match.
+PRODUCT_GROUP_MIN_SIMILARITY = 0.6
+
+# Product list page counts (api/pagination.py). Counts are cached per filter
+# combination and catalog version; the unfiltered catalog on PostgreSQL is
+# estimated from pg_class.reltuples once it reaches PRODUCT_COUNT_ESTIMATE_MIN.
+PRODUCT_COUNT_CACHE_SECONDS = 300
+PRODUCT_COUNT_ESTIMATE_MIN = 100000
@@ -0,0 +1,79 @@
+"""
+Throughput benchmark for the AzureDBPipeline write paths.
+
+Feeds synthetic items through the per-item path and the batched path against
+the local SQL stand-in and reports items/sec and round trips per item. With
+--metrics each path also runs with the stage metrics timers installed, and the
+time per database call is printed.
+
+Usage (from the scraper directory):
+    python -m benchmarks.pipeline_throughput --items 2000 --latency-ms 5
+    python -m benchmarks.pipeline_throughput --items 20000 --latency-ms 0 --metrics
+"""
+import argparse
+import time
+
+from benchmarks.standin import StandInConnection
+from myproject.database import AzureDBPipeline
+from myproject.metrics import StageMetrics
+
+
+def make_items(count: int):
+    for i in range(count):
+        yield {
+            'retailer': 'shoprite' if i % 2 else 'checkers',
+            'scrape_date': '2024-11-28T10:00:00',
+            'product_name': f'Product {i}',
+            'price': 10.0 + i % 50,
+            'image_url': f'https://example.com/images/{i}.jpg',
+            'product_url': f'https://example.com/p/{i}',
+            'category': f'Category {i % 40}',
+            'product_description': f'Description for product {i}',
+        }
+
+
+def run(batch_size: int, items: int, latency: float, metrics: StageMetrics = None):
+    pipeline = AzureDBPipeline(batch_size=batch_size)
+    if metrics is not None:
+        pipeline.instrument(metrics)
+    pipeline.conn = StandInConnection(latency)
+    pipeline.cursor = pipeline.conn.cursor()
+    pipeline.cursor.fast_executemany = pipeline.batching
+
+    start = time.perf_counter()
+    for item in make_items(items):
+        pipeline.process_item(item, spider=None)
+    pipeline.close_spider(spider=None)
+    elapsed = time.perf_counter() - start
+
+    return items / elapsed, pipeline.conn.round_trips / items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--latency-ms', type=float, default=5.0,
+                        help='simulated database round trip latency')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--metrics', action='store_true',
+                        help='also run with the stage metrics timers installed')
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    print(f"{args.items} items, {args.latency_ms}ms per round trip")
+    for label, batch_size in (('per-item', 1), (f'batched ({args.batch_size})', args.batch_size)):
+        rate, trips = run(batch_size, args.items, latency)
+        print(f"{label:>16}: {rate:10.1f} items/sec  {trips:6.2f} round trips/item")
+        if not args.metrics:
+            continue
+        metrics = StageMetrics()
+        rate, trips = run(batch_size, args.items, latency, metrics)
+        print(f"{'  with metrics':>16}: {rate:10.1f} items/sec  {trips:6.2f} round trips/item")
+        for (_, name), histogram in sorted(metrics.histograms.items()):
+            if histogram.count:
+                print(f"{name:>28}: {histogram.count:7d} calls  "
+                      f"{histogram.sum / histogram.count * 1e6:9.1f} us/call")
+
+
+if __name__ == '__main__':
+    main()
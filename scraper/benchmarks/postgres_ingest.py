@@ -0,0 +1,62 @@
+"""
+Ingestion throughput of PostgresPipeline against a local PostgreSQL instance.
+
+Loads synthetic items through the COPY-based pipeline at several batch sizes
+and reports items/sec for a cold load (every product new) and a re-crawl in
+which every price changed. Each run works in a scratch schema that is dropped
+afterwards, so existing tables in the target database are never touched.
+
+Usage (from the scraper directory):
+    python -m benchmarks.postgres_ingest --dsn "dbname=shopwise host=localhost user=postgres"
+"""
+import argparse
+import time
+
+import psycopg2
+
+from benchmarks.pipeline_throughput import make_items
+from myproject.postgres import PostgresPipeline
+
+SCHEMA = 'shopwise_bench'
+
+
+def crawl(dsn: str, batch_size: int, items: int, price_offset: float) -> float:
+    pipeline = PostgresPipeline(batch_size=batch_size)
+    pipeline.dsn = f"{dsn} options='-csearch_path={SCHEMA}'"
+
+    start = time.perf_counter()
+    pipeline.open_spider(spider=None)
+    for item in make_items(items):
+        item['price'] += price_offset
+        pipeline.process_item(item, spider=None)
+    pipeline.close_spider(spider=None)
+    return items / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', required=True, help='libpq connection string')
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 1000])
+    args = parser.parse_args()
+
+    admin = psycopg2.connect(args.dsn)
+    admin.autocommit = True
+    print(f"{args.items} items")
+    try:
+        for batch_size in args.batch_sizes:
+            with admin.cursor() as cursor:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+                cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+            cold = crawl(args.dsn, batch_size, args.items, price_offset=0)
+            recrawl = crawl(args.dsn, batch_size, args.items, price_offset=1)
+            print(f"batch size {batch_size:>5}: {cold:10.1f} items/sec cold, "
+                  f"{recrawl:10.1f} items/sec with every price changed")
+    finally:
+        with admin.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        admin.close()
+
+
+if __name__ == '__main__':
+    main()
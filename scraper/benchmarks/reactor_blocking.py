@@ -0,0 +1,121 @@
+"""
+Crawl wall time with database writes on and off the reactor thread.
+
+Crawls a local HTTP server with simulated response latency and stores every
+item through AzureDBPipeline backed by the SQL stand-in, once with the writes
+made inline on the reactor thread and once on the dedicated writer thread.
+Each mode runs in its own process because the reactor cannot be restarted.
+
+Usage (from the scraper directory):
+    python -m benchmarks.reactor_blocking --pages 200 --latency-ms 50 --db-latency-ms 5
+"""
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scrapy import Spider
+from scrapy.crawler import CrawlerProcess
+
+from benchmarks.standin import StandInConnection
+from myproject.database import AzureDBPipeline
+
+
+class StandInPipeline(AzureDBPipeline):
+    db_latency = 0.0
+
+    def connect_to_db(self):
+        self.conn = StandInConnection(self.db_latency)
+        self.cursor = self.conn.cursor()
+        self.cursor.fast_executemany = True
+
+
+class ProductSpider(Spider):
+    name = 'reactor_blocking'
+
+    def __init__(self, base_url, pages, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.start_urls = [f'{base_url}/p/{i}' for i in range(pages)]
+
+    def parse(self, response):
+        yield {
+            'retailer': 'shoprite',
+            'scrape_date': '2024-11-28T10:00:00',
+            'product_name': response.css('h1::text').get(),
+            'price': 19.99,
+            'image_url': f'{response.url}.jpg',
+            'product_url': response.url,
+            'category': 'Food',
+            'product_description': response.css('p::text').get(),
+        }
+
+
+def serve(latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            body = f'<h1>Product {self.path}</h1><p>Description</p>'.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_mode(args):
+    server = serve(args.latency_ms / 1000)
+    StandInPipeline.db_latency = args.db_latency_ms / 1000
+    process = CrawlerProcess(settings={
+        'ITEM_PIPELINES': {'benchmarks.reactor_blocking.StandInPipeline': 300},
+        'DB_BATCH_SIZE': args.batch_size,
+        'DB_WRITER_THREAD': args.mode == 'thread',
+        'CONCURRENT_REQUESTS': args.concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': args.concurrency,
+        'ROBOTSTXT_OBEY': False,
+        'LOG_LEVEL': 'ERROR',
+        'TWISTED_REACTOR': 'twisted.internet.asyncioreactor.AsyncioSelectorReactor',
+    })
+    start = time.perf_counter()
+    process.crawl(ProductSpider, base_url=f'http://127.0.0.1:{server.server_port}', pages=args.pages)
+    process.start()
+    print(json.dumps({'mode': args.mode, 'seconds': time.perf_counter() - start}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=50.0,
+                        help='simulated HTTP response latency')
+    parser.add_argument('--db-latency-ms', type=float, default=5.0,
+                        help='simulated database round trip latency')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--mode', choices=('inline', 'thread'))
+    args = parser.parse_args()
+
+    if args.mode:
+        return run_mode(args)
+
+    print(f"{args.pages} pages, {args.latency_ms}ms per response, "
+          f"{args.db_latency_ms}ms per DB round trip, batch size {args.batch_size}")
+    for mode in ('inline', 'thread'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.reactor_blocking', '--mode', mode] + sys.argv[1:],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>8}: {result['seconds']:7.2f}s wall time")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Price staleness under a fixed daily request budget: round-robin against the recrawl planner.
+
+Simulates products whose prices change as Poisson processes, with rates
+spread over categories from several changes a day to one every few months.
+Every day each strategy fetches up to --budget product pages:
+
+- round-robin cycles through the whole catalogue, like a full crawl spread
+  over several days;
+- the planner rebuilds a RecrawlPlanner from the changes it has observed so
+  far and fetches due products, most overdue first. Any budget left over
+  goes to the products that will be due soonest.
+
+It reports how long a price change takes to be picked up, and the share of
+stored prices that are stale, averaged over the days after --warmup.
+
+Usage (from the scraper directory):
+    python -m benchmarks.recrawl_schedule --products 20000 --budget 2000
+"""
+import argparse
+import heapq
+import math
+import random
+
+from myproject.recrawl import RecrawlPlanner
+
+DAY = 86400.0
+
+
+def make_catalogue(products: int, categories: int, rng: random.Random):
+    """(category, change rate per second) per product"""
+    base_rates = [math.exp(rng.uniform(math.log(1 / 120), math.log(1.5))) / DAY
+                  for _ in range(categories)]
+    catalogue = []
+    for _ in range(products):
+        category = rng.randrange(categories)
+        catalogue.append((f'c{category}', base_rates[category] * math.exp(rng.gauss(0, 0.7))))
+    return catalogue
+
+
+class Strategy:
+    def __init__(self, name, catalogue):
+        self.name = name
+        self.catalogue = catalogue
+        count = len(catalogue)
+        self.first_fetch = [0.0] * count
+        self.last_fetch = [0.0] * count
+        self.observed_changes = [0] * count
+        self.changed_since = [None] * count  # Time of the first change not fetched yet
+        self.latencies = []
+        self.stale_shares = []
+        self.cursor = 0
+
+    def choose(self, now, budget):
+        raise NotImplementedError
+
+    def fetch(self, now, budget, record):
+        for product in self.choose(now, budget):
+            if self.changed_since[product] is not None:
+                self.observed_changes[product] += 1
+                if record:
+                    self.latencies.append(now - self.changed_since[product])
+                self.changed_since[product] = None
+            self.last_fetch[product] = now
+        if record:
+            stale = sum(since is not None for since in self.changed_since)
+            self.stale_shares.append(stale / len(self.catalogue))
+
+
+class RoundRobin(Strategy):
+    def choose(self, now, budget):
+        count = len(self.catalogue)
+        chosen = [(self.cursor + i) % count for i in range(min(budget, count))]
+        self.cursor = (self.cursor + budget) % count
+        return chosen
+
+
+class Planned(Strategy):
+    def __init__(self, name, catalogue, planner_args):
+        super().__init__(name, catalogue)
+        self.planner_args = planner_args
+
+    def choose(self, now, budget):
+        planner = RecrawlPlanner(**self.planner_args)
+        planner.add_history({
+            'product_url': str(product),
+            'retailer': 'sim',
+            'category': category,
+            'changes': self.observed_changes[product],
+            'observed_seconds': self.last_fetch[product] - self.first_fetch[product],
+            'unseen_seconds': now - self.last_fetch[product],
+            'price': None,
+        } for product, (category, _) in enumerate(self.catalogue))
+        planner.plan()
+        chosen = [entry for entry in planner.due(budget)]
+        chosen += heapq.nsmallest(budget - len(chosen), planner.queue)
+        return [int(entry[1]) for entry in chosen]
+
+
+def simulate(catalogue, strategies, days, budget, warmup, rng):
+    for day in range(1, days + 1):
+        start, now = (day - 1) * DAY, day * DAY
+        for product, (_, rate) in enumerate(catalogue):
+            # Time of the first price change during the day, if there is one
+            first_change = start + rng.expovariate(rate)
+            if first_change >= now:
+                continue
+            for strategy in strategies:
+                if strategy.changed_since[product] is None:
+                    strategy.changed_since[product] = first_change
+        for strategy in strategies:
+            strategy.fetch(now, budget, record=day > warmup)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--categories', type=int, default=40)
+    parser.add_argument('--budget', type=int, default=2000, help='product pages fetched per day')
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--warmup', type=int, default=20, help='days before measuring')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    catalogue = make_catalogue(args.products, args.categories, rng)
+    strategies = [
+        RoundRobin('round-robin', catalogue),
+        Planned('planner', catalogue, {'min_interval': DAY / 2}),
+    ]
+    simulate(catalogue, strategies, args.days, args.budget, args.warmup, rng)
+
+    print(f"{args.products} products, {args.budget} fetches a day, "
+          f"measured over days {args.warmup + 1}-{args.days}")
+    for strategy in strategies:
+        latencies = sorted(strategy.latencies)
+        median = latencies[len(latencies) // 2] / DAY if latencies else float('nan')
+        mean = sum(latencies) / len(latencies) / DAY if latencies else float('nan')
+        stale = sum(strategy.stale_shares) / len(strategy.stale_shares)
+        print(f"{strategy.name:>12}: change picked up after {mean:5.2f} days on average "
+              f"(median {median:5.2f}), {stale:6.1%} of stored prices stale")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Crawl rate per retailer with AutoThrottle and with RetailerThrottleMiddleware.
+
+Starts two local mock retailers with different latency profiles: a fast one
+that answers 429 above 4 concurrent requests, and a slow one that answers 503
+above 1. Each crawl covers both with the same pages and starting delay, once
+with AutoThrottle and once with the per-retailer throttle. It reports pages
+per hour, 429 and 503 responses, and the throttle's backoffs for each retailer. Each mode runs in its own
+process because the reactor cannot be restarted.
+
+Usage (from the scraper directory):
+    python -m benchmarks.retailer_throttle --pages 150
+"""
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scrapy import Request, Spider
+from scrapy.crawler import CrawlerProcess
+
+from myproject import settings as project_settings
+
+PROFILES = {
+    # retailer: (response latency in seconds, concurrent requests allowed, status above that)
+    'fast': (0.02, 4, 429),
+    'slow': (0.25, 1, 503),
+}
+
+
+def serve(latency: float, limit: int, limited_status: int = 429) -> ThreadingHTTPServer:
+    in_flight = Counter()
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                in_flight['now'] += 1
+                limited = in_flight['now'] > limit
+            try:
+                time.sleep(latency)
+                status, body = (limited_status, b'slow down') if limited else (200, f'<h1>{self.path}</h1>'.encode())
+                self.send_response(status)
+                if limited:
+                    self.send_header('Retry-After', '1')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            finally:
+                with lock:
+                    in_flight['now'] -= 1
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class RetailerSpider(Spider):
+    name = 'retailer_throttle'
+
+    def __init__(self, bases, pages, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bases = bases
+        self.pages = pages
+        self.started = time.perf_counter()
+        self.finished = {}
+        self.done = Counter()
+
+    async def start(self):
+        for retailer, base in self.bases.items():
+            for i in range(self.pages):
+                yield Request(f'{base}/p/{i}', meta={'retailer': retailer}, dont_filter=True)
+
+    def parse(self, response):
+        retailer = response.meta['retailer']
+        self.done[retailer] += 1
+        self.finished[retailer] = time.perf_counter() - self.started
+
+    def closed(self, reason):
+        throttled = self.crawler.stats.get_value('throttled_by_retailer')
+        print(json.dumps({
+            retailer: {
+                'pages': self.done[retailer],
+                'seconds': self.finished.get(retailer, 0),
+                'throttled': throttled[retailer],
+                'backoffs': self.crawler.stats.get_value(f'throttle/{retailer}/backoffs', 0),
+                'delay': self.crawler.stats.get_value(f'throttle/{retailer}/delay'),
+                'concurrency': self.crawler.stats.get_value(f'throttle/{retailer}/concurrency'),
+            } for retailer in self.bases
+        }))
+
+
+class CountThrottled:
+    """Downloader middleware counting 429 and 503 responses per retailer"""
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.stats.set_value('throttled_by_retailer', Counter())
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_response(self, request, response, spider):
+        if response.status in (429, 503):
+            self.stats.get_value('throttled_by_retailer')[request.meta['retailer']] += 1
+        return response
+
+
+def run_mode(args):
+    bases = {}
+    for retailer, (latency, limit, limited_status) in PROFILES.items():
+        server = serve(latency, limit, limited_status)
+        bases[retailer] = f'http://127.0.0.1:{server.server_port}'
+
+    settings = {
+        'CONCURRENT_REQUESTS': 8,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 4,
+        'DOWNLOAD_DELAY': args.delay,
+        'RETRY_TIMES': 10,
+        'ROBOTSTXT_OBEY': False,
+        'LOG_LEVEL': 'ERROR',
+        'TWISTED_REACTOR': 'twisted.internet.asyncioreactor.AsyncioSelectorReactor',
+        'DOWNLOADER_MIDDLEWARES': {'benchmarks.retailer_throttle.CountThrottled': 600},
+    }
+    if args.mode == 'retailer':
+        throttle = 'myproject.middlewares.RetailerThrottleMiddleware'
+        settings['DOWNLOADER_MIDDLEWARES'][throttle] = project_settings.DOWNLOADER_MIDDLEWARES[throttle]
+        settings.update({
+            'RETAILER_THROTTLE_ENABLED': True,
+            'RETAILER_THROTTLE_MIN_DELAY': args.delay / 10,
+            'RETAILER_THROTTLE_TARGET_LATENCY': 1.0,
+            'RETAILER_THROTTLE_WINDOW': args.window,
+        })
+    else:
+        settings.update({
+            'AUTOTHROTTLE_ENABLED': True,
+            'AUTOTHROTTLE_START_DELAY': args.delay,
+            'AUTOTHROTTLE_TARGET_CONCURRENCY': 1.0,
+        })
+
+    process = CrawlerProcess(settings=settings)
+    process.crawl(RetailerSpider, bases=bases, pages=args.pages)
+    process.start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=150, help='pages per retailer')
+    parser.add_argument('--delay', type=float, default=0.5, help='starting download delay')
+    parser.add_argument('--window', type=int, default=10, help='RETAILER_THROTTLE_WINDOW')
+    parser.add_argument('--mode', choices=('autothrottle', 'retailer'))
+    args = parser.parse_args()
+
+    if args.mode:
+        return run_mode(args)
+
+    print(f"{args.pages} pages per retailer, starting delay {args.delay}s")
+    for mode in ('autothrottle', 'retailer'):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.retailer_throttle', '--mode', mode] + sys.argv[1:],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        for retailer, numbers in result.items():
+            rate = numbers['pages'] / numbers['seconds'] * 3600 if numbers['seconds'] else 0
+            print(f"{mode:>12} {retailer:>5}: {numbers['pages']:4d} pages in {numbers['seconds']:6.1f}s "
+                  f"({rate:8.0f} pages/hour), {numbers['throttled']} responses throttled"
+                  + (f", {numbers['backoffs']} backoffs" if mode == 'retailer' else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Per-page CPU cost of GrocerySpider.extract_data against the compiled SelectorEngine.
+
+Extracts every product page field from synthetic product pages (or from the
+product pages of a replay corpus) with the original per-call CSS selectors and
+with the precompiled XPath engine. It checks that both give identical output,
+then reports the CPU time per page for each.
+
+Usage (from the scraper directory):
+    python -m benchmarks.selector_engine --pages 2000
+    python -m benchmarks.selector_engine --corpus replay/<version>
+"""
+import argparse
+import time
+
+from scrapy.http import HtmlResponse, Request
+
+from myproject.replay import ReplayCorpus
+from myproject.spiders.groceryspider import GrocerySpider
+from myproject.utils.selectors import SelectorEngine
+
+
+def make_page(i: int) -> HtmlResponse:
+    # Navigation and footer padding to bring the page near a real product page's size
+    nav = ''.join(f'<li class="nav__item"><a href="/c-{n}">Category {n}</a></li>' for n in range(400))
+    body = f"""
+        <html><body><ul class="nav">{nav}</ul>
+        <div class="pdp"><h1 class="pdp__name">  Product {i} 1kg </h1>
+        <div class="special-price__price"><span class="now">R{i}.99</span>
+        <span class="before"> R{i + 5}.49 </span></div>
+        <div class="pdp__image__content"><img src="/medias/{i}.jpg"></div>
+        <div class="pdp__tabs"><div class="pdp__tabs__tab">
+            <p>Description of product {i}.</p><p>Second paragraph.</p></div></div>
+        </div><footer>{nav}</footer></body></html>
+    """
+    url = f'https://www.shoprite.co.za/All-Departments/Food/p/{i}'
+    return HtmlResponse(url=url, body=body.encode(), encoding='utf-8',
+                        request=Request(url, meta={'retailer': 'shoprite'}))
+
+
+def original(response: HtmlResponse) -> dict:
+    selectors = GrocerySpider.SELECTORS[response.meta['retailer']]
+    return {field: GrocerySpider.extract_data(response, selectors[field])
+            for field in GrocerySpider.PRODUCT_FIELDS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--corpus', help='replay corpus to take product pages from')
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = ReplayCorpus(args.corpus)
+        pages = [corpus.response(entry) for entry in corpus.entries()
+                 if entry['kind'] == 'product' and entry['status'] == 200]
+    else:
+        pages = [make_page(i) for i in range(args.pages)]
+
+    engine = SelectorEngine(GrocerySpider.SELECTORS)
+
+    def compiled(response):
+        return engine.extract_fields(response, response.meta['retailer'], GrocerySpider.PRODUCT_FIELDS)
+
+    # Parse every page up front so both paths are timed on an already built tree
+    for response in pages:
+        response.selector.root
+    mismatches = sum(original(response) != compiled(response) for response in pages)
+    print(f"{len(pages)} product pages, {mismatches} with different output")
+
+    for name, extract in (('extract_data', original), ('SelectorEngine', compiled)):
+        start = time.process_time()
+        for response in pages:
+            extract(response)
+        per_page = (time.process_time() - start) / len(pages) * 1e6
+        print(f"{name:>15}: {per_page:8.1f} us CPU per page")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Local SQL stand-in for pipeline benchmarks.
+
+The stand-in implements the small part of the DB-API that the pipelines use
+and charges a fixed latency for every round trip to the "server", which is
+what bounds a real crawl against Azure SQL. Single-row lookups are answered as
+hits, the way they would be on a warm catalog, inserts hand out fresh ids and
+MERGE statements report an id for every row staged in #staging_products.
+"""
+import itertools
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+
+class StandInCursor:
+    def __init__(self, connection: 'StandInConnection'):
+        self.connection = connection
+        self.fast_executemany = False
+        self._results: List[tuple] = []
+
+    def execute(self, sql: str, params: Optional[Sequence[Any]] = None):
+        self.connection.round_trip()
+        self._results = self.connection.answer(sql, [params] if params else [])
+        return self
+
+    def executemany(self, sql: str, seq_of_params: Sequence[Sequence[Any]]):
+        seq_of_params = list(seq_of_params)
+        # fast_executemany ships every parameter set in one round trip
+        trips = 1 if self.fast_executemany else len(seq_of_params)
+        for _ in range(trips):
+            self.connection.round_trip()
+        if '#staging_products' in sql:
+            self.connection.staged.extend(seq_of_params)
+        self._results = []
+        return self
+
+    def fetchone(self) -> Optional[tuple]:
+        return self._results.pop(0) if self._results else None
+
+    def fetchmany(self, size: int = 1) -> List[tuple]:
+        results, self._results = self._results[:size], self._results[size:]
+        return results
+
+    def fetchall(self) -> List[tuple]:
+        results, self._results = self._results, []
+        return results
+
+
+class StandInConnection:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.round_trips = 0
+        self.staged: List[Sequence[Any]] = []
+        self._ids = itertools.count(1)
+        self._product_ids: Dict[str, int] = {}
+
+    def cursor(self) -> StandInCursor:
+        return StandInCursor(self)
+
+    def round_trip(self) -> None:
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def answer(self, sql: str, params: List[Sequence[Any]]) -> List[tuple]:
+        """Return the rows a warm database would send back for sql"""
+        statement = ' '.join(sql.split()).upper()
+        if statement.startswith('MERGE'):
+            # Staging rows lead with product_url and content_hash
+            return [(self._product_id(row[0]), row[0], row[1]) for row in self.staged]
+        if statement.startswith('TRUNCATE'):
+            self.staged.clear()
+        elif statement.startswith('SELECT ID FROM') or 'OUTPUT INSERTED.ID' in statement:
+            return [(next(self._ids),)]
+        return []
+
+    def _product_id(self, product_url: str) -> int:
+        if product_url not in self._product_ids:
+            self._product_ids[product_url] = next(self._ids)
+        return self._product_ids[product_url]
+
+    def commit(self) -> None:
+        self.round_trip()
+
+    def rollback(self) -> None:
+        self.round_trip()
+
+    def close(self) -> None:
+        pass
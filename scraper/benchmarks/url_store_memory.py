@@ -0,0 +1,100 @@
+"""
+Memory per million URLs for the spider's seen-URL stores.
+
+Fills each store with synthetic product and pagination URLs and reports the
+Python heap it holds (measured with tracemalloc), per million URLs, next to a
+plain set of URL strings, which is what GrocerySpider used before. The Bloom
+filter is also checked for its false-positive rate on unseen URLs, and the
+saved fingerprint store for the heap it takes to reopen on a restart.
+
+Usage (from the scraper directory):
+    python -m benchmarks.url_store_memory --urls 1000000
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from myproject.utils.url_store import BloomURLStore, FingerprintURLStore, canonicalize_url
+
+
+def make_urls(count: int, offset: int = 0):
+    for i in range(offset, offset + count):
+        if i % 20:
+            yield (f'https://www.shoprite.co.za/All-Departments/Food/Fresh-Food/'
+                   f'Product-Name-{i}/p/{10000000000 + i}EA')
+        else:
+            yield (f'https://www.checkers.co.za/c-2256/All-Departments?'
+                   f'q=%3Arelevance%3AbrowseAllStoresFacetOff&page={i}')
+
+
+class StringSet:
+    """The original store: a set of the URL strings themselves"""
+
+    def __init__(self):
+        self.urls = set()
+
+    def add(self, url: str) -> bool:
+        if url in self.urls:
+            return False
+        self.urls.add(url)
+        return True
+
+
+def measure(name: str, build, urls: int):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    store = build()
+    for url in make_urls(urls):
+        store.add(url)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{name:>24}: {size / urls:8.1f} bytes/URL, "
+          f"{size / urls * 1e6 / 2 ** 20:8.1f} MiB per million, {urls / elapsed:10.0f} adds/sec")
+    return store
+
+
+def measure_reopen(store: FingerprintURLStore, urls: int):
+    """Save store, then reopen it and look every URL up again"""
+    with tempfile.TemporaryDirectory() as directory:
+        store.path = os.path.join(directory, 'seen.bin')
+        store.close()
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        reopened = FingerprintURLStore(store.path)
+        opened = time.perf_counter() - start
+        found = sum(url in reopened for url in make_urls(urls))
+        size = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        reopened.close(keep=False)
+    print(f"{'fingerprints, reopened':>24}: {size / urls:8.1f} bytes/URL peak heap, "
+          f"opened in {opened * 1000:.1f} ms, {found} of {urls} URLs found")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--urls', type=int, default=1000000)
+    parser.add_argument('--error-rate', type=float, default=0.0001)
+    args = parser.parse_args()
+
+    print(f"{args.urls} URLs")
+    # The original spider stored the joined URL, not a canonical form
+    measure('set of URL strings', StringSet, args.urls)
+    fingerprints = measure('fingerprints', FingerprintURLStore, args.urls)
+    measure_reopen(fingerprints, args.urls)
+    bloom = measure(f'bloom (p={args.error_rate})',
+                    lambda: BloomURLStore(capacity=args.urls, error_rate=args.error_rate), args.urls)
+
+    probes = min(args.urls, 100000)
+    false_positives = sum(url in bloom for url in make_urls(probes, offset=args.urls))
+    print(f"bloom false positives: {false_positives / probes:.5f} on {probes} unseen URLs")
+    print(f"canonical form: {canonicalize_url('https://WWW.Shoprite.co.za/c-2256/?page=2&utm_source=x#top')}")
+
+
+if __name__ == '__main__':
+    main()
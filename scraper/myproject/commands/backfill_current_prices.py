@@ -0,0 +1,38 @@
+import logging
+
+from scrapy.commands import ScrapyCommand
+
+from myproject.database import DBPipeline
+
+
+class Command(ScrapyCommand):
+    """Populate products.current_price from the prices history"""
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Set each product's current price and price time from its latest price row"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--batch-size", dest="batch_size", type=int, default=10000,
+                            help="product ids updated per transaction (default: 10000)")
+
+    def run(self, args, opts):
+        pipeline = DBPipeline.pipeline_class(self.settings)()
+        total = 0
+        try:
+            for last_id, updated in pipeline.backfill_current_prices(opts.batch_size):
+                total += updated
+                logging.info(f"Backfilled current prices up to product {last_id}")
+            print(f"Set the current price of {total} products")
+        except Exception as e:
+            # Batches already committed stay, so a rerun only repeats the failed one onwards
+            logging.error(f"Backfill stopped: {e}")
+            self.exitcode = 1
+        finally:
+            if pipeline.conn:
+                pipeline.conn.close()
@@ -0,0 +1,205 @@
+import json
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from scrapy.commands import ScrapyCommand
+from scrapy.crawler import Crawler
+from scrapy.exceptions import UsageError
+from scrapy.statscollectors import MemoryStatsCollector
+
+from myproject.replay import ReplayCorpus
+from myproject.spiders.groceryspider import GrocerySpider
+from myproject.utils.data_cleaner import DataCleaner
+from myproject.utils.structured_data import structured_product
+from myproject.utils.url_store import FingerprintURLStore
+
+# Product page fields and the DataCleaner function applied to each
+CLEANERS = {
+    'product_name': DataCleaner.clean_text,
+    'price': DataCleaner.clean_price,
+    'image_url': DataCleaner.clean_url,
+    'product_description': DataCleaner.clean_text,
+}
+
+# Stage key: (name shown, unit of its output)
+STAGES = {
+    'listing': ('parse (listing)', 'requests'),
+    'product': ('parse_product_page', 'items'),
+    'extract': ('extract_data', 'values'),
+    'compiled': ('SelectorEngine', 'values'),
+    'structured': ('structured + fallback', 'values'),
+    'clean': ('DataCleaner', 'values'),
+}
+
+
+def fresh(responses):
+    """Unparsed copies of responses, one at a time.
+
+    A response caches its parsed HTML tree on first use, so every pass works
+    on new copies: HTML parsing is counted in each stage, as it is in a
+    crawl, and each copy is freed once the stage is done with it.
+    """
+    for response in responses:
+        yield response.replace(body=response.body)
+
+
+def peak_rss() -> float:
+    """Peak resident set size of this process in MiB, native allocations included"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(ScrapyCommand):
+    """Measure parse throughput on a recorded replay corpus"""
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <corpus>"
+
+    def short_desc(self):
+        return "Benchmark GrocerySpider parsing and DataCleaner on a replay corpus"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--repeat", dest="repeat", type=int, default=3,
+                            help="passes over the corpus per stage (default: 3)")
+        parser.add_argument("--stage", dest="stage", choices=list(STAGES),
+                            help="run one stage in this process and print its figures as JSON "
+                                 "(used internally, each stage runs in its own process)")
+
+    def run(self, args, opts):
+        if len(args) != 1:
+            raise UsageError()
+        if opts.stage:
+            print(json.dumps(self.run_stage(args[0], opts.stage, opts.repeat)))
+            return
+
+        corpus = ReplayCorpus(args[0])
+        entries = [entry for entry in corpus.entries() if entry['status'] == 200]
+        products = sum(entry['kind'] == 'product' for entry in entries)
+        print(f"{corpus.path}: {len(entries) - products} listing pages, {products} product pages, "
+              f"{opts.repeat} passes per stage")
+
+        # Each stage runs in its own process, so its peak RSS is its own
+        results = {}
+        for stage, (name, unit) in STAGES.items():
+            command = [sys.executable, '-m', 'scrapy', 'bench_parse', args[0],
+                       '--repeat', str(opts.repeat), '--stage', stage]
+            for setting in opts.set:
+                command += ['-s', setting]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            result = results[stage] = json.loads(output.strip().splitlines()[-1])
+            elapsed = result['seconds'] or 1e-9
+            page_rate = f"{result['pages'] / elapsed:10.1f}" if result['pages'] else f"{'-':>10}"
+            print(f"{name:>21}: {page_rate} pages/sec {result['outputs'] / elapsed:12.1f} {unit}/sec "
+                  f"peak RSS {result['peak_rss']:8.1f} MiB (+{result['peak_rss'] - result['base_rss']:.1f} MiB)")
+
+        structured = results['structured']
+        for path, times in structured['page_times'].items():
+            print(f"{path:>21} per page: " + ', '.join(
+                f"{source} {times.get(source, 0) / (count * opts.repeat) * 1e6:.1f} us ({count} pages)"
+                for source, count in sorted(structured['sources'].items())
+            ))
+
+        # Fields that came out empty point at selectors that no longer match the pages
+        for field, count in sorted(results['product']['missing'].items()):
+            print(f"missing {field}: {count // opts.repeat} of {products} product pages")
+
+    def run_stage(self, path: str, stage: str, repeat: int) -> dict:
+        """Time repeat passes of one stage and measure this process's peak RSS around them"""
+        corpus = ReplayCorpus(path)
+        entries = [entry for entry in corpus.entries() if entry['status'] == 200]
+        listings = [corpus.response(entry) for entry in entries if entry['kind'] == 'listing']
+        products = [corpus.response(entry) for entry in entries if entry['kind'] == 'product']
+
+        settings = self.settings.copy()
+        settings.set('CRAWL_MODE', 'full')
+        settings.set('URL_STORE_PATH', None)
+        crawler = Crawler(GrocerySpider, settings)
+        # The spider counts requests in the crawl stats, which only exist once a crawl starts
+        crawler.stats = MemoryStatsCollector(crawler)
+        spider = GrocerySpider.from_crawler(crawler)
+
+        missing = Counter()
+
+        def parse_listings():
+            outputs = 0
+            for response in fresh(listings):
+                # A fresh store per page, so every link on it is followed
+                spider.visited_urls = FingerprintURLStore()
+                outputs += sum(1 for _ in spider.parse(response))
+            return len(listings), outputs
+
+        def parse_products():
+            items = 0
+            for response in fresh(products):
+                for item in spider.parse_product_page(response):
+                    items += 1
+                    missing.update(field for field, value in item.items() if value is None)
+            return len(products), items
+
+        raw_values = []
+
+        def extract_fields():
+            raw_values.clear()
+            for response in fresh(products):
+                selectors = spider.SELECTORS[response.meta['retailer']]
+                for field in CLEANERS:
+                    raw_values.append((field, spider.extract_data(response, selectors[field])))
+            return len(products), len(raw_values)
+
+        def compiled_fields():
+            values = 0
+            for response in fresh(products):
+                values += len(spider.selectors.extract_fields(
+                    response, response.meta['retailer'], CLEANERS
+                ))
+            return len(products), values
+
+        # Time per page for each embedded data source, against the compiled selectors alone
+        sources = []
+        page_times = {'structured + fallback': Counter(), 'SelectorEngine': Counter()}
+
+        def structured_fields():
+            values = 0
+            for response, source in zip(fresh(products), sources):
+                start = time.perf_counter()
+                values += len(spider.extract_product_fields(response, response.meta['retailer']))
+                page_times['structured + fallback'][source] += time.perf_counter() - start
+                # A second copy, so the selectors parse the page again as well
+                response = response.replace(body=response.body)
+                start = time.perf_counter()
+                spider.selectors.extract_fields(response, response.meta['retailer'], CLEANERS)
+                page_times['SelectorEngine'][source] += time.perf_counter() - start
+            return len(products), values
+
+        def clean_fields():
+            for field, value in raw_values:
+                CLEANERS[field](value)
+            return 0, len(raw_values)
+
+        run = {
+            'listing': parse_listings, 'product': parse_products, 'extract': extract_fields,
+            'compiled': compiled_fields, 'structured': structured_fields, 'clean': clean_fields,
+        }[stage]
+        # Untimed setup, so it counts in the baseline RSS rather than in the stage
+        if stage == 'clean':
+            extract_fields()
+        if stage == 'structured':
+            sources.extend(structured_product(response)[0] or 'selectors' for response in fresh(products))
+
+        base_rss = peak_rss()
+        pages = outputs = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            stage_pages, stage_outputs = run()
+            pages += stage_pages
+            outputs += stage_outputs
+        return {
+            'pages': pages, 'outputs': outputs, 'seconds': time.perf_counter() - start,
+            'base_rss': base_rss, 'peak_rss': peak_rss(), 'missing': missing,
+            'sources': Counter(sources), 'page_times': page_times,
+        }
@@ -0,0 +1,62 @@
+from scrapy.commands import ScrapyCommand
+
+from myproject.database import DBPipeline
+from myproject.ledger import find_regressions, throughput
+from myproject.spiders.groceryspider import GrocerySpider
+
+
+class Command(ScrapyCommand):
+    """Compare the latest crawl in the ledger against the runs before it"""
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Flag throughput or yield regressions of the latest crawl run"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--spider", dest="spider", default=GrocerySpider.name,
+                            help=f"spider whose runs to compare (default: {GrocerySpider.name})")
+        parser.add_argument("--mode", dest="mode", default=None,
+                            help="crawl mode whose runs to compare (default: CRAWL_MODE setting)")
+        parser.add_argument("--baseline-runs", dest="baseline_runs", type=int, default=None,
+                            help="runs before the latest one to take the median of "
+                                 "(default: CRAWL_LEDGER_BASELINE_RUNS setting)")
+
+    def run(self, args, opts):
+        mode = opts.mode or self.settings.get('CRAWL_MODE', 'full')
+        baseline_runs = opts.baseline_runs or self.settings.getint('CRAWL_LEDGER_BASELINE_RUNS', 7)
+
+        pipeline = DBPipeline.pipeline_class(self.settings)()
+        try:
+            runs = pipeline.recent_crawl_runs(opts.spider, mode, baseline_runs + 1)
+        finally:
+            if pipeline.conn:
+                pipeline.conn.close()
+
+        if len(runs) < 2:
+            print(f"Not enough {mode} runs of {opts.spider} to compare ({len(runs)} recorded)")
+            return
+
+        latest, baseline = runs[0], runs[1:]
+        print(f"Run {latest['run_id']} ({latest['started_at']:%Y-%m-%d %H:%M}, {latest['finish_reason']}) "
+              f"against the median of {len(baseline)} earlier {mode} runs")
+        for scope, counts in [('run', latest)] + sorted(latest['retailers'].items()):
+            print(f"  {scope:>12}: {throughput(latest, counts):8.2f} pages/sec  "
+                  f"{counts['items_yielded']:7d} yielded  {counts['items_written']:7d} written  "
+                  f"{counts['errors']:5d} errors")
+
+        regressions = find_regressions(
+            latest, baseline,
+            throughput_ratio=self.settings.getfloat('CRAWL_REGRESSION_THROUGHPUT_RATIO', 0.67),
+            yield_ratio=self.settings.getfloat('CRAWL_REGRESSION_YIELD_RATIO', 0.67),
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            self.exitcode = 1
+        else:
+            print("No regressions")
@@ -0,0 +1,50 @@
+import logging
+
+from scrapy.commands import ScrapyCommand
+
+from myproject.postgres import PostgresPipeline
+
+
+class Command(ScrapyCommand):
+    """Report and merge PostgreSQL product rows that share a product_url"""
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "List duplicate product_url rows in PostgreSQL, and merge them with --apply"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--apply", dest="apply", action="store_true",
+                            help="merge the duplicates and create the unique product_url index")
+        parser.add_argument("--show", dest="show", type=int, default=20,
+                            help="duplicate URLs to list (default: 20, 0 for all)")
+
+    def run(self, args, opts):
+        pipeline = PostgresPipeline()
+        try:
+            pipeline._open_connection()
+            pipeline._ensure_tables_exist(unique_urls=False)
+            duplicates = pipeline.duplicate_product_urls()
+            rows = sum(len(ids) - 1 for _, ids in duplicates)
+            print(f"{len(duplicates)} product URLs have duplicate rows, {rows} rows to merge")
+            for product_url, ids in duplicates[:opts.show or None]:
+                print(f"{product_url}: ids {ids}, keeping {ids[0]}")
+            if not duplicates:
+                pipeline._create_product_url_index()
+                pipeline.conn.commit()
+                return
+            if not opts.apply:
+                print("Rerun with --apply to merge them")
+                return
+            for table, count in pipeline.merge_duplicate_products().items():
+                print(f"{table}: {count}")
+        except Exception as e:
+            logging.error(f"Dedupe stopped: {e}")
+            self.exitcode = 1
+        finally:
+            if pipeline.conn:
+                pipeline.conn.close()
@@ -0,0 +1,72 @@
+import logging
+import os
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import DropItem
+
+from myproject.database import DBPipeline
+from myproject.spool import finished_segments, read_segment
+
+
+class Command(ScrapyCommand):
+    """Bulk-load finished spool segments into the database"""
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Load spooled items into the database, one transaction per segment"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--spool-dir", dest="spool_dir", default=None,
+                            help="spool directory (default: SPOOL_DIR setting)")
+        parser.add_argument("--limit", dest="limit", type=int, default=0,
+                            help="load at most this many segments")
+
+    def run(self, args, opts):
+        spool_dir = opts.spool_dir or self.settings.get('SPOOL_DIR', 'spool')
+        segments = finished_segments(spool_dir)
+        if opts.limit:
+            segments = segments[:opts.limit]
+        if not segments:
+            logging.info(f"No finished segments in {spool_dir}")
+            return
+
+        loaded_dir = os.path.join(spool_dir, 'loaded')
+        os.makedirs(loaded_dir, exist_ok=True)
+
+        # A batch size no segment reaches, so each segment is flushed as one batch.
+        # Prices are dated by when they were scraped, not when the spool is loaded.
+        pipeline = DBPipeline.pipeline_class(self.settings)(batch_size=2 ** 31, scrape_dates=True)
+        pipeline.connect_to_db()
+        try:
+            for path in segments:
+                count = self._load_segment(pipeline, path)
+                # Moved only after the commit. If the move is lost the segment is
+                # loaded again, and change detection turns the rerun into no-ops.
+                os.replace(path, os.path.join(loaded_dir, os.path.basename(path)))
+                logging.info(f"Loaded {count} items from {path}")
+        except Exception as e:
+            logging.error(f"Stopped loading spool at {path}: {e}")
+            self.exitcode = 1
+        finally:
+            pipeline._close_connection()
+
+    def _load_segment(self, pipeline, path: str) -> int:
+        """Buffer every item in the segment and write them in a single transaction"""
+        pipeline.seen_urls = set()
+        count = 0
+        for item in read_segment(path):
+            try:
+                pipeline._write_item(item)
+                count += 1
+            except DropItem:
+                # A product scraped twice in one segment keeps its first copy
+                continue
+        # Written all or nothing, unlike flush(), so a failed segment stays in the spool
+        items, pipeline.buffer = pipeline.buffer, []
+        pipeline._write_batch(items)
+        return count
@@ -0,0 +1,156 @@
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from scrapy.commands import ScrapyCommand
+
+from myproject.database import DBPipeline
+from myproject.sharding import ShardStore, discover_page_count, plan_shards
+from myproject.spiders.groceryspider import GrocerySpider
+from myproject.utils.selectors import SelectorEngine
+from myproject.utils.url_store import remove_file
+
+
+class Command(ScrapyCommand):
+    """Split the crawl into shards and run them in parallel worker processes"""
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Run grocery_spider as sharded worker processes sharing one coordination store"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--workers", dest="workers", type=int, default=os.cpu_count() or 1,
+                            help="worker processes to start (default: CPU count)")
+        parser.add_argument("--pages-per-shard", dest="pages_per_shard", type=int, default=0,
+                            help="split each start URL into listing page ranges of this size "
+                                 "(default: one shard per start URL)")
+        parser.add_argument("--shard-dir", dest="shard_dir", default="shards",
+                            help="directory for the coordination store, seen URLs and worker logs")
+        parser.add_argument("--max-restarts", dest="max_restarts", type=int, default=None,
+                            help="replacement workers to start for failed ones (default: --workers)")
+
+    def run(self, args, opts):
+        start_urls = self.settings.getdict('SHARD_START_URLS') or {
+            retailer: [url] for retailer, url in GrocerySpider.START_URLS.items()
+        }
+        start_urls = {retailer: urls if isinstance(urls, list) else [urls]
+                      for retailer, urls in start_urls.items()}
+
+        page_counts = {}
+        if opts.pages_per_shard:
+            selectors = SelectorEngine(GrocerySpider.SELECTORS)
+            user_agent = self.settings.get('USER_AGENT')
+            for retailer, urls in start_urls.items():
+                for url in urls:
+                    page_counts[url] = discover_page_count(url, retailer, selectors, user_agent)
+
+        shards = plan_shards(start_urls, opts.pages_per_shard, page_counts)
+        run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+        os.makedirs(opts.shard_dir, exist_ok=True)
+        store = ShardStore(os.path.join(opts.shard_dir, 'shards.sqlite'),
+                           lease=self.settings.getfloat('SHARD_LEASE_SECONDS', 300))
+        store.add_shards(run_id, shards)
+
+        workers = max(1, min(opts.workers, len(shards)))
+        logging.info(f"Run {run_id}: {len(shards)} shards on {workers} workers")
+        if not self.settings.getbool('SPOOL_ENABLED'):
+            self._create_tables()
+
+        seen_path = os.path.join(opts.shard_dir, f'{run_id}-seen.sqlite')
+        # Workers share the claimed shards, the seen URLs and the conditional
+        # request validators, and each opens its own pipeline connection
+        worker_settings = [
+            f"SHARD_STORE={store.path}",
+            f"SHARD_RUN={run_id}",
+            "URL_STORE=sqlite",
+            f"URL_STORE_PATH={seen_path}",
+            "CONDITIONAL_REQUESTS_COMMIT_EVERY=1",
+        ] + opts.set
+        max_restarts = workers if opts.max_restarts is None else opts.max_restarts
+        failed = self._supervise(store, run_id, worker_settings, opts.shard_dir, workers, max_restarts)
+        counts = store.status_counts(run_id)
+        stats = store.collect_stats(run_id)
+        store.close()
+
+        print(f"Run {run_id}: {workers} workers, {failed} failed, shards {counts}")
+        for key, value in sorted(stats.items()):
+            print(f"{key}: {value}")
+        # Failed workers' shards were crawled again by others or by replacements,
+        # so the run succeeded if every shard is done
+        if set(counts) - {'done'}:
+            self.exitcode = 1
+        else:
+            # Every shard is crawled, so the run's seen URLs are not needed to resume it
+            remove_file(seen_path)
+
+    def _supervise(self, store, run_id, worker_settings, shard_dir, workers, max_restarts) -> int:
+        """Run the workers until all have exited, returning how many failed.
+
+        The shards an exited worker still has claimed go back to pending at
+        once, and a replacement is started while restarts remain. A worker
+        whose lease ran out is hung: it is terminated, killed if that does not
+        stop it, and handled the same way.
+        """
+        # Workers by the name they claim shards under, which GrocerySpider
+        # builds from the host name and its process id
+        processes = {}
+        stopping = {}  # worker -> when it was sent SIGTERM
+        started = failed = 0
+
+        def start_worker():
+            nonlocal started
+            command = [sys.executable, '-m', 'scrapy', 'crawl', GrocerySpider.name]
+            for setting in worker_settings + [
+                f"LOG_FILE={os.path.join(shard_dir, f'{run_id}-worker-{started}.log')}"
+            ]:
+                command += ['-s', setting]
+            process = subprocess.Popen(command)
+            processes[f"{socket.gethostname()}-{process.pid}"] = process
+            started += 1
+
+        for _ in range(workers):
+            start_worker()
+        while processes:
+            time.sleep(1)
+            for worker, process in list(processes.items()):
+                if process.poll() is None:
+                    continue
+                del processes[worker]
+                stopping.pop(worker, None)
+                released = store.release(run_id, worker)
+                if process.returncode:
+                    failed += 1
+                    logging.error(f"Worker {worker} exited with {process.returncode}, "
+                                  f"returned {released} shards to pending")
+                elif released:
+                    logging.warning(f"Worker {worker} exited with {released} shards unfinished")
+                if (process.returncode or released) and started - workers < max_restarts \
+                        and store.status_counts(run_id).get('pending'):
+                    start_worker()
+
+            for shard_id, worker in store.expired(run_id):
+                if worker in processes and worker not in stopping:
+                    logging.error(f"Worker {worker} stopped renewing its lease on {shard_id}, terminating it")
+                    processes[worker].terminate()
+                    stopping[worker] = time.monotonic()
+            # Another worker may have taken the shard over by now, so this does
+            # not wait for the lease to show as expired again
+            for worker, since in stopping.items():
+                if time.monotonic() - since > 30:
+                    processes[worker].kill()
+        return failed
+
+    def _create_tables(self):
+        """Create the database tables once, before workers race to create them"""
+        pipeline = DBPipeline.pipeline_class(self.settings)()
+        pipeline.connect_to_db()
+        pipeline._close_connection()
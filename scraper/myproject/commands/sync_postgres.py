@@ -0,0 +1,51 @@
+import logging
+
+from scrapy.commands import ScrapyCommand
+
+from myproject.database import AzureDBPipeline
+from myproject.postgres import PostgresPipeline
+from myproject.sync import CatalogSync, sync_summary
+
+
+class Command(ScrapyCommand):
+    """Copy the rows added to the Azure SQL catalog since the last sync into PostgreSQL"""
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options]"
+
+    def short_desc(self):
+        return "Incrementally sync the Azure SQL catalog into the PostgreSQL API database"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--batch-size", dest="batch_size", type=int, default=None,
+                            help="rows read and loaded per transaction (default: SYNC_BATCH_SIZE setting)")
+        parser.add_argument("--settle-seconds", dest="settle_seconds", type=int, default=None,
+                            help="skip rows newer than this, which may still be committing "
+                                 "(default: SYNC_SETTLE_SECONDS setting)")
+
+    def run(self, args, opts):
+        source = AzureDBPipeline()
+        target = PostgresPipeline()
+        try:
+            source._open_connection()
+            target._open_connection()
+            target._ensure_tables_exist()
+            sync = CatalogSync(
+                source, target,
+                batch_size=opts.batch_size or self.settings.getint('SYNC_BATCH_SIZE', 10000),
+                settle_seconds=(opts.settle_seconds if opts.settle_seconds is not None
+                                else self.settings.getint('SYNC_SETTLE_SECONDS', 60)),
+            )
+            for line in sync_summary(sync.run()):
+                print(line)
+        except Exception as e:
+            # Batches committed before the failure keep their watermarks, so a rerun resumes
+            logging.error(f"Sync stopped: {e}")
+            self.exitcode = 1
+        finally:
+            for pipeline in (source, target):
+                if pipeline.conn:
+                    pipeline.conn.close()
@@ -1,35 +1,336 @@
 import pyodbc
-from typing import Dict, Any
+import time
+import hashlib
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple
 import logging
 from dotenv import load_dotenv
+from scrapy import signals
+from scrapy.exceptions import DropItem
+from scrapy.utils.misc import load_object
 import os
+from myproject.metrics import stage_metrics
+from myproject.signals import items_committed
+
+# Marks a cache key that did not exist before the open transaction
+_MISSING = object()
 
 class AzureDBPipeline:
-    def __init__(self):
+    # Database calls timed per call when the crawl collects stage metrics
+    TIMED_CALLS = (
+        '_get_or_create_retailer', '_get_or_create_category', '_upsert_product', '_insert_price',
+        '_write_products', '_write_prices', '_write_changes', '_mark_unchanged_seen', '_commit',
+    )
+
+    # Counters kept per crawl run and per retailer in the crawl ledger
+    LEDGER_COUNTS = ('pages_fetched', 'items_yielded', 'items_written', 'errors', 'bytes_downloaded')
+    LEDGER_RUN_COLUMNS = (
+        ('run_id', 'spider', 'mode', 'started_at', 'finished_at', 'finish_reason')
+        + LEDGER_COUNTS + ('db_seconds', 'db_time_share')
+    )
+
+    def __init__(self, batch_size: int = 1, batch_interval: float = 0, stats=None,
+                 writer_queue_size: int = 0, change_feed: bool = False, scrape_dates: bool = False):
         self.conn = None
         self.cursor = None
+        self.stats = stats
+        self.signals = None  # Crawler signals, for items_committed; None outside a crawl
+        # All database work runs on a single writer thread when writer_queue_size is set,
+        # with at most writer_queue_size items waiting for it
+        self.writer_queue_size = writer_queue_size
+        self.writer = None
+        self.writer_slots = None
+        # Buffered write mode is used when batch_size is greater than 1
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.buffer: List[Dict[str, Any]] = []
+        self.last_flush = time.monotonic()
+        # name/url -> id caches, preloaded when the connection is opened
+        self.retailer_ids: Dict[str, int] = {}
+        self.category_ids: Dict[str, int] = {}
+        self.product_ids: Dict[str, int] = {}
+        # product id -> stored content hash / latest price, for change detection
+        self.product_hashes: Dict[int, bytes] = {}
+        self.last_prices: Dict[int, float] = {}
+        # Products seen in this crawl, and unchanged ones still to be marked as seen
+        self.seen_urls: Set[str] = set()
+        self.unchanged_ids: List[int] = []
+        # Cache writes made by the open transaction, undone again on rollback
+        self._uncommitted: List[Tuple[dict, Any, Any]] = []
+        # product id -> [change kind, old price, new price] of the open transaction,
+        # appended to catalog_changes just before it commits
+        self.change_feed = change_feed
+        self.changes: Dict[int, list] = {}
+        # Date prices by the items' scrape_date instead of the time they are written,
+        # for items loaded long after they were scraped
+        self.scrape_dates = scrape_dates
         load_dotenv()
-        
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(
+            batch_size=crawler.settings.getint('DB_BATCH_SIZE', 1),
+            batch_interval=crawler.settings.getfloat('DB_BATCH_INTERVAL', 0),
+            stats=crawler.stats,
+            writer_queue_size=(
+                crawler.settings.getint('DB_WRITER_QUEUE_SIZE', 100)
+                if crawler.settings.getbool('DB_WRITER_THREAD') else 0
+            ),
+            change_feed=crawler.settings.getbool('CATALOG_CHANGES_ENABLED'),
+        )
+        pipeline.signals = crawler.signals
+        crawler.signals.connect(pipeline.spider_idle, signal=signals.spider_idle)
+        metrics = stage_metrics(crawler)
+        if metrics is not None:
+            pipeline.instrument(metrics)
+        return pipeline
+
+    def instrument(self, metrics) -> None:
+        """Record the latency of each TIMED_CALLS call in metrics, under the 'db' stage"""
+        for name in self.TIMED_CALLS:
+            setattr(self, name, metrics.timed('db', name.lstrip('_'), getattr(self, name)))
+
     def connect_to_db(self):
         """Connect to Azure SQL Database"""
         try:
-            connection_string = (
-                f"DRIVER={{{os.getenv('DB_DRIVER')}}};"
-                f"SERVER={os.getenv('DB_SERVER')};"
-                f"DATABASE={os.getenv('DB_NAME')};"
-                f"UID={os.getenv('DB_USERNAME')};"
-                f"PWD={os.getenv('DB_PASSWORD')};"
-                f"Encrypt={os.getenv('DB_ENCRYPT')};"
-                f"TrustServerCertificate={os.getenv('DB_TRUST_SERVER_CERTIFICATE')};"
-                f"Connection Timeout={os.getenv('DB_CONNECTION_TIMEOUT')};"
-            )
-            self.conn = pyodbc.connect(connection_string)
-            self.cursor = self.conn.cursor()
+            self._open_connection()
             self._ensure_tables_exist()
+            self._ensure_staging_tables()
+            self._load_caches()
         except Exception as e:
             logging.error(f"Error connecting to database: {e}")
             raise
 
+    def _open_connection(self):
+        connection_string = (
+            f"DRIVER={{{os.getenv('DB_DRIVER')}}};"
+            f"SERVER={os.getenv('DB_SERVER')};"
+            f"DATABASE={os.getenv('DB_NAME')};"
+            f"UID={os.getenv('DB_USERNAME')};"
+            f"PWD={os.getenv('DB_PASSWORD')};"
+            f"Encrypt={os.getenv('DB_ENCRYPT')};"
+            f"TrustServerCertificate={os.getenv('DB_TRUST_SERVER_CERTIFICATE')};"
+            f"Connection Timeout={os.getenv('DB_CONNECTION_TIMEOUT')};"
+        )
+        self.conn = pyodbc.connect(connection_string)
+        self.cursor = self.conn.cursor()
+        # Send executemany parameter sets in a single round trip
+        self.cursor.fast_executemany = True
+
+    def complete_product_urls(self) -> Iterator[str]:
+        """URLs of stored products that already have an image and a description"""
+        if not self.conn:
+            self._open_connection()
+        try:
+            self.cursor.execute("""
+                SELECT product_url FROM products
+                WHERE image_url IS NOT NULL AND description IS NOT NULL AND description <> ''
+            """)
+            while True:
+                rows = self.cursor.fetchmany(10000)
+                if not rows:
+                    break
+                for (product_url,) in rows:
+                    yield product_url
+        except Exception as e:
+            logging.error(f"Error loading complete product urls: {e}")
+            raise
+
+    def price_history(self) -> Iterator[Dict[str, Any]]:
+        """Price change history of every stored product, for planning recrawls.
+
+        Each row has the product's retailer and category, the number of price
+        changes recorded, the seconds from its first price to when it was last
+        seen, the seconds since then, and its latest price. Ages are measured
+        against the database clock, which wrote the timestamps.
+        """
+        if not self.conn:
+            self._open_connection()
+        try:
+            self.cursor.execute("SELECT CURRENT_TIMESTAMP")
+            # psycopg2 returns it in the session time zone the naive columns are stored in
+            now = self.cursor.fetchone()[0].replace(tzinfo=None)
+            self.cursor.execute("""
+                SELECT products.product_url, retailers.name, categories.name,
+                       history.changes, history.first_price_at,
+                       COALESCE(products.last_seen_at, history.last_price_at), latest.price
+                FROM products
+                JOIN retailers ON retailers.id = products.retailer_id
+                LEFT JOIN categories ON categories.id = products.category_id
+                JOIN (
+                    SELECT product_id, COUNT(*) - 1 AS changes,
+                           MIN(created_at) AS first_price_at, MAX(created_at) AS last_price_at
+                    FROM prices GROUP BY product_id
+                ) AS history ON history.product_id = products.id
+                JOIN (
+                    SELECT product_id, price,
+                           ROW_NUMBER() OVER (PARTITION BY product_id
+                                              ORDER BY created_at DESC, id DESC) AS position
+                    FROM prices
+                ) AS latest ON latest.product_id = products.id AND latest.position = 1
+            """)
+            while True:
+                rows = self.cursor.fetchmany(10000)
+                if not rows:
+                    break
+                for product_url, retailer, category, changes, first_price_at, last_seen_at, price in rows:
+                    yield {
+                        'product_url': product_url,
+                        'retailer': retailer,
+                        'category': category or 'Unknown',
+                        'changes': changes,
+                        'observed_seconds': max(0.0, (last_seen_at - first_price_at).total_seconds()),
+                        'unseen_seconds': max(0.0, (now - last_seen_at).total_seconds()),
+                        'price': price,
+                    }
+        except Exception as e:
+            logging.error(f"Error loading price history: {e}")
+            raise
+
+    def backfill_current_prices(self, batch_size: int = 10000) -> Iterator[Tuple[int, int]]:
+        """Set every product's current price from its latest prices row.
+
+        Works through product ids batch_size at a time, one transaction each,
+        yielding (last product id, products updated) after every batch.
+        """
+        if not self.conn:
+            self._open_connection()
+            self._ensure_tables_exist()
+        self.cursor.execute("SELECT MAX(id) FROM products")
+        last_id = self.cursor.fetchone()[0] or 0
+        for first_id in range(1, last_id + 1, batch_size):
+            try:
+                updated = self._backfill_current_prices(first_id, first_id + batch_size - 1)
+                self.conn.commit()
+            except Exception as e:
+                logging.error(f"Error backfilling current prices from product {first_id}: {e}")
+                self.conn.rollback()
+                raise
+            yield min(first_id + batch_size - 1, last_id), updated
+
+    def _backfill_current_prices(self, first_id: int, last_id: int) -> int:
+        self.cursor.execute("""
+            UPDATE products SET current_price = latest.price, current_price_at = latest.created_at
+            FROM products JOIN (
+                SELECT product_id, price, created_at,
+                       ROW_NUMBER() OVER (PARTITION BY product_id
+                                          ORDER BY created_at DESC, id DESC) AS position
+                FROM prices
+                WHERE product_id BETWEEN ? AND ?
+            ) AS latest ON latest.product_id = products.id AND latest.position = 1
+        """, (first_id, last_id))
+        return self.cursor.rowcount
+
+    def record_crawl_run(self, run: Dict[str, Any], retailers: Dict[str, Dict[str, int]]) -> None:
+        """Write a crawl's ledger row and its per-retailer rows in one transaction"""
+        if not self.conn:
+            self._open_connection()
+        try:
+            self._ensure_ledger_tables()
+            crawl_run_id = self._insert_crawl_run(run)
+            if retailers:
+                self._insert_crawl_run_retailers([
+                    (crawl_run_id, retailer) + tuple(counts[column] for column in self.LEDGER_COUNTS)
+                    for retailer, counts in retailers.items()
+                ])
+            self.conn.commit()
+        except Exception as e:
+            logging.error(f"Error recording crawl run {run['run_id']}: {e}")
+            self.conn.rollback()
+            raise
+
+    def recent_crawl_runs(self, spider: str, mode: str, limit: int) -> List[Dict[str, Any]]:
+        """The latest finished runs of spider in mode, newest first, each with its retailers"""
+        if not self.conn:
+            self._open_connection()
+        try:
+            self._ensure_ledger_tables()
+            runs = {}
+            for row in self._select_crawl_runs(spider, mode, limit):
+                run = dict(zip(('id',) + self.LEDGER_RUN_COLUMNS, row))
+                run['retailers'] = {}
+                runs[run['id']] = run
+            if runs:
+                for row in self._select_crawl_run_retailers(list(runs)):
+                    crawl_run_id, retailer = row[0], row[1]
+                    runs[crawl_run_id]['retailers'][retailer] = dict(zip(self.LEDGER_COUNTS, row[2:]))
+            return list(runs.values())
+        except Exception as e:
+            logging.error(f"Error loading crawl runs: {e}")
+            raise
+
+    def _ensure_ledger_tables(self):
+        """Create the crawl run ledger tables if they don't exist"""
+        try:
+            self.cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'crawl_runs')
+                CREATE TABLE [crawl_runs] (
+                    [id] integer IDENTITY(1,1) PRIMARY KEY,
+                    [run_id] varchar(36) UNIQUE,
+                    [spider] nvarchar(100),
+                    [mode] nvarchar(20),
+                    [started_at] DATETIME2,
+                    [finished_at] DATETIME2,
+                    [finish_reason] nvarchar(100),
+                    [pages_fetched] integer,
+                    [items_yielded] integer,
+                    [items_written] integer,
+                    [errors] integer,
+                    [bytes_downloaded] bigint,
+                    [db_seconds] float,
+                    [db_time_share] float
+                )
+            """)
+            self.cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'crawl_run_retailers')
+                CREATE TABLE [crawl_run_retailers] (
+                    [id] integer IDENTITY(1,1) PRIMARY KEY,
+                    [crawl_run_id] integer,
+                    [retailer] nvarchar(255),
+                    [pages_fetched] integer,
+                    [items_yielded] integer,
+                    [items_written] integer,
+                    [errors] integer,
+                    [bytes_downloaded] bigint,
+                    FOREIGN KEY ([crawl_run_id]) REFERENCES [crawl_runs] ([id])
+                )
+            """)
+            self.conn.commit()
+        except Exception as e:
+            logging.error(f"Error creating crawl ledger tables: {e}")
+            self.conn.rollback()
+            raise
+
+    def _insert_crawl_run(self, run: Dict[str, Any]) -> int:
+        self.cursor.execute(f"""
+            INSERT INTO crawl_runs ({', '.join(self.LEDGER_RUN_COLUMNS)})
+            OUTPUT INSERTED.id
+            VALUES ({', '.join('?' * len(self.LEDGER_RUN_COLUMNS))})
+        """, tuple(run[column] for column in self.LEDGER_RUN_COLUMNS))
+        return self.cursor.fetchone()[0]
+
+    def _insert_crawl_run_retailers(self, rows: List[tuple]) -> None:
+        self.cursor.executemany(f"""
+            INSERT INTO crawl_run_retailers (crawl_run_id, retailer, {', '.join(self.LEDGER_COUNTS)})
+            VALUES (?, ?, {', '.join('?' * len(self.LEDGER_COUNTS))})
+        """, rows)
+
+    def _select_crawl_runs(self, spider: str, mode: str, limit: int) -> List[tuple]:
+        self.cursor.execute(f"""
+            SELECT id, {', '.join(self.LEDGER_RUN_COLUMNS)} FROM crawl_runs
+            WHERE spider = ? AND mode = ? AND finished_at IS NOT NULL
+            ORDER BY id DESC
+            OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY
+        """, (spider, mode, limit))
+        return self.cursor.fetchall()
+
+    def _select_crawl_run_retailers(self, crawl_run_ids: List[int]) -> List[tuple]:
+        self.cursor.execute(f"""
+            SELECT crawl_run_id, retailer, {', '.join(self.LEDGER_COUNTS)} FROM crawl_run_retailers
+            WHERE crawl_run_id IN ({', '.join('?' * len(crawl_run_ids))})
+        """, crawl_run_ids)
+        return self.cursor.fetchall()
+
     def _ensure_tables_exist(self):
         """Check if tables exist and create them if they don't"""
         try:
@@ -64,11 +365,39 @@ class AzureDBPipeline:
                     [category_id] integer,
                     [retailer_id] integer,
                     [created_at] DATETIME2 DEFAULT GETDATE(),
+                    [content_hash] binary(16),
+                    [last_seen_at] DATETIME2,
+                    [current_price] float,
+                    [current_price_at] DATETIME2,
                     FOREIGN KEY ([retailer_id]) REFERENCES [retailers] ([id]),
                     FOREIGN KEY ([category_id]) REFERENCES [categories] ([id])
                 )
             """)
 
+            # Change detection columns for products tables created before they existed
+            self.cursor.execute("""
+                IF COL_LENGTH('products', 'content_hash') IS NULL
+                ALTER TABLE [products] ADD [content_hash] binary(16)
+            """)
+            self.cursor.execute("""
+                IF COL_LENGTH('products', 'last_seen_at') IS NULL
+                ALTER TABLE [products] ADD [last_seen_at] DATETIME2
+            """)
+            # Latest price kept on the product, so the API reads it without touching prices
+            self.cursor.execute("""
+                IF COL_LENGTH('products', 'current_price') IS NULL
+                ALTER TABLE [products] ADD [current_price] float, [current_price_at] DATETIME2
+            """)
+            # Keyset pagination of the API's product list, on (ordering field, id)
+            self.cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'products_created_at_id')
+                CREATE INDEX [products_created_at_id] ON [products] ([created_at], [id])
+            """)
+            self.cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'products_name_id')
+                CREATE INDEX [products_name_id] ON [products] ([name], [id])
+            """)
+
             self.cursor.execute("""
                 IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'prices')
                 CREATE TABLE [prices] (
@@ -79,6 +408,25 @@ class AzureDBPipeline:
                     FOREIGN KEY ([product_id]) REFERENCES [products] ([id])
                 )
             """)
+            self.cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = 'prices_product_id_created_at')
+                CREATE INDEX [prices_product_id_created_at] ON [prices] ([product_id], [created_at])
+            """)
+
+            # Append-only feed of product and price changes, read by the API after a seq watermark
+            self.cursor.execute("""
+                IF NOT EXISTS (SELECT * FROM sys.tables WHERE name = 'catalog_changes')
+                CREATE TABLE [catalog_changes] (
+                    [seq] bigint IDENTITY(1,1) PRIMARY KEY,
+                    [product_id] integer,
+                    [change_kind] varchar(10),
+                    [old_price] float,
+                    [new_price] float,
+                    [run_id] varchar(36),
+                    [created_at] DATETIME2 DEFAULT GETDATE(),
+                    FOREIGN KEY ([product_id]) REFERENCES [products] ([id])
+                )
+            """)
             
             self.conn.commit()
         except Exception as e:
@@ -86,43 +434,426 @@ class AzureDBPipeline:
             self.conn.rollback()
             raise
 
-    def process_item(self, item: Dict[str, Any], spider) -> Dict[str, Any]:
+    def _load_caches(self):
+        """Preload retailer, category and product ids so warm crawls skip lookups"""
+        try:
+            self.cursor.execute("SELECT name, id FROM retailers ORDER BY id")
+            for name, retailer_id in self.cursor.fetchall():
+                self.retailer_ids.setdefault(name, retailer_id)
+
+            self.cursor.execute("SELECT name, id FROM categories ORDER BY id")
+            for name, category_id in self.cursor.fetchall():
+                self.category_ids.setdefault(name, category_id)
+
+            self.cursor.execute("SELECT product_url, id, content_hash FROM products ORDER BY id")
+            while True:
+                rows = self.cursor.fetchmany(10000)
+                if not rows:
+                    break
+                for product_url, product_id, content_hash in rows:
+                    self.product_ids.setdefault(product_url, product_id)
+                    if content_hash is not None:
+                        self.product_hashes[product_id] = bytes(content_hash)
+
+            self.cursor.execute("""
+                SELECT product_id, price FROM (
+                    SELECT product_id, price,
+                           ROW_NUMBER() OVER (PARTITION BY product_id
+                                              ORDER BY created_at DESC, id DESC) AS position
+                    FROM prices
+                ) AS latest
+                WHERE position = 1
+            """)
+            while True:
+                rows = self.cursor.fetchmany(10000)
+                if not rows:
+                    break
+                for product_id, price in rows:
+                    self.last_prices[product_id] = price
+
+            logging.info(
+                f"Loaded id caches: {len(self.retailer_ids)} retailers, "
+                f"{len(self.category_ids)} categories, {len(self.product_ids)} products, "
+                f"{len(self.last_prices)} latest prices"
+            )
+        except Exception as e:
+            logging.error(f"Error loading id caches: {e}")
+            raise
+
+    def _cache(self, mapping: dict, key: Any, value: Any) -> Any:
+        """Update a cache, tracking the change until the transaction that made it commits"""
+        self._uncommitted.append((mapping, key, mapping.get(key, _MISSING)))
+        mapping[key] = value
+        return value
+
+    def _commit(self):
+        self.conn.commit()
+        self._uncommitted.clear()
+
+    def _rollback(self):
+        self.conn.rollback()
+        self.changes.clear()
+        # Ids, hashes and prices written inside the rolled back transaction no longer exist
+        for mapping, key, previous in reversed(self._uncommitted):
+            if previous is _MISSING:
+                mapping.pop(key, None)
+            else:
+                mapping[key] = previous
+        self._uncommitted.clear()
+
+    def _note_change(self, product_id: int, kind: str, old_price: float = None,
+                     new_price: float = None) -> None:
+        """Remember a product change for catalog_changes, one row per product and transaction.
+
+        kind is 'created', 'updated' or 'price'; a product created or updated
+        in the same transaction as its price changed keeps that kind and
+        carries the prices too.
+        """
+        if not self.change_feed:
+            return
+        change = self.changes.setdefault(product_id, ['price', None, None])
+        if kind != 'price':
+            change[0] = kind
+        if new_price is not None:
+            change[1], change[2] = old_price, new_price
+
+    def _flush_changes(self) -> None:
+        """Write the noted changes inside the open transaction, so they commit with it"""
+        if not self.changes:
+            return
+        run_id = self.stats.get_value('crawl_run/run_id') if self.stats is not None else None
+        rows = [(product_id, kind, old_price, new_price, run_id)
+                for product_id, (kind, old_price, new_price) in self.changes.items()]
+        self.changes.clear()
+        self._write_changes(rows)
+
+    def _write_changes(self, rows: List[tuple]) -> None:
+        """Append (product_id, change_kind, old_price, new_price, run_id) rows to catalog_changes"""
+        self.cursor.executemany("""
+            INSERT INTO catalog_changes (product_id, change_kind, old_price, new_price, run_id)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+        self._inc_stat('db/catalog_changes', len(rows))
+
+    def _inc_stat(self, key: str, count: int = 1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
+
+    def _committed(self, items: List[Dict[str, Any]]) -> None:
+        """Count committed items and send items_committed for them"""
+        self._count_written(items)
+        if self.signals is None:
+            return
+        product_urls = [item['product_url'] for item in items]
+        if self.writer is not None:
+            # Signal handlers run on the reactor thread, not the writer
+            from twisted.internet import reactor
+            reactor.callFromThread(self.signals.send_catch_log, signal=items_committed, product_urls=product_urls)
+        else:
+            self.signals.send_catch_log(signal=items_committed, product_urls=product_urls)
+
+    def _count_written(self, items: List[Dict[str, Any]]) -> None:
+        """Count committed items, in total and per retailer, for the crawl ledger"""
+        self._inc_stat('db/items_written', len(items))
+        for item in items:
+            self._inc_stat(f"db/items_written/{item['retailer']}")
+
+    def _ensure_staging_tables(self):
+        """Create the session-scoped staging tables used for set-based writes"""
+        try:
+            self.cursor.execute("""
+                IF OBJECT_ID('tempdb..#staging_products') IS NULL
+                CREATE TABLE #staging_products (
+                    [product_url] nvarchar(2000),
+                    [content_hash] binary(16),
+                    [name] nvarchar(500),
+                    [image_url] nvarchar(2000),
+                    [description] nvarchar(max),
+                    [category_id] integer,
+                    [retailer_id] integer
+                )
+            """)
+            self.cursor.execute("""
+                IF OBJECT_ID('tempdb..#seen_products') IS NULL
+                CREATE TABLE #seen_products ([id] integer PRIMARY KEY)
+            """)
+            self.conn.commit()
+        except Exception as e:
+            logging.error(f"Error creating staging tables: {e}")
+            self.conn.rollback()
+            raise
+
+    @property
+    def batching(self) -> bool:
+        return self.batch_size > 1
+
+    def open_spider(self, spider):
+        """Connect and warm the id caches before the first item arrives"""
+        if self.writer_queue_size:
+            from twisted.internet.defer import DeferredSemaphore
+            from twisted.python.threadpool import ThreadPool
+
+            # pyodbc connections must not be shared between threads, so one thread owns it
+            self.writer = ThreadPool(minthreads=1, maxthreads=1, name='db-writer')
+            self.writer.start()
+            self.writer_slots = DeferredSemaphore(self.writer_queue_size)
+            return self._in_writer(self.connect_to_db)
+
+        if not self.conn:
+            self.connect_to_db()
+
+    def _in_writer(self, func, *args):
+        """Run func on the writer thread, returning a Deferred with its result"""
+        from twisted.internet import reactor, threads
+        return threads.deferToThreadPool(reactor, self.writer, func, *args)
+
+    def process_item(self, item: Dict[str, Any], spider):
         """Process and store item in Azure SQL Database"""
+        if self.writer is not None:
+            # Items wait for a free slot once the writer queue is full, which holds
+            # them in Scrapy's scraper slot and throttles new downloads
+            return self.writer_slots.run(self._in_writer, self._write_item, item)
+        return self._write_item(item)
+
+    def _write_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a single item, either directly or through the batch buffer"""
+        if item['product_url'] in self.seen_urls:
+            self._inc_stat('db/duplicates_dropped')
+            raise DropItem(f"Duplicate product in this crawl: {item['product_url']}")
+        self.seen_urls.add(item['product_url'])
+
+        if item.get('price_only'):
+            if not self.conn:
+                self.connect_to_db()
+            if item['product_url'] not in self.product_ids:
+                # Price-only items carry no product details to insert the product with
+                self._inc_stat('db/price_only_unknown')
+                raise DropItem(f"Price-only item for unknown product: {item['product_url']}")
+
+        if self.batching:
+            return self._buffer_item(item)
+
         try:
             if not self.conn:
                 self.connect_to_db()
                 
+            if item.get('price_only'):
+                self._insert_price(self._known_product_id(item), item['price'])
+                if self._uncommitted:
+                    self._flush_changes()
+                    self._commit()
+                self._committed([item])
+                return item
+
             # Process each component
             retailer_id = self._get_or_create_retailer(item['retailer'])
             category_id = self._get_or_create_category(item['category'])
             product_id = self._upsert_product(item, retailer_id, category_id)
             self._insert_price(product_id, item['price'])
             
-            self.conn.commit()
+            # Every write updates a cache, so an empty change list means nothing to commit
+            if self._uncommitted:
+                self._flush_changes()
+                self._commit()
+            self._committed([item])
             return item
             
         except Exception as e:
             if self.conn:
-                self.conn.rollback()
+                self._rollback()
             logging.error(f"Error processing item: {e}")
             raise
 
+    def _buffer_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue item for the next batch, flushing when the batch is full or stale"""
+        if not self.conn:
+            self.connect_to_db()
+
+        self.buffer.append(item)
+        if len(self.buffer) >= self.batch_size or self._batch_expired():
+            self.flush()
+        return item
+
+    def _batch_expired(self) -> bool:
+        if not self.batch_interval:
+            return False
+        return time.monotonic() - self.last_flush >= self.batch_interval
+
+    def flush(self) -> None:
+        """Write all buffered items to the database in a single transaction.
+
+        If the batch fails, it is rolled back and its items are written again
+        one per transaction, so one bad item does not lose the rest. Items
+        that still fail are logged and counted under db/items_failed.
+        """
+        if not self.buffer:
+            return
+
+        items, self.buffer = self.buffer, []
+        self.last_flush = time.monotonic()
+        try:
+            self._write_batch(items)
+            return
+        except Exception as e:
+            logging.error(f"Error flushing batch of {len(items)} items, retrying them one at a time: {e}")
+            self._inc_stat('db/batch_failures')
+            if len(items) == 1:
+                self._drop_failed(items[0], e)
+                return
+
+        for item in items:
+            try:
+                self._write_batch([item])
+            except Exception as e:
+                self._drop_failed(item, e)
+
+    def _drop_failed(self, item: Dict[str, Any], error: Exception) -> None:
+        logging.error(f"Dropped item {item['product_url']} after it failed to write: {error}")
+        self._inc_stat('db/items_failed')
+        self.seen_urls.discard(item['product_url'])
+
+    def _write_batch(self, items: List[Dict[str, Any]]) -> None:
+        """Write items in one transaction, rolling it back and raising if any write fails"""
+        try:
+            # Only new and changed products are staged for the MERGE
+            rows = {}
+            prices = {}
+            for item in items:
+                if item.get('price_only'):
+                    product_id = self._known_product_id(item)
+                    if self._price_changed(product_id, item['price']):
+                        prices[item['product_url']] = (item['price'], self._observed_at(item))
+                    else:
+                        self._inc_stat('db/writes_avoided/price_insert')
+                    continue
+
+                retailer_id = self._get_or_create_retailer(item['retailer'])
+                category_id = self._get_or_create_category(item['category'])
+                product_id = self.product_ids.get(item['product_url'])
+                content_hash = self._content_hash(item, retailer_id, category_id)
+
+                if product_id is None or self.product_hashes.get(product_id) != content_hash:
+                    rows[item['product_url']] = (
+                        item['product_url'], content_hash, item['product_name'],
+                        item['image_url'], item.get('product_description', ''),
+                        category_id, retailer_id
+                    )
+                else:
+                    self.unchanged_ids.append(product_id)
+                    self._inc_stat('db/writes_avoided/product_update')
+
+                if product_id is None or self._price_changed(product_id, item['price']):
+                    prices[item['product_url']] = (item['price'], self._observed_at(item))
+                else:
+                    self._inc_stat('db/writes_avoided/price_insert')
+
+            if rows:
+                for product_id, product_url, content_hash in self._write_products(list(rows.values())):
+                    self._note_change(product_id, 'updated' if product_url in self.product_ids else 'created')
+                    self._cache(self.product_ids, product_url, product_id)
+                    self._cache(self.product_hashes, product_id, bytes(content_hash))
+
+            if prices:
+                price_rows = [(self.product_ids[url], price, observed_at)
+                              for url, (price, observed_at) in prices.items()]
+                self._write_prices(price_rows)
+                for product_id, price, _ in price_rows:
+                    self._note_change(product_id, 'price', self.last_prices.get(product_id), price)
+                    self._cache(self.last_prices, product_id, price)
+
+            self._mark_unchanged_seen()
+            self._flush_changes()
+            self._commit()
+            self._committed(items)
+
+        except Exception:
+            if self.conn:
+                self._rollback()
+            raise
+
+    def _write_products(self, rows: List[tuple]) -> List[tuple]:
+        """Upsert staged product rows, returning (id, product_url, content_hash) for each"""
+        self.cursor.executemany("""
+            INSERT INTO #staging_products (product_url, content_hash, name, image_url,
+                                           description, category_id, retailer_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+        self.cursor.execute("""
+            MERGE products AS target
+            USING #staging_products AS source
+            ON target.product_url = source.product_url
+            WHEN MATCHED THEN
+                UPDATE SET name = source.name, image_url = source.image_url,
+                           description = source.description,
+                           category_id = source.category_id,
+                           retailer_id = source.retailer_id,
+                           content_hash = source.content_hash,
+                           last_seen_at = GETDATE()
+            WHEN NOT MATCHED THEN
+                INSERT (name, image_url, product_url, description, category_id,
+                        retailer_id, content_hash, last_seen_at)
+                VALUES (source.name, source.image_url, source.product_url,
+                        source.description, source.category_id, source.retailer_id,
+                        source.content_hash, GETDATE())
+            OUTPUT INSERTED.id, INSERTED.product_url, INSERTED.content_hash;
+        """)
+        written = self.cursor.fetchall()
+        self.cursor.execute("TRUNCATE TABLE #staging_products")
+        return written
+
+    def _observed_at(self, item: Dict[str, Any]) -> Optional[datetime]:
+        """When the item's price was seen: its scrape_date with scrape_dates set, else None for now"""
+        if not self.scrape_dates:
+            return None
+        try:
+            return datetime.fromisoformat(item['scrape_date'])
+        except (KeyError, TypeError, ValueError):
+            logging.warning(f"Item {item['product_url']} has no valid scrape_date, dating its price now")
+            return datetime.now()
+
+    def _write_prices(self, price_rows: List[Tuple[int, float, Optional[datetime]]]) -> None:
+        """Insert (product_id, price, observed_at) rows and make them the products' current prices.
+
+        observed_at is None for prices seen now. A dated price only becomes the
+        current price if it is newer than the one the product already has.
+        """
+        if not self.scrape_dates:
+            self.cursor.executemany(
+                "INSERT INTO prices (product_id, price) VALUES (?, ?)",
+                [(product_id, price) for product_id, price, _ in price_rows]
+            )
+            self.cursor.executemany(
+                "UPDATE products SET current_price = ?, current_price_at = GETDATE() WHERE id = ?",
+                [(price, product_id) for product_id, price, _ in price_rows]
+            )
+            return
+        self.cursor.executemany("INSERT INTO prices (product_id, price, created_at) VALUES (?, ?, ?)", price_rows)
+        self.cursor.executemany(
+            "UPDATE products SET current_price = ?, current_price_at = ? "
+            "WHERE id = ? AND (current_price_at IS NULL OR current_price_at <= ?)",
+            [(price, observed_at, product_id, observed_at) for product_id, price, observed_at in price_rows]
+        )
+
     def _get_or_create_retailer(self, retailer_name: str) -> int:
         """Get or create retailer and return id"""
+        if retailer_name in self.retailer_ids:
+            return self.retailer_ids[retailer_name]
+
         try:
             # Check if retailer exists
             self.cursor.execute("SELECT id FROM retailers WHERE name = ?", (retailer_name,))
             result = self.cursor.fetchone()
             
             if result:
-                return result[0]
+                return self._cache(self.retailer_ids, retailer_name, result[0])
             
             # Create new retailer if it doesn't exist
             self.cursor.execute(
                 "INSERT INTO retailers (name) OUTPUT INSERTED.id VALUES (?)",
                 (retailer_name,)
             )
-            return self.cursor.fetchone()[0]
+            return self._cache(self.retailer_ids, retailer_name, self.cursor.fetchone()[0])
             
         except Exception as e:
             logging.error(f"Error in _get_or_create_retailer: {e}")
@@ -130,20 +861,23 @@ class AzureDBPipeline:
 
     def _get_or_create_category(self, category_name: str) -> int:
         """Get or create category and return id"""
+        if category_name in self.category_ids:
+            return self.category_ids[category_name]
+
         try:
             # Check if category exists
             self.cursor.execute("SELECT id FROM categories WHERE name = ?", (category_name,))
             result = self.cursor.fetchone()
             
             if result:
-                return result[0]
+                return self._cache(self.category_ids, category_name, result[0])
             
             # Create new category if it doesn't exist
             self.cursor.execute(
                 "INSERT INTO categories (name) OUTPUT INSERTED.id VALUES (?)",
                 (category_name,)
             )
-            return self.cursor.fetchone()[0]
+            return self._cache(self.category_ids, category_name, self.cursor.fetchone()[0])
             
         except Exception as e:
             logging.error(f"Error in _get_or_create_category: {e}")
@@ -152,56 +886,180 @@ class AzureDBPipeline:
     def _upsert_product(self, item: Dict[str, Any], retailer_id: int, category_id: int) -> int:
         """Insert or update product and return id"""
         try:
-            # Check if product exists based on product_url
-            self.cursor.execute(
-                "SELECT id FROM products WHERE product_url = ?",
-                (item['product_url'],)
-            )
-            result = self.cursor.fetchone()
+            content_hash = self._content_hash(item, retailer_id, category_id)
+            product_id = self.product_ids.get(item['product_url'])
+            if product_id is None:
+                # Check if product exists based on product_url
+                self.cursor.execute(
+                    "SELECT id FROM products WHERE product_url = ?",
+                    (item['product_url'],)
+                )
+                result = self.cursor.fetchone()
+                if result:
+                    product_id = self._cache(self.product_ids, item['product_url'], result[0])
             
-            if result:
+            if product_id is not None:
+                if self.product_hashes.get(product_id) == content_hash:
+                    # Nothing changed, only remember that the product was seen
+                    self.unchanged_ids.append(product_id)
+                    self._inc_stat('db/writes_avoided/product_update')
+                    return product_id
+
                 # Update existing product
                 self.cursor.execute("""
                     UPDATE products 
                     SET name = ?, image_url = ?, description = ?, 
-                        category_id = ?, retailer_id = ?
+                        category_id = ?, retailer_id = ?,
+                        content_hash = ?, last_seen_at = GETDATE()
                     WHERE id = ?
                 """, (
                     item['product_name'], item['image_url'],
                     item.get('product_description', ''),
-                    category_id, retailer_id, result[0]
+                    category_id, retailer_id, content_hash, product_id
                 ))
-                return result[0]
+                self._note_change(product_id, 'updated')
+                self._cache(self.product_hashes, product_id, content_hash)
+                return product_id
             
             # Insert new product
             self.cursor.execute("""
                 INSERT INTO products (name, image_url, product_url, description, 
-                                    category_id, retailer_id)
+                                    category_id, retailer_id, content_hash, last_seen_at)
                 OUTPUT INSERTED.id
-                VALUES (?, ?, ?, ?, ?, ?)
+                VALUES (?, ?, ?, ?, ?, ?, ?, GETDATE())
             """, (
                 item['product_name'], item['image_url'], item['product_url'],
                 item.get('product_description', ''),
-                category_id, retailer_id
+                category_id, retailer_id, content_hash
             ))
-            return self.cursor.fetchone()[0]
+            product_id = self._cache(self.product_ids, item['product_url'], self.cursor.fetchone()[0])
+            self._note_change(product_id, 'created')
+            self._cache(self.product_hashes, product_id, content_hash)
+            return product_id
             
         except Exception as e:
             logging.error(f"Error in _upsert_product: {e}")
             raise
 
     def _insert_price(self, product_id: int, price: float) -> None:
-        """Insert new price record"""
+        """Insert new price record if the price changed since it was last recorded"""
+        if not self._price_changed(product_id, price):
+            self._inc_stat('db/writes_avoided/price_insert')
+            return
+
         try:
             self.cursor.execute(
                 "INSERT INTO prices (product_id, price) VALUES (?, ?)",
                 (product_id, price)
             )
+            self.cursor.execute(
+                "UPDATE products SET current_price = ?, current_price_at = GETDATE() WHERE id = ?",
+                (price, product_id)
+            )
+            self._note_change(product_id, 'price', self.last_prices.get(product_id), price)
+            self._cache(self.last_prices, product_id, price)
         except Exception as e:
             logging.error(f"Error in _insert_price: {e}")
             raise
 
+    def _known_product_id(self, item: Dict[str, Any]) -> int:
+        """Id of the product a price-only item updates, which counts as seen unchanged"""
+        product_id = self.product_ids[item['product_url']]
+        self.unchanged_ids.append(product_id)
+        self._inc_stat('db/writes_avoided/product_update')
+        return product_id
+
+    @staticmethod
+    def _content_hash(item: Dict[str, Any], retailer_id: int, category_id: int) -> bytes:
+        """Digest of the product columns, used to skip rewriting unchanged products"""
+        content = '\x1f'.join(str(value) for value in (
+            item['product_name'], item['image_url'],
+            item.get('product_description', ''), category_id, retailer_id
+        ))
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+    def _price_changed(self, product_id: int, price: float) -> bool:
+        return self.last_prices.get(product_id, _MISSING) != price
+
+    def _mark_unchanged_seen(self) -> None:
+        """Set last_seen_at on unchanged products with one set-based UPDATE"""
+        if not self.unchanged_ids:
+            return
+
+        product_ids, self.unchanged_ids = self.unchanged_ids, []
+        try:
+            self.cursor.executemany(
+                "INSERT INTO #seen_products (id) VALUES (?)",
+                [(product_id,) for product_id in set(product_ids)]
+            )
+            self.cursor.execute("""
+                UPDATE products SET last_seen_at = GETDATE()
+                FROM products JOIN #seen_products ON #seen_products.id = products.id
+            """)
+            self.cursor.execute("TRUNCATE TABLE #seen_products")
+        except Exception as e:
+            logging.error(f"Error in _mark_unchanged_seen: {e}")
+            raise
+
+    def spider_idle(self, spider):
+        """Write out a partially filled batch while the crawl is waiting for work"""
+        if not self.batching:
+            return
+        if self.writer is not None:
+            self._in_writer(self.flush).addErrback(
+                lambda failure: logging.error(f"Error flushing idle batch: {failure.value}")
+            )
+        elif self.conn:
+            self.flush()
+
     def close_spider(self, spider):
-        """Close database connection when spider closes"""
+        """Flush buffered items and close database connection when spider closes"""
+        if self.writer is not None:
+            # Queued after every pending write, so the final flush sees all items
+            d = self._in_writer(self._close_connection)
+            d.addBoth(self._stop_writer)
+            return d
+        self._close_connection()
+
+    def _stop_writer(self, result):
+        self.writer.stop()
+        self.writer = None
+        return result
+
+    def _close_connection(self):
+        """Write out remaining work and close the connection"""
         if self.conn:
-            self.conn.close()
\ No newline at end of file
+            try:
+                self.flush()
+                if self.unchanged_ids:
+                    self._mark_unchanged_seen()
+                    self._commit()
+            finally:
+                self.conn.close()
+
+
+class DBPipeline:
+    """Item pipeline entry point that builds the pipeline for the current settings.
+
+    Items go to the local spool when SPOOL_ENABLED is set, and to the database
+    named by DB_BACKEND otherwise.
+    """
+
+    BACKENDS = {
+        'azure': 'myproject.database.AzureDBPipeline',
+        'postgres': 'myproject.postgres.PostgresPipeline',
+    }
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.getbool('SPOOL_ENABLED'):
+            return load_object('myproject.spool.SpoolPipeline').from_crawler(crawler)
+        return cls.pipeline_class(crawler.settings).from_crawler(crawler)
+
+    @classmethod
+    def pipeline_class(cls, settings):
+        """Database pipeline class for the DB_BACKEND setting"""
+        backend = settings.get('DB_BACKEND', 'azure')
+        if backend not in cls.BACKENDS:
+            raise ValueError(f"Unknown DB_BACKEND {backend!r}, expected one of {sorted(cls.BACKENDS)}")
+        return load_object(cls.BACKENDS[backend])
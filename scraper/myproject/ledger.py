@@ -0,0 +1,152 @@
+import logging
+import uuid
+from datetime import datetime
+from statistics import median
+from typing import Any, Dict, List
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from myproject.database import AzureDBPipeline, DBPipeline
+
+
+def _new_counts() -> Dict[str, int]:
+    return {column: 0 for column in AzureDBPipeline.LEDGER_COUNTS}
+
+
+class CrawlLedger:
+    """Write a crawl_runs row, with one child row per retailer, for every crawl.
+
+    Counts pages fetched, items yielded, errors and bytes downloaded per
+    retailer from the crawl's signals, takes items written from the
+    pipeline's db/items_written stats and the database time from the stage
+    metrics. The row is written through the DB_BACKEND pipeline class on its
+    own connection when the spider closes.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.settings = crawler.settings
+        self.stats = crawler.stats
+        self.run_id = str(uuid.uuid4())
+        self.started_at = None
+        self.retailers: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CRAWL_LEDGER_ENABLED'):
+            raise NotConfigured
+        if crawler.settings.getbool('SPOOL_ENABLED'):
+            # Spooled crawls leave the database alone until the spool is loaded
+            raise NotConfigured
+        ledger = cls(crawler)
+        crawler.signals.connect(ledger.spider_opened, signal=signals.spider_opened)
+        # response_downloaded also sees pages the conditional request check drops
+        crawler.signals.connect(ledger.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(ledger.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ledger.spider_error, signal=signals.spider_error)
+        crawler.signals.connect(ledger.item_error, signal=signals.item_error)
+        crawler.signals.connect(ledger.spider_closed, signal=signals.spider_closed)
+        return ledger
+
+    def _counts(self, retailer) -> Dict[str, int]:
+        retailer = retailer or 'unknown'
+        if retailer not in self.retailers:
+            self.retailers[retailer] = _new_counts()
+        return self.retailers[retailer]
+
+    def spider_opened(self, spider):
+        self.started_at = datetime.now()
+        # Run id shared with the rest of the crawl through the stats
+        self.stats.set_value('crawl_run/run_id', self.run_id)
+
+    def response_downloaded(self, response, request, spider):
+        counts = self._counts(request.meta.get('retailer'))
+        counts['pages_fetched'] += 1
+        counts['bytes_downloaded'] += len(response.body)
+        if response.status >= 400:
+            counts['errors'] += 1
+
+    def item_scraped(self, item, response, spider):
+        self._counts(item.get('retailer'))['items_yielded'] += 1
+
+    def spider_error(self, failure, response, spider):
+        self._counts(response.meta.get('retailer') if response is not None else None)['errors'] += 1
+
+    def item_error(self, item, response, spider, failure):
+        self._counts(item.get('retailer'))['errors'] += 1
+
+    def spider_closed(self, spider, reason):
+        finished_at = datetime.now()
+        for retailer, counts in self.retailers.items():
+            counts['items_written'] = self.stats.get_value(f'db/items_written/{retailer}', 0)
+
+        run = {column: sum(counts[column] for counts in self.retailers.values())
+               for column in AzureDBPipeline.LEDGER_COUNTS}
+        # Download exceptions carry no retailer, so the run total comes from the stats
+        run['errors'] += self.stats.get_value('downloader/exception_count', 0)
+
+        db_seconds = None
+        metrics = getattr(self.crawler, 'stage_metrics', None)
+        if metrics is not None:
+            db_seconds = sum(histogram.sum for (stage, _), histogram in metrics.histograms.items()
+                             if stage == 'db')
+        elapsed = (finished_at - (self.started_at or finished_at)).total_seconds()
+        run.update({
+            'run_id': self.run_id,
+            'spider': spider.name,
+            'mode': getattr(spider, 'mode', None),
+            'started_at': self.started_at,
+            'finished_at': finished_at,
+            'finish_reason': reason,
+            'db_seconds': db_seconds,
+            'db_time_share': db_seconds / elapsed if db_seconds is not None and elapsed else None,
+        })
+
+        pipeline = DBPipeline.pipeline_class(self.settings)()
+        try:
+            pipeline.record_crawl_run(run, self.retailers)
+            logging.info(f"Recorded crawl run {self.run_id}: {run['pages_fetched']} pages, "
+                         f"{run['items_yielded']} items yielded, {run['items_written']} written")
+        finally:
+            if pipeline.conn:
+                pipeline.conn.close()
+
+
+def throughput(run: Dict[str, Any], counts: Dict[str, Any] = None) -> float:
+    """Pages fetched per second of the run, for the run or one of its retailers"""
+    elapsed = (run['finished_at'] - run['started_at']).total_seconds()
+    return (counts or run)['pages_fetched'] / elapsed if elapsed > 0 else 0.0
+
+
+def find_regressions(latest: Dict[str, Any], baseline: List[Dict[str, Any]],
+                     throughput_ratio: float, yield_ratio: float) -> List[str]:
+    """Regressions of the latest run against the median of the baseline runs.
+
+    Throughput (pages per second) is flagged when it falls below
+    throughput_ratio of the baseline, and items yielded or written when they
+    fall below yield_ratio, for the whole run and for each retailer.
+    """
+    regressions = []
+    scopes = [('run', latest, [(run, run) for run in baseline])]
+    for retailer, counts in sorted(latest['retailers'].items()):
+        scopes.append((retailer, counts, [
+            (run, run['retailers'][retailer]) for run in baseline if retailer in run['retailers']
+        ]))
+
+    for scope, counts, history in scopes:
+        if not history:
+            continue
+        checks = (
+            ('pages/sec', throughput(latest, counts), [throughput(run, c) for run, c in history],
+             throughput_ratio),
+            ('items yielded', counts['items_yielded'], [c['items_yielded'] for _, c in history], yield_ratio),
+            ('items written', counts['items_written'], [c['items_written'] for _, c in history], yield_ratio),
+        )
+        for metric, value, values, ratio in checks:
+            base = median(values)
+            if base > 0 and value < base * ratio:
+                regressions.append(
+                    f"{scope}: {metric} {value:.1f} is {value / base:.0%} of the baseline median {base:.1f}"
+                )
+    return regressions
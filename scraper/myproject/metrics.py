@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+from bisect import bisect_left
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+# Histogram bucket upper bounds in seconds, doubling from 10us to about 84s
+BUCKETS = tuple(1e-5 * 2 ** i for i in range(24))
+
+
+class Histogram:
+    """Latency histogram over the fixed BUCKETS, with a final +Inf bucket"""
+
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q quantile, capped at the largest value seen"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': [[bound, count] for bound, count in zip(BUCKETS + (None,), self.counts)],
+        }
+
+
+class StageMetrics:
+    """Latency histograms and counters of one crawl, keyed by (stage, name).
+
+    Stages are 'download' (per retailer), 'parse' (per callback), 'clean' and
+    'db' (per pipeline call). Recording a value is a perf_counter pair and a
+    bisect, well under a microsecond.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.counters: Dict[Tuple[str, str], float] = {}
+
+    def histogram(self, stage: str, name: str) -> Histogram:
+        key = (stage, name)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        return self.histograms[key]
+
+    def observe(self, stage: str, name: str, seconds: float) -> None:
+        self.histogram(stage, name).observe(seconds)
+
+    def inc(self, stage: str, name: str, count: float = 1) -> None:
+        self.counters[(stage, name)] = self.counters.get((stage, name), 0) + count
+
+    def timed(self, stage: str, name: str, func: Callable) -> Callable:
+        """Wrap func so that every call is recorded in the (stage, name) histogram"""
+        observe = self.histogram(stage, name).observe
+
+        def timed_call(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(perf_counter() - start)
+
+        return timed_call
+
+    def to_stats(self) -> Dict[str, Any]:
+        """Flat summary for the Scrapy stats collector"""
+        stats = {}
+        for (stage, name), histogram in sorted(self.histograms.items()):
+            if not histogram.count:
+                continue
+            prefix = f'metrics/{stage}/{name}'
+            stats[f'{prefix}/count'] = histogram.count
+            stats[f'{prefix}/seconds'] = round(histogram.sum, 6)
+            stats[f'{prefix}/p50_ms'] = round(histogram.quantile(0.5) * 1000, 3)
+            stats[f'{prefix}/p95_ms'] = round(histogram.quantile(0.95) * 1000, 3)
+            stats[f'{prefix}/max_ms'] = round(histogram.max * 1000, 3)
+        for (stage, name), value in sorted(self.counters.items()):
+            stats[f'metrics/{stage}/{name}/total'] = value
+        return stats
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'histograms': {
+                f'{stage}/{name}': histogram.to_dict()
+                for (stage, name), histogram in sorted(self.histograms.items())
+            },
+            'counters': {f'{stage}/{name}': value for (stage, name), value in sorted(self.counters.items())},
+        }
+
+    def to_prometheus(self, prefix: str = 'shopwise_crawl') -> str:
+        """Prometheus text exposition format"""
+        lines = [
+            f'# HELP {prefix}_stage_seconds Time spent in each crawl stage',
+            f'# TYPE {prefix}_stage_seconds histogram',
+        ]
+        for (stage, name), histogram in sorted(self.histograms.items()):
+            labels = f'stage="{stage}",name="{name}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{prefix}_stage_seconds_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f'{prefix}_stage_seconds_sum{{{labels}}} {histogram.sum}')
+            lines.append(f'{prefix}_stage_seconds_count{{{labels}}} {histogram.count}')
+        lines += [
+            f'# HELP {prefix}_stage_total Counters of each crawl stage',
+            f'# TYPE {prefix}_stage_total counter',
+        ]
+        for (stage, name), value in sorted(self.counters.items()):
+            lines.append(f'{prefix}_stage_total{{stage="{stage}",name="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def stage_metrics(crawler) -> Optional[StageMetrics]:
+    """The crawl's shared StageMetrics, or None when METRICS_ENABLED is off"""
+    if not crawler.settings.getbool('METRICS_ENABLED'):
+        return None
+    if getattr(crawler, 'stage_metrics', None) is None:
+        crawler.stage_metrics = StageMetrics()
+    return crawler.stage_metrics
+
+
+class StageMetricsExtension:
+    """Record download latency per retailer and publish every stage's metrics.
+
+    Parse, cleaning and database timings are recorded by
+    StageTimingMiddleware, GrocerySpider and the database pipeline into the
+    same StageMetrics. At spider close the summary goes to the crawl stats
+    and, when METRICS_JSON_FILE / METRICS_PROMETHEUS_FILE are set, to those
+    files.
+    """
+
+    def __init__(self, metrics: StageMetrics, stats, json_file=None, prometheus_file=None):
+        self.metrics = metrics
+        self.stats = stats
+        self.json_file = json_file
+        self.prometheus_file = prometheus_file
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        metrics = stage_metrics(crawler)
+        if metrics is None:
+            raise NotConfigured
+        extension = cls(
+            metrics, crawler.stats,
+            json_file=crawler.settings.get('METRICS_JSON_FILE'),
+            prometheus_file=crawler.settings.get('METRICS_PROMETHEUS_FILE'),
+        )
+        # response_downloaded also sees pages the conditional request check drops
+        crawler.signals.connect(extension.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def response_downloaded(self, response, request, spider):
+        retailer = request.meta.get('retailer', 'unknown')
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.metrics.observe('download', retailer, latency)
+        self.metrics.inc('download_bytes', retailer, len(response.body))
+
+    def spider_closed(self, spider, reason):
+        for key, value in self.metrics.to_stats().items():
+            self.stats.set_value(key, value)
+
+        substitutions = {'spider': spider.name, 'time': datetime.now().strftime('%Y%m%dT%H%M%S')}
+        if self.json_file:
+            path = self.json_file % substitutions
+            document = dict(self.metrics.to_json(), spider=spider.name, reason=reason,
+                            finished=datetime.now().isoformat())
+            self._write(path, json.dumps(document, indent=2))
+        if self.prometheus_file:
+            self._write(self.prometheus_file % substitutions, self.metrics.to_prometheus())
+
+    @staticmethod
+    def _write(path: str, text: str) -> None:
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+            logging.info(f"Wrote crawl metrics to {path}")
+        except OSError as e:
+            logging.error(f"Error writing crawl metrics to {path}: {e}")
+
+
+class StageTimingMiddleware:
+    """Spider middleware timing each callback, per callback name.
+
+    Only the time spent inside the callback's own code is counted: the
+    callback's output is timed one next() at a time, so the middlewares and
+    pipelines that consume it are left out. Asynchronous output, which newer
+    Scrapy passes to every spider middleware, is timed the same way.
+    """
+
+    def __init__(self, metrics: StageMetrics):
+        self.metrics = metrics
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        metrics = stage_metrics(crawler)
+        if metrics is None:
+            raise NotConfigured
+        return cls(metrics)
+
+    def process_spider_output(self, response, result, spider):
+        callback = response.request.callback if response.request else None
+        histogram = self.metrics.histogram('parse', getattr(callback, '__name__', None) or 'parse')
+        iterator = iter(result)
+        elapsed = 0.0
+        while True:
+            start = perf_counter()
+            try:
+                output = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += perf_counter() - start
+            yield output
+        histogram.observe(elapsed)
+
+    async def process_spider_output_async(self, response, result, spider):
+        """process_spider_output for asynchronous callback output, timed one __anext__ at a time"""
+        callback = response.request.callback if response.request else None
+        histogram = self.metrics.histogram('parse', getattr(callback, '__name__', None) or 'parse')
+        iterator = result.__aiter__()
+        elapsed = 0.0
+        while True:
+            start = perf_counter()
+            try:
+                output = await iterator.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                elapsed += perf_counter() - start
+            yield output
+        histogram.observe(elapsed)
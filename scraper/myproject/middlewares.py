@@ -4,9 +4,13 @@
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+import hashlib
 import random
+import sqlite3
 from scrapy.downloadermiddlewares.useragent import UserAgentMiddleware
 from scrapy.utils.project import get_project_settings
+from myproject.signals import items_committed
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -119,4 +123,258 @@ class RotateUserAgentMiddleware(UserAgentMiddleware):
 
     def process_request(self, request, spider):
         if self.user_agents:
-            request.headers['User-Agent'] = random.choice(self.user_agents)
\ No newline at end of file
+            request.headers['User-Agent'] = random.choice(self.user_agents)
+
+class ConditionalRequestMiddleware:
+    """Skip product pages that have not changed since the previous crawl.
+
+    Stores the ETag, Last-Modified and a body hash per URL in a local SQLite
+    file and revalidates requests marked with ``meta['conditional']`` using
+    If-None-Match / If-Modified-Since. A 304, or a 200 whose body hashes the
+    same as last time, is dropped with IgnoreRequest before it reaches the
+    spider, so it produces no item and no database write. The request's
+    ``meta['not_modified']`` is set first, for errbacks that need to tell it
+    apart from other failures.
+    """
+
+    def __init__(self, db_path, stats=None, commit_every=500):
+        self.db_path = db_path
+        self.stats = stats
+        self.commit_every = commit_every
+        self.pending = 0
+        # Validators of scraped pages whose items are not committed yet, by product_url
+        self.uncommitted = {}
+        # Items committed before their item_scraped signal was sent
+        self.committed_early = set()
+        # WAL and a lock timeout let the workers of a sharded crawl share the file
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS validators (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash BLOB
+            )
+        """)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('CONDITIONAL_REQUESTS_ENABLED'):
+            raise NotConfigured
+        middleware = cls(
+            crawler.settings.get('CONDITIONAL_REQUESTS_DB', 'conditional.sqlite'),
+            stats=crawler.stats,
+            commit_every=crawler.settings.getint('CONDITIONAL_REQUESTS_COMMIT_EVERY', 500),
+        )
+        crawler.signals.connect(middleware.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(middleware.items_committed, signal=items_committed)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def _validators(self, url):
+        return self.conn.execute(
+            "SELECT etag, last_modified, body_hash FROM validators WHERE url = ?", (url,)
+        ).fetchone()
+
+    def process_request(self, request, spider):
+        if not request.meta.get('conditional'):
+            return None
+
+        stored = self._validators(request.url)
+        if stored:
+            etag, last_modified, _ = stored
+            if etag:
+                request.headers.setdefault('If-None-Match', etag)
+            if last_modified:
+                request.headers.setdefault('If-Modified-Since', last_modified)
+        return None
+
+    def process_response(self, request, response, spider):
+        if not request.meta.get('conditional'):
+            return response
+
+        if response.status == 304:
+            self.stats.inc_value('conditional/not_modified')
+            request.meta['not_modified'] = True
+            raise IgnoreRequest(f"Not modified: {request.url}")
+        if response.status != 200:
+            return response
+
+        body_hash = hashlib.blake2b(response.body, digest_size=16).digest()
+        stored = self._validators(request.url)
+        if stored and stored[2] == body_hash:
+            self.stats.inc_value('conditional/unchanged_body')
+            request.meta['not_modified'] = True
+            raise IgnoreRequest(f"Body unchanged: {request.url}")
+
+        # Saved once the page's item is committed, so a page whose item was dropped
+        # or failed to write is fetched in full again next time
+        request.meta['conditional_validators'] = (
+            response.headers.get('ETag', b'').decode('latin-1') or None,
+            response.headers.get('Last-Modified', b'').decode('latin-1') or None,
+            body_hash,
+        )
+        self.stats.inc_value('conditional/changed')
+        return response
+
+    def item_scraped(self, item, response, spider):
+        product_url = ItemAdapter(item).get('product_url')
+        committed = product_url in self.committed_early
+        self.committed_early.discard(product_url)
+        validators = response.meta.get('conditional_validators')
+        if not validators:
+            return
+        if committed:
+            self._save(response.request.url, validators)
+        else:
+            self.uncommitted[product_url] = (response.request.url, validators)
+
+    def items_committed(self, product_urls):
+        for product_url in product_urls:
+            scraped = self.uncommitted.pop(product_url, None)
+            if scraped:
+                self._save(*scraped)
+            else:
+                # An unbatched write commits before item_scraped is sent for its item
+                self.committed_early.add(product_url)
+
+    def _save(self, url, validators):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO validators (url, etag, last_modified, body_hash) VALUES (?, ?, ?, ?)",
+            (url,) + validators
+        )
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.conn.commit()
+            self.pending = 0
+
+    def spider_closed(self, spider):
+        # Pages whose items never committed are fetched in full again next crawl
+        self.stats.inc_value('conditional/uncommitted', len(self.uncommitted))
+        self.conn.commit()
+        self.conn.close()
+
+
+class RetailerThrottleMiddleware:
+    """Adapt the concurrency and delay of each retailer's downloader slot on its own.
+
+    Requests are put in a download slot named after their retailer. Each slot
+    starts at DOWNLOAD_DELAY with one request in flight. After a window of
+    fast, successful responses it first shrinks the delay towards
+    RETAILER_THROTTLE_MIN_DELAY and then adds concurrency, up to
+    CONCURRENT_REQUESTS_PER_DOMAIN. A 429 or 503, a high error rate or latency
+    above twice RETAILER_THROTTLE_TARGET_LATENCY halves the slot's concurrency
+    and doubles its delay (honouring Retry-After); high latency or error rate at
+    most once per window of responses. Only that retailer slows down.
+    """
+
+    BACKOFF_STATUSES = {429, 503}
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.start_delay = settings.getfloat('DOWNLOAD_DELAY', 0)
+        self.min_delay = settings.getfloat('RETAILER_THROTTLE_MIN_DELAY', 0.5)
+        self.max_delay = settings.getfloat('RETAILER_THROTTLE_MAX_DELAY', 60)
+        self.max_concurrency = settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN', 8)
+        self.target_latency = settings.getfloat('RETAILER_THROTTLE_TARGET_LATENCY', 2.0)
+        self.window = settings.getint('RETAILER_THROTTLE_WINDOW', 10)
+        self.max_error_rate = settings.getfloat('RETAILER_THROTTLE_MAX_ERROR_RATE', 0.2)
+        self.budgets = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('RETAILER_THROTTLE_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def _budget(self, retailer):
+        if retailer not in self.budgets:
+            self.budgets[retailer] = {
+                'concurrency': 1, 'delay': self.start_delay,
+                'latency': None, 'ok': 0, 'outcomes': [],
+            }
+        return self.budgets[retailer]
+
+    def process_request(self, request, spider):
+        retailer = request.meta.get('retailer')
+        if retailer and 'download_slot' not in request.meta:
+            request.meta['download_slot'] = retailer
+            self._apply(retailer)
+        return None
+
+    def process_response(self, request, response, spider):
+        retailer = request.meta.get('retailer')
+        if not retailer:
+            return response
+
+        budget = self._budget(retailer)
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            budget['latency'] = latency if budget['latency'] is None else 0.8 * budget['latency'] + 0.2 * latency
+
+        if response.status in self.BACKOFF_STATUSES:
+            self._record(budget, False)
+            self._back_off(retailer, budget, self._retry_after(response))
+        else:
+            self._record(budget, response.status < 500)
+            self._adapt(retailer, budget)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        retailer = request.meta.get('retailer')
+        if retailer:
+            budget = self._budget(retailer)
+            self._record(budget, False)
+            self._adapt(retailer, budget)
+        return None
+
+    def _record(self, budget, success):
+        budget['outcomes'] = (budget['outcomes'] + [success])[-self.window * 2:]
+        budget['ok'] = budget['ok'] + 1 if success else 0
+
+    def _adapt(self, retailer, budget):
+        outcomes = budget['outcomes']
+        error_rate = outcomes.count(False) / len(outcomes)
+        if len(outcomes) >= self.window and error_rate > self.max_error_rate:
+            self._back_off(retailer, budget)
+        elif len(outcomes) >= self.window and budget['latency'] is not None \
+                and budget['latency'] > 2 * self.target_latency:
+            # At most once a window, so the slowly decaying average does not back off on every response
+            self._back_off(retailer, budget)
+        elif budget['ok'] >= self.window and budget['latency'] is not None \
+                and budget['latency'] <= self.target_latency:
+            if budget['delay'] > self.min_delay:
+                budget['delay'] = max(self.min_delay, budget['delay'] * 0.75)
+            elif budget['concurrency'] < self.max_concurrency:
+                budget['concurrency'] += 1
+            budget['ok'] = 0
+            self._apply(retailer)
+
+    def _back_off(self, retailer, budget, retry_after=0.0):
+        budget['concurrency'] = max(1, budget['concurrency'] // 2)
+        budget['delay'] = min(self.max_delay, max(budget['delay'] * 2, self.min_delay, retry_after))
+        budget['ok'] = 0
+        budget['outcomes'] = []
+        self.stats.inc_value(f'throttle/{retailer}/backoffs')
+        self._apply(retailer)
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers.get('Retry-After', b'0'))
+        except ValueError:
+            # HTTP-date values are rare from these sites; fall back to doubling
+            return 0.0
+
+    def _apply(self, retailer):
+        """Copy the retailer's budget onto its downloader slot"""
+        budget = self._budget(retailer)
+        slot = self.crawler.engine.downloader.slots.get(retailer)
+        if slot is not None:
+            slot.concurrency = budget['concurrency']
+            slot.delay = budget['delay']
+        self.stats.set_value(f'throttle/{retailer}/concurrency', budget['concurrency'])
+        self.stats.set_value(f'throttle/{retailer}/delay', round(budget['delay'], 3))
@@ -0,0 +1,459 @@
+import io
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+
+from myproject.database import AzureDBPipeline
+
+
+class PostgresPipeline(AzureDBPipeline):
+    """Store items in the PostgreSQL database read by the production API.
+
+    Items are always written in batches: each batch is streamed into a staging
+    table with COPY, upserted into products with a single INSERT ... ON CONFLICT
+    and its prices are loaded with a second COPY, all in one transaction.
+    Id caches, change detection and the writer thread work as in AzureDBPipeline.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # libpq connection string, in the same format deployment.py reads
+        self.dsn = os.getenv('AZURE_POSTGRESQL_CONNECTIONSTRING')
+
+    @property
+    def batching(self) -> bool:
+        # A DB_BATCH_SIZE of 1 still goes through COPY, as a batch of one item
+        return True
+
+    def connect_to_db(self):
+        """Connect to PostgreSQL Database"""
+        try:
+            self._open_connection()
+            self._ensure_tables_exist()
+            self._ensure_staging_tables()
+            self._load_caches()
+        except Exception as e:
+            logging.error(f"Error connecting to database: {e}")
+            raise
+
+    def _open_connection(self):
+        self.conn = psycopg2.connect(self.dsn)
+        self.cursor = self.conn.cursor()
+
+    def _ensure_tables_exist(self, unique_urls: bool = True):
+        """Check if tables exist and create them if they don't.
+
+        Without unique_urls the product_url index is left for
+        merge_duplicate_products to create.
+        """
+        try:
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS retailers (
+                    id serial PRIMARY KEY,
+                    name varchar(255),
+                    created_at timestamp DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS categories (
+                    id serial PRIMARY KEY,
+                    name varchar(255),
+                    created_at timestamp DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS products (
+                    id serial PRIMARY KEY,
+                    name varchar(500),
+                    image_url varchar(2000),
+                    product_url varchar(2000),
+                    description text,
+                    category_id integer REFERENCES categories (id),
+                    retailer_id integer REFERENCES retailers (id),
+                    created_at timestamp DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            self.cursor.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS content_hash bytea")
+            self.cursor.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS last_seen_at timestamp")
+            # Latest price kept on the product, so the API reads it without touching prices
+            self.cursor.execute("""
+                ALTER TABLE products ADD COLUMN IF NOT EXISTS current_price double precision,
+                                     ADD COLUMN IF NOT EXISTS current_price_at timestamp
+            """)
+            # ON CONFLICT (product_url) needs a unique index to arbitrate on. A
+            # database restored from a backup may hold duplicate URLs, which
+            # `scrapy dedupe_products` reports and merges first.
+            self.cursor.execute("SELECT to_regclass('products_product_url_key')")
+            if unique_urls and self.cursor.fetchone()[0] is None:
+                duplicates = self.duplicate_product_urls(limit=5)
+                if duplicates:
+                    raise RuntimeError(
+                        f"products has duplicate product_url values, e.g. {duplicates[0][0]} on ids "
+                        f"{duplicates[0][1]}; run `scrapy dedupe_products` to review and merge them"
+                    )
+                self._create_product_url_index()
+            # Keyset pagination of the API's product list, on (ordering field, id)
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS products_created_at_id ON products (created_at, id)")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS products_name_id ON products (name, id)")
+
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS prices (
+                    id serial PRIMARY KEY,
+                    product_id integer REFERENCES products (id),
+                    price double precision,
+                    created_at timestamp DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            self.cursor.execute("""
+                CREATE INDEX IF NOT EXISTS prices_product_id_created_at
+                ON prices (product_id, created_at)
+            """)
+
+            # Append-only feed of product and price changes, read by the API after a seq watermark
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS catalog_changes (
+                    seq bigserial PRIMARY KEY,
+                    product_id integer REFERENCES products (id),
+                    change_kind varchar(10),
+                    old_price double precision,
+                    new_price double precision,
+                    run_id varchar(36),
+                    created_at timestamp DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            self.conn.commit()
+        except Exception as e:
+            logging.error(f"Error creating tables: {e}")
+            self.conn.rollback()
+            raise
+
+    def _create_product_url_index(self) -> None:
+        self.cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS products_product_url_key ON products (product_url)")
+
+    def duplicate_product_urls(self, limit: int = 0) -> List[Tuple[str, List[int]]]:
+        """(product_url, ids) of every URL stored on more than one product row, oldest id first"""
+        self.cursor.execute(f"""
+            SELECT product_url, array_agg(id ORDER BY id) FROM products
+            WHERE product_url IS NOT NULL
+            GROUP BY product_url HAVING count(*) > 1
+            ORDER BY product_url
+            {'LIMIT %s' if limit else ''}
+        """, (limit,) if limit else None)
+        return self.cursor.fetchall()
+
+    def merge_duplicate_products(self) -> Dict[str, int]:
+        """Merge the rows of each duplicate product_url into its oldest one, then create the unique index.
+
+        The oldest row keeps its id and created_at and takes the details of
+        the newest. Rows referencing a duplicate through a foreign key are
+        moved to the kept product; where a unique constraint already holds
+        the kept product's row, the duplicate's row is deleted instead. The
+        kept product's current price is recomputed from the merged prices.
+        Runs in one transaction and returns the number of rows changed per table.
+        """
+        counts = {}
+        try:
+            self.cursor.execute("""
+                CREATE TEMPORARY TABLE product_duplicates ON COMMIT DROP AS
+                SELECT id AS duplicate_id, keep_id FROM (
+                    SELECT id, min(id) OVER (PARTITION BY product_url) AS keep_id
+                    FROM products WHERE product_url IS NOT NULL
+                ) AS ranked
+                WHERE id <> keep_id
+            """)
+            self.cursor.execute("""
+                UPDATE products SET name = newest.name, image_url = newest.image_url,
+                                    description = newest.description,
+                                    category_id = newest.category_id, retailer_id = newest.retailer_id,
+                                    last_seen_at = newest.last_seen_at, content_hash = NULL
+                FROM (
+                    SELECT DISTINCT ON (d.keep_id) d.keep_id, p.*
+                    FROM product_duplicates d JOIN products p ON p.id = d.duplicate_id
+                    ORDER BY d.keep_id, p.id DESC
+                ) AS newest
+                WHERE products.id = newest.keep_id
+            """)
+            counts['products_kept'] = self.cursor.rowcount
+
+            self.cursor.execute("""
+                SELECT c.conrelid::regclass::text, a.attname
+                FROM pg_constraint c
+                JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+                WHERE c.contype = 'f' AND c.confrelid = 'products'::regclass
+            """)
+            for table, column in self.cursor.fetchall():
+                counts[table] = self._repoint_references(table, column)
+
+            self.cursor.execute("""
+                UPDATE products SET current_price = latest.price, current_price_at = latest.created_at
+                FROM (
+                    SELECT DISTINCT ON (product_id) product_id, price, created_at FROM prices
+                    WHERE product_id IN (SELECT keep_id FROM product_duplicates)
+                    ORDER BY product_id, created_at DESC, id DESC
+                ) AS latest
+                WHERE products.id = latest.product_id
+            """)
+            self.cursor.execute("DELETE FROM products USING product_duplicates WHERE id = duplicate_id")
+            counts['products_deleted'] = self.cursor.rowcount
+            self._create_product_url_index()
+            self.conn.commit()
+        except Exception as e:
+            logging.error(f"Error merging duplicate products: {e}")
+            self.conn.rollback()
+            raise
+        return counts
+
+    def _repoint_references(self, table: str, column: str) -> int:
+        """Point table.column from duplicate products to the kept ones, returning the rows changed"""
+        self.cursor.execute("SAVEPOINT repoint")
+        try:
+            self.cursor.execute(f"""
+                UPDATE {table} SET {column} = d.keep_id FROM product_duplicates d
+                WHERE {table}.{column} = d.duplicate_id
+            """)
+            moved = self.cursor.rowcount
+            self.cursor.execute("RELEASE SAVEPOINT repoint")
+            return moved
+        except psycopg2.errors.UniqueViolation:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT repoint")
+
+        # Some rows clash with a row the kept product already has: move the
+        # others one at a time, and delete the clashing ones
+        self.cursor.execute(f"""
+            SELECT {table}.ctid, d.keep_id FROM {table} JOIN product_duplicates d
+            ON {table}.{column} = d.duplicate_id
+        """)
+        deleted = 0
+        rows = self.cursor.fetchall()
+        for ctid, keep_id in rows:
+            self.cursor.execute("SAVEPOINT repoint")
+            try:
+                self.cursor.execute(f"UPDATE {table} SET {column} = %s WHERE ctid = %s", (keep_id, ctid))
+                self.cursor.execute("RELEASE SAVEPOINT repoint")
+            except psycopg2.errors.UniqueViolation:
+                self.cursor.execute("ROLLBACK TO SAVEPOINT repoint")
+                self.cursor.execute(f"DELETE FROM {table} WHERE ctid = %s", (ctid,))
+                deleted += 1
+        logging.warning(f"Deleted {deleted} {table} rows of duplicate products whose kept product already had one")
+        return len(rows)
+
+    def _backfill_current_prices(self, first_id: int, last_id: int) -> int:
+        self.cursor.execute("""
+            UPDATE products SET current_price = latest.price, current_price_at = latest.created_at
+            FROM (
+                SELECT DISTINCT ON (product_id) product_id, price, created_at
+                FROM prices
+                WHERE product_id BETWEEN %s AND %s
+                ORDER BY product_id, created_at DESC, id DESC
+            ) AS latest
+            WHERE products.id = latest.product_id
+        """, (first_id, last_id))
+        return self.cursor.rowcount
+
+    def _ensure_ledger_tables(self):
+        """Create the crawl run ledger tables if they don't exist"""
+        try:
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS crawl_runs (
+                    id serial PRIMARY KEY,
+                    run_id varchar(36) UNIQUE,
+                    spider varchar(100),
+                    mode varchar(20),
+                    started_at timestamp,
+                    finished_at timestamp,
+                    finish_reason varchar(100),
+                    pages_fetched integer,
+                    items_yielded integer,
+                    items_written integer,
+                    errors integer,
+                    bytes_downloaded bigint,
+                    db_seconds double precision,
+                    db_time_share double precision
+                )
+            """)
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS crawl_run_retailers (
+                    id serial PRIMARY KEY,
+                    crawl_run_id integer REFERENCES crawl_runs (id),
+                    retailer varchar(255),
+                    pages_fetched integer,
+                    items_yielded integer,
+                    items_written integer,
+                    errors integer,
+                    bytes_downloaded bigint
+                )
+            """)
+            self.conn.commit()
+        except Exception as e:
+            logging.error(f"Error creating crawl ledger tables: {e}")
+            self.conn.rollback()
+            raise
+
+    def _insert_crawl_run(self, run: Dict[str, Any]) -> int:
+        self.cursor.execute(f"""
+            INSERT INTO crawl_runs ({', '.join(self.LEDGER_RUN_COLUMNS)})
+            VALUES ({', '.join(['%s'] * len(self.LEDGER_RUN_COLUMNS))})
+            RETURNING id
+        """, tuple(run[column] for column in self.LEDGER_RUN_COLUMNS))
+        return self.cursor.fetchone()[0]
+
+    def _insert_crawl_run_retailers(self, rows: List[tuple]) -> None:
+        self.cursor.executemany(f"""
+            INSERT INTO crawl_run_retailers (crawl_run_id, retailer, {', '.join(self.LEDGER_COUNTS)})
+            VALUES (%s, %s, {', '.join(['%s'] * len(self.LEDGER_COUNTS))})
+        """, rows)
+
+    def _select_crawl_runs(self, spider: str, mode: str, limit: int) -> List[tuple]:
+        self.cursor.execute(f"""
+            SELECT id, {', '.join(self.LEDGER_RUN_COLUMNS)} FROM crawl_runs
+            WHERE spider = %s AND mode = %s AND finished_at IS NOT NULL
+            ORDER BY id DESC
+            LIMIT %s
+        """, (spider, mode, limit))
+        return self.cursor.fetchall()
+
+    def _select_crawl_run_retailers(self, crawl_run_ids: List[int]) -> List[tuple]:
+        self.cursor.execute(f"""
+            SELECT crawl_run_id, retailer, {', '.join(self.LEDGER_COUNTS)} FROM crawl_run_retailers
+            WHERE crawl_run_id = ANY(%s)
+        """, (crawl_run_ids,))
+        return self.cursor.fetchall()
+
+    def _ensure_staging_tables(self):
+        """Create the session-scoped staging table COPY loads into"""
+        try:
+            # Temporary tables are never WAL-logged, so this is the session-private
+            # form of an UNLOGGED table and cannot collide with other crawler processes
+            self.cursor.execute("""
+                CREATE TEMPORARY TABLE IF NOT EXISTS staging_products (
+                    product_url varchar(2000),
+                    content_hash bytea,
+                    name varchar(500),
+                    image_url varchar(2000),
+                    description text,
+                    category_id integer,
+                    retailer_id integer
+                ) ON COMMIT DELETE ROWS
+            """)
+            self.conn.commit()
+        except Exception as e:
+            logging.error(f"Error creating staging tables: {e}")
+            self.conn.rollback()
+            raise
+
+    def _get_or_create_retailer(self, retailer_name: str) -> int:
+        """Get or create retailer and return id"""
+        return self._get_or_create_named('retailers', self.retailer_ids, retailer_name)
+
+    def _get_or_create_category(self, category_name: str) -> int:
+        """Get or create category and return id"""
+        return self._get_or_create_named('categories', self.category_ids, category_name)
+
+    def _get_or_create_named(self, table: str, cache: Dict[str, int], name: str) -> int:
+        if name in cache:
+            return cache[name]
+
+        try:
+            self.cursor.execute(f"SELECT id FROM {table} WHERE name = %s", (name,))
+            result = self.cursor.fetchone()
+
+            if result:
+                return self._cache(cache, name, result[0])
+
+            self.cursor.execute(f"INSERT INTO {table} (name) VALUES (%s) RETURNING id", (name,))
+            return self._cache(cache, name, self.cursor.fetchone()[0])
+
+        except Exception as e:
+            logging.error(f"Error in _get_or_create_named({table}): {e}")
+            raise
+
+    def _write_products(self, rows: List[tuple]) -> List[tuple]:
+        """COPY staged product rows and upsert them, returning (id, product_url, content_hash)"""
+        self._copy('staging_products', (
+            'product_url', 'content_hash', 'name', 'image_url',
+            'description', 'category_id', 'retailer_id'
+        ), rows)
+
+        self.cursor.execute("""
+            INSERT INTO products (name, image_url, product_url, description, category_id,
+                                  retailer_id, content_hash, last_seen_at)
+            SELECT name, image_url, product_url, description, category_id,
+                   retailer_id, content_hash, now()
+            FROM staging_products
+            ON CONFLICT (product_url) DO UPDATE
+            SET name = EXCLUDED.name, image_url = EXCLUDED.image_url,
+                description = EXCLUDED.description,
+                category_id = EXCLUDED.category_id,
+                retailer_id = EXCLUDED.retailer_id,
+                content_hash = EXCLUDED.content_hash,
+                last_seen_at = EXCLUDED.last_seen_at
+            RETURNING id, product_url, content_hash
+        """)
+        return self.cursor.fetchall()
+
+    def _write_prices(self, price_rows: List[Tuple[int, float, Optional[datetime]]]) -> None:
+        """COPY (product_id, price, observed_at) rows into prices and make them the products' current prices"""
+        product_ids, prices, observed = zip(*price_rows)
+        if not self.scrape_dates:
+            self._copy('prices', ('product_id', 'price'), zip(product_ids, prices))
+            self.cursor.execute("""
+                UPDATE products SET current_price = latest.price, current_price_at = now()
+                FROM unnest(%s::integer[], %s::double precision[]) AS latest (id, price)
+                WHERE products.id = latest.id
+            """, (list(product_ids), list(prices)))
+            return
+        self._copy('prices', ('product_id', 'price', 'created_at'), price_rows)
+        self.cursor.execute("""
+            UPDATE products SET current_price = latest.price, current_price_at = latest.observed_at
+            FROM unnest(%s::integer[], %s::double precision[], %s::timestamp[]) AS latest (id, price, observed_at)
+            WHERE products.id = latest.id
+              AND (products.current_price_at IS NULL OR products.current_price_at <= latest.observed_at)
+        """, (list(product_ids), list(prices), list(observed)))
+
+    def _write_changes(self, rows: List[tuple]) -> None:
+        """COPY (product_id, change_kind, old_price, new_price, run_id) rows into catalog_changes"""
+        self._copy('catalog_changes', ('product_id', 'change_kind', 'old_price', 'new_price', 'run_id'), rows)
+        self._inc_stat('db/catalog_changes', len(rows))
+
+    def _copy(self, table: str, columns: Tuple[str, ...], rows: List[tuple]) -> None:
+        """Stream rows into table with COPY ... FROM STDIN"""
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(self._copy_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        self.cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+    @staticmethod
+    def _copy_value(value) -> str:
+        """Encode a value for COPY's text format"""
+        if value is None:
+            return '\\N'
+        if isinstance(value, bytes):
+            # bytea hex input, with the backslash escaped for the text format
+            return '\\\\x' + value.hex()
+        return (
+            str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r')
+        )
+
+    def _mark_unchanged_seen(self) -> None:
+        """Set last_seen_at on unchanged products with one set-based UPDATE"""
+        if not self.unchanged_ids:
+            return
+
+        product_ids, self.unchanged_ids = self.unchanged_ids, []
+        try:
+            self.cursor.execute(
+                "UPDATE products SET last_seen_at = now() WHERE id = ANY(%s)",
+                (list(set(product_ids)),)
+            )
+        except Exception as e:
+            logging.error(f"Error in _mark_unchanged_seen: {e}")
+            raise
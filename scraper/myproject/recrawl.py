@@ -0,0 +1,98 @@
+import heapq
+import math
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from myproject.utils.url_store import FingerprintURLStore
+
+
+class RecrawlPlanner:
+    """Schedule product recrawls from the price change history.
+
+    Price changes of a product are treated as a Poisson process. Its rate is
+    the number of recorded changes over the time it has been observed. Products
+    with little history are pulled towards the pooled rate of their category,
+    which counts as prior_seconds of extra observation. A product is due once
+    the chance that its price changed since it was last seen reaches
+    target_probability, which happens after ``-ln(1 - p) / rate`` seconds,
+    kept between min_interval and max_interval.
+
+    The queue is keyed by ``1 - unseen / interval``, the share of its interval
+    a product still has to wait. Due products have a key of zero or less, and
+    the most overdue are the ones most likely to have changed, whatever their
+    interval.
+    """
+
+    def __init__(self, target_probability: float = 0.5, min_interval: float = 6 * 3600,
+                 max_interval: float = 30 * 86400, prior_seconds: float = 7 * 86400):
+        self.threshold = -math.log(1 - target_probability)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.prior_seconds = prior_seconds
+        self.products: List[Tuple[str, str, str, int, float, float, Any]] = []
+        self.known_urls = FingerprintURLStore()
+        self.queue: List[Tuple[float, str, str, str, Any]] = []
+        self.category_due: Dict[Tuple[str, str], float] = {}
+
+    def add_history(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Add rows shaped like AzureDBPipeline.price_history()"""
+        for row in rows:
+            self.products.append((
+                row['product_url'], row['retailer'], row['category'], row['changes'],
+                row['observed_seconds'], row['unseen_seconds'], row['price'],
+            ))
+            self.known_urls.add(row['product_url'])
+
+    def _rate(self, changes: float, observed: float, prior_rate: float) -> float:
+        return (changes + prior_rate * self.prior_seconds) / (observed + self.prior_seconds)
+
+    def interval(self, rate: float) -> float:
+        """Seconds until a product changing at rate is due again"""
+        if rate <= 0:
+            return self.max_interval
+        return min(self.max_interval, max(self.min_interval, self.threshold / rate))
+
+    def category_rates(self) -> Dict[Tuple[str, str], float]:
+        """Pooled change rate per (retailer, category), shrunk towards the overall rate"""
+        totals: Dict[Tuple[str, str], List[float]] = {}
+        for _, retailer, category, changes, observed, _, _ in self.products:
+            total = totals.setdefault((retailer, category), [0, 0.0])
+            total[0] += changes
+            total[1] += observed
+        all_changes = sum(total[0] for total in totals.values())
+        all_observed = sum(total[1] for total in totals.values())
+        overall = all_changes / all_observed if all_observed else 1 / self.max_interval
+        return {key: self._rate(changes, observed, overall) for key, (changes, observed) in totals.items()}
+
+    def plan(self) -> None:
+        """Build the queue of products ordered by next due time"""
+        category_rates = self.category_rates()
+        self.queue = []
+        self.category_due = {}
+        for product_url, retailer, category, changes, observed, unseen, price in self.products:
+            key = (retailer, category)
+            rate = self._rate(changes, observed, category_rates[key])
+            self.queue.append((1 - unseen / self.interval(rate), product_url, retailer, category, price))
+            # A category is due when its most recently seen product would be at its rate
+            category_next = 1 - unseen / self.interval(category_rates[key])
+            self.category_due[key] = max(self.category_due.get(key, -math.inf), category_next)
+        heapq.heapify(self.queue)
+
+    def due(self, budget: int = 0) -> Iterable[Tuple[float, str, str, str, Any]]:
+        """Pop due products, most overdue first, stopping after budget of them when set"""
+        popped = 0
+        while self.queue and self.queue[0][0] <= 0 and (not budget or popped < budget):
+            popped += 1
+            yield heapq.heappop(self.queue)
+
+    def due_retailers(self) -> Set[str]:
+        """Retailers with at least one due category, whose listing pages should be crawled"""
+        return {retailer for (retailer, _), next_due in self.category_due.items() if next_due <= 0}
+
+    def retailers(self) -> Set[str]:
+        return {retailer for retailer, _ in self.category_due}
+
+    def __contains__(self, product_url: str) -> bool:
+        return product_url in self.known_urls
+
+    def __len__(self) -> int:
+        return len(self.products)
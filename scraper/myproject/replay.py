@@ -0,0 +1,156 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from scrapy import Request, signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers, HtmlResponse
+from twisted.internet import defer
+
+# Bump when the layout of index.jsonl or the bodies directory changes
+CORPUS_FORMAT = 1
+
+# Spider callbacks and the page kind their responses are filed under
+PAGE_KINDS = {'parse': 'listing', 'parse_product_page': 'product'}
+
+
+class ReplayCorpus:
+    """On-disk corpus of recorded responses.
+
+    A corpus is a directory holding ``manifest.json``, ``index.jsonl`` with one
+    line per response (requested and final url, status, headers, kind, retailer
+    and body file) and the gzip-compressed bodies in ``bodies/``. Each recording
+    goes into its own versioned directory, so older corpora stay around for
+    comparison.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._index: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @classmethod
+    def create(cls, root: str, version: Optional[str] = None) -> 'ReplayCorpus':
+        version = version or datetime.now().strftime('%Y%m%dT%H%M%S')
+        corpus = cls(os.path.join(root, version))
+        os.makedirs(os.path.join(corpus.path, 'bodies'), exist_ok=True)
+        with open(os.path.join(corpus.path, 'manifest.json'), 'w') as f:
+            json.dump({'format': CORPUS_FORMAT, 'version': version,
+                       'created': datetime.now().isoformat()}, f)
+        return corpus
+
+    def add(self, request_url: str, url: str, status: int, headers: Dict[str, list],
+            body: bytes, kind: str, retailer: Optional[str]) -> None:
+        body_file = hashlib.sha1(request_url.encode('utf-8')).hexdigest() + '.gz'
+        with gzip.open(os.path.join(self.path, 'bodies', body_file), 'wb') as f:
+            f.write(body)
+        entry = {'request_url': request_url, 'url': url, 'status': status, 'headers': headers,
+                 'kind': kind, 'retailer': retailer, 'body': body_file}
+        with open(os.path.join(self.path, 'index.jsonl'), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        """Recorded entries in recording order, the latest one per requested URL"""
+        return iter(self._load_index().values())
+
+    def get(self, request_url: str) -> Optional[Dict[str, Any]]:
+        return self._load_index().get(request_url)
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        if self._index is None:
+            self._index = {}
+            with open(os.path.join(self.path, 'index.jsonl')) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._index[entry['request_url']] = entry
+        return self._index
+
+    def body(self, entry: Dict[str, Any]) -> bytes:
+        with gzip.open(os.path.join(self.path, 'bodies', entry['body']), 'rb') as f:
+            return f.read()
+
+    def response(self, entry: Dict[str, Any], request: Optional[Request] = None) -> HtmlResponse:
+        """Rebuild the recorded response, for request or a new one carrying its retailer"""
+        if request is None:
+            request = Request(entry['url'], meta={'retailer': entry['retailer']})
+        return HtmlResponse(
+            url=entry['url'], status=entry['status'], headers=Headers(entry['headers']),
+            body=self.body(entry), request=request
+        )
+
+
+class ReplayRecorderMiddleware:
+    """Downloader middleware that records every response the spider receives into a new corpus"""
+
+    def __init__(self, corpus: ReplayCorpus, stats=None):
+        self.corpus = corpus
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        root = crawler.settings.get('REPLAY_RECORD_DIR')
+        if not root:
+            raise NotConfigured
+        corpus = ReplayCorpus.create(root, crawler.settings.get('REPLAY_CORPUS_VERSION'))
+        middleware = cls(corpus, stats=crawler.stats)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_request(self, request, spider):
+        # Record full pages rather than 304s from the conditional request middleware
+        request.meta['conditional'] = False
+        return None
+
+    def process_response(self, request, response, spider):
+        callback = getattr(request.callback, '__name__', 'parse')
+        self.corpus.add(
+            # Filed under the URL first requested, so replay finds it without redirects
+            request_url=request.meta.get('redirect_urls', [request.url])[0],
+            url=response.url,
+            status=response.status,
+            headers={
+                key.decode('latin-1'): [value.decode('latin-1') for value in values]
+                for key, values in response.headers.items()
+            },
+            body=response.body,
+            kind=PAGE_KINDS.get(callback, callback),
+            retailer=request.meta.get('retailer'),
+        )
+        self.stats.inc_value('replay/recorded')
+        return response
+
+    def spider_closed(self, spider):
+        logging.info(f"Recorded {self.stats.get_value('replay/recorded', 0)} responses to {self.corpus.path}")
+
+
+class ReplayDownloadHandler:
+    """Download handler that serves responses from the REPLAY_CORPUS corpus without any network access.
+
+    URLs missing from the corpus get an empty 404 response.
+    """
+
+    lazy = False
+
+    def __init__(self, crawler):
+        path = crawler.settings.get('REPLAY_CORPUS')
+        if not path:
+            raise NotConfigured
+        self.corpus = ReplayCorpus(path)
+        self.stats = crawler.stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def download_request(self, request, spider=None):
+        entry = self.corpus.get(request.url)
+        if entry is None:
+            self.stats.inc_value('replay/missing')
+            return defer.succeed(HtmlResponse(url=request.url, status=404, body=b'', request=request))
+
+        self.stats.inc_value('replay/served')
+        return defer.succeed(self.corpus.response(entry, request))
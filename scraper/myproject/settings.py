@@ -11,6 +11,7 @@ BOT_NAME = "myproject"
 
 SPIDER_MODULES = ["myproject.spiders"]
 NEWSPIDER_MODULE = "myproject.spiders"
+COMMANDS_MODULE = "myproject.commands"
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -27,7 +28,7 @@ CONCURRENT_REQUESTS = 8
 # See also autothrottle settings and docs
 DOWNLOAD_DELAY = 3 
 # The download delay setting will honor only one of:
-ONCURRENT_REQUESTS_PER_DOMAIN = 4
+CONCURRENT_REQUESTS_PER_DOMAIN = 4
 #CONCURRENT_REQUESTS_PER_IP = 16
 
 # Disable cookies (enabled by default)
@@ -44,9 +45,11 @@ ONCURRENT_REQUESTS_PER_DOMAIN = 4
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
+SPIDER_MIDDLEWARES = {
 #    "myproject.middlewares.MyprojectSpiderMiddleware": 543,
-#}
+    # Closest to the spider, so it times the callbacks alone
+    "myproject.metrics.StageTimingMiddleware": 950,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
@@ -65,22 +68,162 @@ USER_AGENT_LIST = [
 DOWNLOADER_MIDDLEWARES = {
     'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
     'myproject.middlewares.RotateUserAgentMiddleware': 400,
+    # Above RetryMiddleware (550), so it sees 429/503 responses before they are
+    # retried, and above ConditionalRequestMiddleware, so it also records the 304s
+    # and unchanged bodies that one drops
+    'myproject.middlewares.RetailerThrottleMiddleware': 585,
+    # Below HttpCompressionMiddleware (590), so it hashes the decompressed body
+    'myproject.middlewares.ConditionalRequestMiddleware': 580,
+    # Outermost, so it records the responses exactly as the spider receives them
+    'myproject.replay.ReplayRecorderMiddleware': 50,
 }
 
+# Record every response into a new versioned corpus under this directory, for
+# offline replay with REPLAY_CORPUS and `scrapy bench_parse`
+#REPLAY_RECORD_DIR = 'replay'
+# Corpus directory served by myproject.replay.ReplayDownloadHandler when it is
+# set as the http/https download handler
+#REPLAY_CORPUS = 'replay/20241128T100000'
+
+# Revalidate product pages with the ETag/Last-Modified of the previous crawl and
+# skip the ones that did not change, keeping validators in CONDITIONAL_REQUESTS_DB
+CONDITIONAL_REQUESTS_ENABLED = True
+CONDITIONAL_REQUESTS_DB = 'conditional.sqlite'
+# Validators saved per transaction; sharded crawl workers commit each one so
+# they never hold the file's write lock for long
+CONDITIONAL_REQUESTS_COMMIT_EVERY = 500
+
+# Give each retailer its own downloader slot, starting at DOWNLOAD_DELAY with one
+# request in flight, and adapt its delay and concurrency (up to
+# CONCURRENT_REQUESTS_PER_DOMAIN) from its latency, errors and 429/503 responses.
+# Replaces AutoThrottle, which would fight it over the slot delay.
+RETAILER_THROTTLE_ENABLED = True
+RETAILER_THROTTLE_MIN_DELAY = 0.5
+RETAILER_THROTTLE_MAX_DELAY = 60
+# Latency (seconds) under which a retailer's budget may grow
+RETAILER_THROTTLE_TARGET_LATENCY = 2.0
+# Successful responses needed before each step up
+RETAILER_THROTTLE_WINDOW = 10
+RETAILER_THROTTLE_MAX_ERROR_RATE = 0.2
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+    "myproject.metrics.StageMetricsExtension": 500,
+    "myproject.ledger.CrawlLedger": 510,
+}
+
+# Latency histograms per crawl stage: download time per retailer, parse time per
+# callback, DataCleaner time, and time per database call in the pipeline. They
+# are summarised into the crawl stats under metrics/ at spider close, and written
+# in full to these files when set (%(spider)s and %(time)s are substituted)
+METRICS_ENABLED = True
+#METRICS_JSON_FILE = 'metrics/%(spider)s-%(time)s.json'
+#METRICS_PROMETHEUS_FILE = 'metrics/%(spider)s.prom'
+
+# Record each crawl in the crawl_runs / crawl_run_retailers tables of the
+# DB_BACKEND database (not while SPOOL_ENABLED). `scrapy check_runs` compares the
+# latest run with the median of the CRAWL_LEDGER_BASELINE_RUNS runs before it,
+# and flags pages/sec below CRAWL_REGRESSION_THROUGHPUT_RATIO of the baseline,
+# or items yielded/written below CRAWL_REGRESSION_YIELD_RATIO
+CRAWL_LEDGER_ENABLED = True
+CRAWL_LEDGER_BASELINE_RUNS = 7
+CRAWL_REGRESSION_THROUGHPUT_RATIO = 0.67
+CRAWL_REGRESSION_YIELD_RATIO = 0.67
+
+# 'full' fetches every product page; 'listing' reads prices of products the
+# database already holds completely from the category listing tiles and only
+# fetches pages of new or incomplete products; 'due' fetches only the stored
+# products the recrawl plan expects to have changed, plus listing pages of
+# retailers with a due category, to find new products
+CRAWL_MODE = 'full'
+
+# Recrawl plan for 'due' mode, estimated from the prices history: a product is
+# due once the chance its price changed since it was last seen reaches
+# RECRAWL_TARGET_PROBABILITY, no sooner than RECRAWL_MIN_INTERVAL hours and no
+# later than RECRAWL_MAX_INTERVAL hours. Products with little history lean on
+# their category's rate as if it had been observed for RECRAWL_PRIOR_DAYS.
+RECRAWL_TARGET_PROBABILITY = 0.5
+RECRAWL_MIN_INTERVAL = 6
+RECRAWL_MAX_INTERVAL = 720
+RECRAWL_PRIOR_DAYS = 7
+# Most product pages a due crawl requests, most overdue first (0: no limit)
+RECRAWL_BUDGET = 0
+
+# Read product fields from the page's JSON-LD or data-product-ga payload first,
+# using the CSS SELECTORS only for fields it does not carry
+STRUCTURED_DATA_ENABLED = True
+
+# Store for product and pagination URLs the spider has already queued:
+# 'fingerprints' (exact 64-bit hashes), 'bloom' (a Bloom filter sized for
+# URL_STORE_CAPACITY URLs at URL_STORE_ERROR_RATE false positives) or 'sqlite'
+# (a fingerprint table at URL_STORE_PATH that several processes can share)
+URL_STORE = 'fingerprints'
+URL_STORE_CAPACITY = 1000000
+URL_STORE_ERROR_RATE = 0.0001
+# With JOBDIR also set, an interrupted crawl saves the store here and the next
+# run resumes it with the queued requests; a finished crawl deletes it. Without
+# JOBDIR the file is deleted at start-up, since its URLs may never have been fetched
+#URL_STORE_PATH = 'seen_urls.bin'
+
+# Sharded crawls (`scrapy shard_crawl`): category start URLs per retailer that
+# the launcher splits into shards, defaulting to GrocerySpider.START_URLS. The
+# launcher sets SHARD_STORE and SHARD_RUN for each worker process it starts.
+SHARD_START_URLS = {}
+SHARD_STORE = None
+SHARD_RUN = None
+# Seconds a worker's claim on a shard lasts. Workers renew it three times per
+# lease while they crawl the shard; once it runs out, because the worker
+# crashed or hung, an idle worker takes the shard over and the launcher
+# terminates the hung worker and starts a replacement.
+SHARD_LEASE_SECONDS = 300
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
-    'myproject.database.AzureDBPipeline': 300,
+    'myproject.database.DBPipeline': 300,
 }
+
+# Database the pipeline writes to: 'azure' (Azure SQL through pyodbc) or
+# 'postgres' (PostgreSQL through psycopg2, using AZURE_POSTGRESQL_CONNECTIONSTRING)
+DB_BACKEND = 'azure'
+
+# Append items to compressed NDJSON segments in SPOOL_DIR instead of writing them
+# to the database; finished segments are loaded with `scrapy load_spool`
+SPOOL_ENABLED = False
+SPOOL_DIR = 'spool'
+# Start a new segment after this many items or seconds
+SPOOL_SEGMENT_ITEMS = 50000
+SPOOL_SEGMENT_SECONDS = 600
+
+# Buffer scraped items and write them to the database in batches
+# (set DB_BATCH_SIZE to 1 to write each item in its own transaction)
+DB_BATCH_SIZE = 500
+# Flush a partially filled batch after this many seconds
+DB_BATCH_INTERVAL = 30
+# Run database writes on a dedicated thread so they never block the reactor,
+# with at most DB_WRITER_QUEUE_SIZE items waiting to be written
+DB_WRITER_THREAD = True
+DB_WRITER_QUEUE_SIZE = 100
+
+# Append a catalog_changes row (product id, 'created'/'updated'/'price', old and
+# new price, crawl run id) for every product the pipeline changes, in the same
+# transaction as the change. The API reads the feed after a seq watermark to
+# invalidate its caches instead of rescanning the catalog.
+CATALOG_CHANGES_ENABLED = True
+
+# `scrapy sync_postgres` copies rows added to the Azure SQL tables since its last
+# run into the AZURE_POSTGRESQL_CONNECTIONSTRING database the API reads, from
+# watermarks kept in that database's sync_watermarks table. Rows newer than
+# SYNC_SETTLE_SECONDS are left for the next run, as a lower id may still be
+# committing. Product rows updated in place are found through catalog_changes.
+SYNC_BATCH_SIZE = 10000
+SYNC_SETTLE_SECONDS = 60
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
-AUTOTHROTTLE_ENABLED = True
+AUTOTHROTTLE_ENABLED = False
 # The initial download delay
 AUTOTHROTTLE_START_DELAY = 5
 # The maximum download delay to be set in case of high latencies
@@ -0,0 +1,199 @@
+import json
+import logging
+import re
+import sqlite3
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from lxml import html
+
+
+class ShardStore:
+    """SQLite coordination store for sharded crawls.
+
+    Holds the shards planned for each run, which worker claimed them and the
+    stats every worker reports when it finishes. Workers on one machine share
+    the file. A networked store would replace this class with the same
+    methods, and this one stays as its local stand-in.
+
+    A claim is a lease of lease seconds, which the worker renews with
+    heartbeat() while it crawls the shard. A shard whose lease ran out, because
+    its worker crashed or hung, is handed out again by claim().
+    """
+
+    LEASE_SECONDS = 300
+
+    def __init__(self, path: str, lease: float = LEASE_SECONDS):
+        self.path = path
+        self.lease = lease
+        # Autocommit, so each statement is its own short transaction between processes
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS shards (
+                run_id TEXT,
+                shard_id TEXT,
+                retailer TEXT,
+                start_url TEXT,
+                first_page INTEGER,
+                last_page INTEGER,
+                status TEXT DEFAULT 'pending',
+                worker TEXT,
+                claimed_at REAL,
+                finished_at REAL,
+                PRIMARY KEY (run_id, shard_id)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS worker_stats (
+                run_id TEXT,
+                worker TEXT,
+                stats TEXT,
+                PRIMARY KEY (run_id, worker)
+            )
+        """)
+
+    def add_shards(self, run_id: str, shards: List[Dict[str, Any]]) -> None:
+        self.conn.executemany("""
+            INSERT OR IGNORE INTO shards (run_id, shard_id, retailer, start_url, first_page, last_page)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [
+            (run_id, shard['shard_id'], shard['retailer'], shard['start_url'],
+             shard.get('first_page'), shard.get('last_page'))
+            for shard in shards
+        ])
+
+    def claim(self, run_id: str, worker: str) -> Optional[Dict[str, Any]]:
+        """Atomically hand the next pending or expired shard of the run to worker.
+
+        Pending shards go first. The returned shard's previous_worker is the
+        worker that held it before, whose lease expired or who was released,
+        or None for a shard claimed for the first time.
+        """
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never
+        # select the same pending shard
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("""
+                SELECT shard_id, retailer, start_url, first_page, last_page, worker FROM shards
+                WHERE run_id = ? AND (status = 'pending' OR (status = 'claimed' AND claimed_at < ?))
+                ORDER BY status = 'claimed', rowid LIMIT 1
+            """, (run_id, now - self.lease)).fetchone()
+            if row:
+                self.conn.execute("""
+                    UPDATE shards SET status = 'claimed', worker = ?, claimed_at = ?
+                    WHERE run_id = ? AND shard_id = ?
+                """, (worker, now, run_id, row[0]))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        if not row:
+            return None
+        shard_id, retailer, start_url, first_page, last_page, previous_worker = row
+        return {'shard_id': shard_id, 'retailer': retailer, 'start_url': start_url,
+                'first_page': first_page, 'last_page': last_page, 'previous_worker': previous_worker}
+
+    def heartbeat(self, run_id: str, shard_id: str, worker: str) -> bool:
+        """Renew worker's lease on a shard, returning False if it no longer holds it"""
+        cursor = self.conn.execute("""
+            UPDATE shards SET claimed_at = ?
+            WHERE run_id = ? AND shard_id = ? AND worker = ? AND status = 'claimed'
+        """, (time.time(), run_id, shard_id, worker))
+        return cursor.rowcount == 1
+
+    def expired(self, run_id: str) -> List[Tuple[str, str]]:
+        """(shard_id, worker) of the run's claimed shards whose lease ran out"""
+        return self.conn.execute("""
+            SELECT shard_id, worker FROM shards
+            WHERE run_id = ? AND status = 'claimed' AND claimed_at < ?
+        """, (run_id, time.time() - self.lease)).fetchall()
+
+    def release(self, run_id: str, worker: str) -> int:
+        """Return the shards worker still has claimed to pending, for a worker known to be gone"""
+        return self.conn.execute("""
+            UPDATE shards SET status = 'pending', claimed_at = NULL
+            WHERE run_id = ? AND worker = ? AND status = 'claimed'
+        """, (run_id, worker)).rowcount
+
+    def finish(self, run_id: str, shard_id: str) -> None:
+        self.conn.execute("""
+            UPDATE shards SET status = 'done', finished_at = ?
+            WHERE run_id = ? AND shard_id = ?
+        """, (time.time(), run_id, shard_id))
+
+    def status_counts(self, run_id: str) -> Dict[str, int]:
+        return dict(self.conn.execute(
+            "SELECT status, COUNT(*) FROM shards WHERE run_id = ? GROUP BY status", (run_id,)
+        ).fetchall())
+
+    def save_stats(self, run_id: str, worker: str, stats: Dict[str, Any]) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO worker_stats (run_id, worker, stats) VALUES (?, ?, ?)",
+            (run_id, worker, json.dumps(stats, default=str))
+        )
+
+    def collect_stats(self, run_id: str) -> Dict[str, Any]:
+        """Numeric stats summed over every worker of the run"""
+        totals: Dict[str, Any] = {}
+        for (stats,) in self.conn.execute(
+            "SELECT stats FROM worker_stats WHERE run_id = ?", (run_id,)
+        ):
+            for key, value in json.loads(stats).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def page_count(pagination: List[str]) -> Optional[int]:
+    """Number of listing pages, from the highest page= number among the pagination links"""
+    pages = [
+        int(value) for link in pagination
+        for value in parse_qs(urlsplit(link).query).get('page', [])
+        if re.fullmatch(r'\d+', value)
+    ]
+    return max(pages) + 1 if pages else None
+
+
+def discover_page_count(url: str, retailer: str, selectors, user_agent: str) -> Optional[int]:
+    """Fetch the first listing page of url and read how many pages it has"""
+    try:
+        request = urllib.request.Request(url, headers={'User-Agent': user_agent})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            root = html.fromstring(response.read())
+    except Exception as e:
+        logging.error(f"Could not read page count of {url}: {e}")
+        return None
+    return page_count(selectors.extract_all(root, retailer, 'pagination'))
+
+
+def plan_shards(start_urls: Dict[str, List[str]], pages_per_shard: int = 0,
+                page_counts: Optional[Dict[str, Optional[int]]] = None) -> List[Dict[str, Any]]:
+    """Split each retailer's start URLs into shards, optionally by listing page range.
+
+    A start URL with a known page count and pages_per_shard set is split into
+    ranges of that many pages. Any other start URL is one shard that follows
+    its own pagination.
+    """
+    page_counts = page_counts or {}
+    shards = []
+    for retailer, urls in start_urls.items():
+        for position, url in enumerate(urls):
+            count = page_counts.get(url)
+            if not pages_per_shard or not count:
+                shards.append({'shard_id': f'{retailer}/{position}', 'retailer': retailer,
+                               'start_url': url})
+                continue
+            for first in range(0, count, pages_per_shard):
+                last = min(count, first + pages_per_shard) - 1
+                shards.append({'shard_id': f'{retailer}/{position}/{first}-{last}',
+                               'retailer': retailer, 'start_url': url,
+                               'first_page': first, 'last_page': last})
+    return shards
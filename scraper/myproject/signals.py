@@ -0,0 +1,6 @@
+# Custom signals sent through crawler.signals, like scrapy.signals
+
+# Sent by the item pipelines once items are durably stored: after the
+# database transaction holding them commits, or once their spool segment is
+# finished. Arguments: product_urls, the product_url of every stored item.
+items_committed = object()
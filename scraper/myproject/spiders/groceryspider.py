@@ -1,8 +1,22 @@
+import logging
+import os
+import socket
+import time
 import scrapy
-from scrapy import Spider, Request
+from scrapy import Spider, Request, signals
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet import task
 from datetime import datetime
 from urllib.parse import urlparse
+from w3lib.url import add_or_replace_parameter
 from myproject.utils.data_cleaner import DataCleaner
+from myproject.utils.selectors import SelectorEngine
+from myproject.utils.structured_data import structured_product
+from myproject.utils.url_store import FingerprintURLStore, open_url_store
+from myproject.database import DBPipeline
+from myproject.metrics import stage_metrics
+from myproject.recrawl import RecrawlPlanner
+from myproject.sharding import ShardStore
 
 class GrocerySpider(Spider):
     name = 'grocery_spider'
@@ -46,57 +60,289 @@ class GrocerySpider(Spider):
         # 'clicks': 'https://www.clicks.co.za/all-brands',
     }
     
+    CRAWL_MODES = ('full', 'listing', 'due')
+    # SELECTORS fields read from product pages
+    PRODUCT_FIELDS = ('product_name', 'price', 'image_url', 'product_description')
+
     def __init__(self, *args, **kwargs):
         super(GrocerySpider, self).__init__(*args, **kwargs)
-        self.visited_urls = set()  # Keep track of visited URLs
+        self.visited_urls = None  # Seen-URL store, opened in from_crawler
+        self.mode = 'full'
+        self.complete_products = None  # Products whose page need not be fetched again
+        self.recrawl = None  # Recrawl plan of stored products, loaded in due mode
+        self.recrawl_budget = 0
+        self.metrics = None  # Stage metrics of the crawl, when METRICS_ENABLED is set
+        # SELECTORS compiled to XPath once, instead of on every extract_data call
+        self.selectors = SelectorEngine(self.SELECTORS)
+        self.structured_data = True  # Read embedded product JSON before the CSS selectors
+        self.shards = None  # Coordination store of a sharded crawl, opened in from_crawler
+        self.shard_run = None
+        self.shard = None  # Shard this worker is crawling
+        self.heartbeat = None  # LoopingCall renewing the shard's lease
+        # Links followed in a shard taken over from another worker, see first_visit
+        self.reclaimed_urls = None
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(GrocerySpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.visited_urls = open_url_store(crawler.settings)
+        spider.metrics = stage_metrics(crawler)
+        spider.structured_data = crawler.settings.getbool('STRUCTURED_DATA_ENABLED', True)
+        spider.mode = crawler.settings.get('CRAWL_MODE', 'full')
+        if spider.mode not in cls.CRAWL_MODES:
+            raise ValueError(f"Unknown CRAWL_MODE {spider.mode!r}, expected one of {cls.CRAWL_MODES}")
+        if spider.mode == 'listing':
+            spider.complete_products = cls.load_complete_products(crawler.settings)
+        if spider.mode == 'due':
+            spider.recrawl = cls.load_recrawl_plan(crawler.settings)
+            spider.recrawl_budget = crawler.settings.getint('RECRAWL_BUDGET', 0)
+        if crawler.settings.get('SHARD_STORE') and crawler.settings.get('SHARD_RUN'):
+            spider.shards = ShardStore(crawler.settings.get('SHARD_STORE'),
+                                       lease=crawler.settings.getfloat('SHARD_LEASE_SECONDS', 300))
+            spider.shard_run = crawler.settings.get('SHARD_RUN')
+            crawler.signals.connect(spider.next_shard, signal=signals.spider_idle)
+            crawler.signals.connect(spider.start_heartbeat, signal=signals.spider_opened)
+        return spider
+
+    @staticmethod
+    def load_complete_products(settings) -> FingerprintURLStore:
+        """Store of product URLs the database already holds an image and description for"""
+        products = FingerprintURLStore()
+        pipeline = DBPipeline.pipeline_class(settings)()
+        try:
+            for product_url in pipeline.complete_product_urls():
+                products.add(product_url)
+        finally:
+            if pipeline.conn:
+                pipeline.conn.close()
+        logging.info(f"Listing mode: {len(products)} complete products need no page fetch")
+        return products
+
+    @staticmethod
+    def load_recrawl_plan(settings) -> RecrawlPlanner:
+        """Recrawl plan built from the price history of every stored product"""
+        planner = RecrawlPlanner(
+            target_probability=settings.getfloat('RECRAWL_TARGET_PROBABILITY', 0.5),
+            min_interval=settings.getfloat('RECRAWL_MIN_INTERVAL', 6) * 3600,
+            max_interval=settings.getfloat('RECRAWL_MAX_INTERVAL', 720) * 3600,
+            prior_seconds=settings.getfloat('RECRAWL_PRIOR_DAYS', 7) * 86400,
+        )
+        pipeline = DBPipeline.pipeline_class(settings)()
+        try:
+            planner.add_history(pipeline.price_history())
+        finally:
+            if pipeline.conn:
+                pipeline.conn.close()
+        planner.plan()
+        logging.info(f"Due mode: planned recrawls of {len(planner)} products")
+        return planner
+
+    def closed(self, reason):
+        # A finished crawl leaves nothing to resume, and its seen URLs would make
+        # the next crawl skip every link. A sharded run's store belongs to the
+        # run, which other workers may still be crawling.
+        self.visited_urls.close(keep=reason != 'finished' or self.shards is not None)
+        if self.heartbeat and self.heartbeat.running:
+            self.heartbeat.stop()
+        if self.shards:
+            self.shards.save_stats(self.shard_run, self.worker, self.crawler.stats.get_stats())
+            self.shards.close()
 
     def start_requests(self):
+        if self.shards:
+            yield from self.claim_shard()
+            return
+        if self.mode == 'due':
+            yield from self.due_requests()
         for retailer, url in self.START_URLS.items():
+            if self.mode == 'due' and not self.listing_due(retailer):
+                continue
+            self.count_request('listing')
             yield Request(
                 url=url,
                 callback=self.parse,
                 meta={'retailer': retailer}
             )
 
+    def due_requests(self):
+        """Product page requests for stored products whose price is due to have changed"""
+        for _, product_url, retailer, category, price in self.recrawl.due(self.recrawl_budget):
+            self.count_request('product')
+            yield Request(
+                url=product_url,
+                callback=self.parse_product_page,
+                errback=self.not_modified,
+                meta={'retailer': retailer, 'conditional': True, 'known_price': price},
+                dont_filter=True
+            )
+
+    def listing_due(self, retailer: str) -> bool:
+        """Whether a retailer's listing pages are due, or it has no history yet"""
+        return retailer in self.recrawl.due_retailers() or retailer not in self.recrawl.retailers()
+
+    def not_modified(self, failure):
+        """Errback of due requests: an unchanged page still counts as a recrawl of its price"""
+        request = failure.request
+        if not request.meta.get('not_modified'):
+            return failure
+        self.crawler.stats.inc_value('grocery/due/not_modified')
+        product_url = DataCleaner.clean_url(request.url)
+        return [{
+            'retailer': request.meta['retailer'],
+            'scrape_date': datetime.now().isoformat(),
+            'price': request.meta['known_price'],
+            'product_url': product_url,
+            'category': DataCleaner.clean_category(self.extract_category_from_url(product_url)),
+            'price_only': True,
+        }]
+
+    def claim_shard(self):
+        """Claim the next pending shard of the run and build its listing requests"""
+        self.shard = self.shards.claim(self.shard_run, self.worker)
+        if self.shard is None:
+            return
+        logging.info(f"Worker {self.worker} claimed shard {self.shard['shard_id']}")
+        retailer, url = self.shard['retailer'], self.shard['start_url']
+        reclaimed = self.shard['previous_worker'] is not None
+        if reclaimed:
+            logging.warning(f"Shard {self.shard['shard_id']} was left unfinished by "
+                            f"{self.shard['previous_worker']}, crawling it again")
+            self.crawler.stats.inc_value('grocery/shards/reclaimed')
+            self.reclaimed_urls = FingerprintURLStore()
+        if self.shard['first_page'] is None:
+            self.count_request('listing')
+            yield Request(url=url, callback=self.parse, meta={'retailer': retailer, 'reclaimed': reclaimed})
+            return
+
+        # A page range shard requests its pages directly and does not follow pagination
+        for page in range(self.shard['first_page'], self.shard['last_page'] + 1):
+            page_url = add_or_replace_parameter(url, 'page', str(page)) if page else url
+            self.count_request('listing')
+            yield Request(url=page_url, callback=self.parse,
+                          meta={'retailer': retailer, 'follow_pagination': False, 'reclaimed': reclaimed})
+
+    def start_heartbeat(self, spider):
+        """spider_opened handler: renew the lease on the claimed shard a few times per lease"""
+        self.heartbeat = task.LoopingCall(self.renew_lease)
+        self.heartbeat.start(self.shards.lease / 3, now=False)
+
+    def renew_lease(self):
+        if self.shard is None:
+            return
+        if not self.shards.heartbeat(self.shard_run, self.shard['shard_id'], self.worker):
+            # Another worker took the shard over after the lease ran out. Both
+            # crawl it to the end, and the shared seen-URL store keeps most of
+            # the overlap from being fetched twice.
+            logging.warning(f"Worker {self.worker} lost its lease on shard {self.shard['shard_id']}")
+            self.crawler.stats.inc_value('grocery/shards/lease_lost')
+
+    def first_visit(self, url: str, response) -> bool:
+        """Mark url as seen, returning True if the spider should follow it.
+
+        The worker that left a reclaimed shard may have marked its links seen
+        without fetching them, so links of a reclaimed shard are followed once
+        more, whatever the shared store says.
+        """
+        new = self.visited_urls.add(url)
+        if response.meta.get('reclaimed'):
+            return self.reclaimed_urls.add(url)
+        return new
+
+    def next_shard(self, spider):
+        """spider_idle handler: mark the finished shard done and start the next one"""
+        if self.shard is None:
+            return
+        self.shards.finish(self.shard_run, self.shard['shard_id'])
+        self.crawler.stats.inc_value('grocery/shards/done')
+        requests = list(self.claim_shard())
+        if not requests:
+            return
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        raise DontCloseSpider
+
     def parse(self, response):
         """
         Main parsing method to handle category pages and extract product links.
         """
         retailer = response.meta['retailer']
-        selectors = self.SELECTORS[retailer]
 
         # Extract and follow product links
-        for product in response.css(selectors['product_container']):
-            product_url = product.css(selectors['product_url']).get()
+        for product in self.selectors.select(response, retailer, 'product_container'):
+            product_url = self.selectors.first(product, retailer, 'product_url')
             if product_url:
                 # Handle relative URLs
                 product_url = response.urljoin(product_url)
                 
-                # Check if the product link has been visited before
-                if product_url not in self.visited_urls:
-                    self.visited_urls.add(product_url)  # Mark it as visited
+                # Check if the product link has been visited before; the store
+                # compares canonical forms, but the link is fetched and stored as given
+                if self.first_visit(product_url, response):
+                    if self.mode == 'due' and DataCleaner.clean_url(product_url) in self.recrawl:
+                        # Stored products are fetched when the plan says they are due
+                        self.crawler.stats.inc_value('grocery/due/planned_products_skipped')
+                        continue
+                    if self.mode == 'listing':
+                        item = self.parse_listing_tile(product, product_url, retailer)
+                        if item:
+                            yield item
+                            continue
+
+                    self.count_request('product')
                     yield Request(
                         url=product_url,
                         callback=self.parse_product_page,
-                        meta={'retailer': retailer},
+                        # Product pages are revalidated and skipped when unchanged
+                        meta={'retailer': retailer, 'conditional': True},
                         dont_filter=True  # Ensure this request is not filtered
                     )
 
         # Follow pagination if it exists
-        pagination_links = response.css(selectors['pagination']).getall()
+        if not response.meta.get('follow_pagination', True):
+            return
+        pagination_links = self.selectors.extract_all(response, retailer, 'pagination')
         for link in pagination_links:
             next_page = response.urljoin(link)  # Ensure relative links are joined correctly
             
             # Check if the pagination link has been visited before
-            if next_page not in self.visited_urls:
-                self.visited_urls.add(next_page)  # Mark it as visited
+            if self.first_visit(next_page, response):
+                self.count_request('listing')
                 yield Request(
                     url=next_page,
                     callback=self.parse,
-                    meta={'retailer': retailer},
+                    meta={'retailer': retailer, 'reclaimed': response.meta.get('reclaimed', False)},
                     dont_filter=True  # Ensure this request is not filtered
                 )
 
+    def parse_listing_tile(self, product, product_url: str, retailer: str):
+        """Price-only item for a complete product, read from its listing tile.
+
+        Returns None when the product page still has to be fetched: the product
+        is new or incomplete in the database, or the tile shows no price.
+        """
+        product_url = DataCleaner.clean_url(product_url)
+        if product_url not in self.complete_products:
+            return None
+
+        # Same selectors and cleaning as the product page, so unchanged prices compare equal
+        price = DataCleaner.clean_price(self.selectors.extract(product, retailer, 'price'))
+        if price is None:
+            return None
+
+        self.crawler.stats.inc_value('grocery/listing/price_only_items')
+        return {
+            'retailer': retailer,
+            'scrape_date': datetime.now().isoformat(),
+            'price': price,
+            'product_url': product_url,
+            'category': DataCleaner.clean_category(self.extract_category_from_url(product_url)),
+            'price_only': True,
+        }
+
+    def count_request(self, kind: str):
+        """Count a listing or product page request for the current crawl mode"""
+        self.crawler.stats.inc_value(f'grocery/{self.mode}/requests/{kind}')
+
     def parse_product_page(self, response: scrapy.http.Response):
         retailer = response.meta['retailer']
         selectors = self.SELECTORS[retailer]
@@ -105,24 +351,25 @@ class GrocerySpider(Spider):
         if retailer == 'clicks':
             categories = response.css(selectors['category']).getall()
             category = self.extract_main_category(categories)
-            product_name = self.extract_data(response, selectors['product_name'])
         else:
             category = self.extract_category_from_url(response.url)
-            product_name = self.extract_data(response, selectors['product_name'])
 
-        # Get raw data
+        # Get raw data from the page's embedded product JSON where it has it, and
+        # the remaining fields from the selectors, evaluated against the one parsed tree
+        fields = self.extract_product_fields(response, retailer)
         raw_data = {
             'retailer': retailer,
             'scrape_date': datetime.now().isoformat(),
-            'product_name': product_name,
-            'price': self.extract_data(response, selectors['price']),
-            'image_url': self.extract_data(response, selectors['image_url']),
+            'product_name': fields['product_name'],
+            'price': fields['price'],
+            'image_url': fields['image_url'],
             'product_url': response.url,
             'category': category,
-            'product_description': self.extract_data(response, selectors['product_description']),
+            'product_description': fields['product_description'],
         }
 
         # Clean data using DataCleaner
+        clean_start = time.perf_counter()
         cleaned_data = {
             'retailer': raw_data['retailer'],
             'scrape_date': raw_data['scrape_date'],
@@ -133,9 +380,20 @@ class GrocerySpider(Spider):
             'category': DataCleaner.clean_category(raw_data['category']),
             'product_description': DataCleaner.clean_text(raw_data['product_description'])
         }
-        
+        if self.metrics:
+            self.metrics.observe('clean', retailer, time.perf_counter() - clean_start)
+
         yield cleaned_data
 
+    def extract_product_fields(self, response: scrapy.http.Response, retailer: str) -> dict:
+        """Raw product page fields, from structured data first and SELECTORS for the rest"""
+        source, fields = structured_product(response) if self.structured_data else (None, {})
+        missing = [field for field in self.PRODUCT_FIELDS if field not in fields]
+        if missing:
+            fields.update(self.selectors.extract_fields(response, retailer, missing))
+        self.crawler.stats.inc_value(f'grocery/extraction/{source or "selectors"}')
+        return fields
+
     def extract_main_category(self, categories):
         """Extract main category from breadcrumb list"""
         if not categories:
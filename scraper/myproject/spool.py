@@ -0,0 +1,111 @@
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List
+
+from myproject.signals import items_committed
+
+
+class SpoolPipeline:
+    """Append cleaned items to rotating, gzip-compressed NDJSON segment files.
+
+    The segment being written ends in ``.part`` and is renamed once it holds
+    SPOOL_SEGMENT_ITEMS items, is SPOOL_SEGMENT_SECONDS old or the spider closes,
+    so every file without the suffix is complete and ready for
+    ``scrapy load_spool``.
+    """
+
+    SUFFIX = '.ndjson.gz'
+
+    def __init__(self, spool_dir: str, segment_items: int = 50000,
+                 segment_seconds: float = 600, stats=None):
+        self.spool_dir = spool_dir
+        self.segment_items = segment_items
+        self.segment_seconds = segment_seconds
+        self.stats = stats
+        self.segment = None
+        self.segment_path = None
+        self.segment_count = 0
+        self.segment_opened = 0.0
+        self.sequence = 0
+        self.signals = None  # Crawler signals, for items_committed; None outside a crawl
+        self.segment_urls: List[str] = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(
+            spool_dir=crawler.settings.get('SPOOL_DIR', 'spool'),
+            segment_items=crawler.settings.getint('SPOOL_SEGMENT_ITEMS', 50000),
+            segment_seconds=crawler.settings.getfloat('SPOOL_SEGMENT_SECONDS', 600),
+            stats=crawler.stats,
+        )
+        pipeline.signals = crawler.signals
+        return pipeline
+
+    def open_spider(self, spider):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.spider_name = getattr(spider, 'name', 'spider')
+
+    def process_item(self, item: Dict[str, Any], spider) -> Dict[str, Any]:
+        """Append item to the open segment, rotating it when it is full or old"""
+        if self.segment is None:
+            self._open_segment()
+
+        self.segment.write(json.dumps(dict(item), default=str).encode('utf-8') + b'\n')
+        self.segment_count += 1
+        self.segment_urls.append(item['product_url'])
+        if self.stats is not None:
+            self.stats.inc_value('spool/items')
+
+        if (self.segment_count >= self.segment_items
+                or time.monotonic() - self.segment_opened >= self.segment_seconds):
+            self._close_segment()
+        return item
+
+    def _open_segment(self):
+        self.sequence += 1
+        name = (
+            f"{self.spider_name}-{datetime.now().strftime('%Y%m%dT%H%M%S')}"
+            f"-{os.getpid()}-{self.sequence:05d}{self.SUFFIX}"
+        )
+        self.segment_path = os.path.join(self.spool_dir, name)
+        self.segment = gzip.open(self.segment_path + '.part', 'wb', compresslevel=5)
+        self.segment_count = 0
+        self.segment_opened = time.monotonic()
+
+    def _close_segment(self):
+        """Finish the open segment and publish it under its final name"""
+        self.segment.close()
+        os.replace(self.segment_path + '.part', self.segment_path)
+        logging.info(f"Spooled {self.segment_count} items to {self.segment_path}")
+        if self.stats is not None:
+            self.stats.inc_value('spool/segments')
+        self.segment = None
+        # A finished segment is kept until it is loaded, so its items count as stored
+        product_urls, self.segment_urls = self.segment_urls, []
+        if self.signals is not None:
+            self.signals.send_catch_log(signal=items_committed, product_urls=product_urls)
+
+    def close_spider(self, spider):
+        if self.segment is not None:
+            self._close_segment()
+
+
+def finished_segments(spool_dir: str) -> List[str]:
+    """Paths of complete segments in spool_dir, oldest first"""
+    if not os.path.isdir(spool_dir):
+        return []
+    return sorted(
+        os.path.join(spool_dir, name) for name in os.listdir(spool_dir)
+        if name.endswith(SpoolPipeline.SUFFIX)
+    )
+
+
+def read_segment(path: str) -> Iterator[Dict[str, Any]]:
+    with gzip.open(path, 'rb') as segment:
+        for line in segment:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,217 @@
+import logging
+import time
+from typing import Dict, List, Tuple
+
+# Tables copied in foreign key order as (table, key column, columns)
+SYNC_TABLES = (
+    ('retailers', 'id', ('id', 'name', 'created_at')),
+    ('categories', 'id', ('id', 'name', 'created_at')),
+    ('products', 'id', ('id', 'name', 'image_url', 'product_url', 'description', 'category_id',
+                        'retailer_id', 'created_at', 'content_hash', 'last_seen_at',
+                        'current_price', 'current_price_at')),
+    ('prices', 'id', ('id', 'product_id', 'price', 'created_at')),
+    ('catalog_changes', 'seq', ('seq', 'product_id', 'change_kind', 'old_price', 'new_price',
+                                'run_id', 'created_at')),
+)
+
+# Watermark of the catalog_changes rows already applied to products. Both product
+# updates and price changes rewrite product columns in place.
+PRODUCT_UPDATES = 'products/updated'
+
+
+class CatalogSync:
+    """Copy rows added or changed in the Azure SQL catalog into PostgreSQL.
+
+    Every table is append-only apart from products, so each one is copied
+    from a high-water mark on its key. Product rows updated in place, their
+    details or their current price, are found through catalog_changes and
+    copied again.
+
+    Only rows created at least settle_seconds before the sync started are
+    copied: a lower key still held by an open scraper transaction would
+    otherwise be passed by the watermark and never copied. Source batches are
+    keyset range reads on the primary key. Each batch is loaded with COPY and
+    an upsert, and its watermark is saved in the same PostgreSQL transaction,
+    so an interrupted sync resumes after the last batch it committed.
+    """
+
+    def __init__(self, source, target, batch_size: int = 10000, settle_seconds: int = 60):
+        # Open AzureDBPipeline and PostgresPipeline instances
+        self.source = source
+        self.target = target
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+        self.bounds: Dict[str, int] = {}
+
+    def run(self) -> List[Tuple[str, int, float]]:
+        """Sync every table, returning (table, rows, seconds) for each step"""
+        self._ensure_sync_tables()
+        watermarks = self._load_watermarks()
+        cutoff = self._source_cutoff()
+        # Bounds are all taken at one cutoff, so every copied row's parents are copied too
+        self.bounds = {table: self._source_bound(table, key, cutoff) for table, key, _ in SYNC_TABLES}
+
+        results = []
+        for table, key, columns in SYNC_TABLES:
+            started = time.monotonic()
+            rows = self._sync_table(table, key, columns, watermarks.get(table, 0))
+            results.append((table, rows, time.monotonic() - started))
+            if table == 'products':
+                started = time.monotonic()
+                rows = self._sync_product_updates(columns, watermarks.get(PRODUCT_UPDATES, 0))
+                results.append((PRODUCT_UPDATES, rows, time.monotonic() - started))
+
+        self._reset_sequences()
+        return results
+
+    def _sync_table(self, table: str, key: str, columns: Tuple[str, ...], watermark: int) -> int:
+        bound = self.bounds[table]
+        copied = 0
+        while watermark < bound:
+            rows = self._read_batch(table, key, columns, watermark, bound)
+            if not rows:
+                break
+            watermark = rows[-1][columns.index(key)]
+            self._load_batch(table, key, columns, rows, watermark)
+            copied += len(rows)
+            logging.info(f"Synced {copied} {table} rows (up to {key} {watermark} of {bound})")
+        return copied
+
+    def _sync_product_updates(self, columns: Tuple[str, ...], watermark: int) -> int:
+        bound = self.bounds['catalog_changes']
+        copied = 0
+        while watermark < bound:
+            changes = self._read_product_updates(watermark, bound)
+            if not changes:
+                # No updates left below the bound, so nothing before it needs checking again
+                self._save_watermark(PRODUCT_UPDATES, bound)
+                self.target.conn.commit()
+                break
+            watermark = changes[-1][0]
+            product_ids = sorted({product_id for _, product_id in changes})
+            rows = self._read_products(columns, product_ids)
+            self._load_batch('products', 'id', columns, rows, watermark, PRODUCT_UPDATES)
+            copied += len(rows)
+            logging.info(f"Synced {copied} updated products (up to seq {watermark} of {bound})")
+        return copied
+
+    def _load_batch(self, table: str, key: str, columns: Tuple[str, ...], rows: List[tuple],
+                    watermark: int, watermark_name: str = None) -> None:
+        """Upsert rows through a staging table and save the watermark, in one transaction"""
+        staging = f"sync_{table}"
+        try:
+            cursor = self.target.cursor
+            cursor.execute(f"""
+                CREATE TEMPORARY TABLE IF NOT EXISTS {staging}
+                (LIKE {table}) ON COMMIT DELETE ROWS
+            """)
+            self.target._copy(staging, columns, rows)
+            updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column != key)
+            cursor.execute(f"""
+                INSERT INTO {table} ({', '.join(columns)})
+                SELECT {', '.join(columns)} FROM {staging}
+                ON CONFLICT ({key}) DO UPDATE SET {updates}
+            """)
+            self._save_watermark(watermark_name or table, watermark)
+            self.target.conn.commit()
+        except Exception as e:
+            logging.error(f"Error loading {len(rows)} {table} rows: {e}")
+            self.target.conn.rollback()
+            raise
+
+    def _ensure_sync_tables(self):
+        try:
+            self.target.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS sync_watermarks (
+                    table_name varchar(50) PRIMARY KEY,
+                    high_water bigint,
+                    updated_at timestamp DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            self.target.conn.commit()
+        except Exception as e:
+            logging.error(f"Error creating sync tables: {e}")
+            self.target.conn.rollback()
+            raise
+
+    def _load_watermarks(self) -> Dict[str, int]:
+        self.target.cursor.execute("SELECT table_name, high_water FROM sync_watermarks")
+        watermarks = dict(self.target.cursor.fetchall())
+        self.target.conn.commit()
+        return watermarks
+
+    def _save_watermark(self, name: str, watermark: int) -> None:
+        self.target.cursor.execute("""
+            INSERT INTO sync_watermarks (table_name, high_water) VALUES (%s, %s)
+            ON CONFLICT (table_name) DO UPDATE
+            SET high_water = EXCLUDED.high_water, updated_at = CURRENT_TIMESTAMP
+        """, (name, watermark))
+
+    def _reset_sequences(self) -> None:
+        """Move each serial sequence past the copied keys, for rows inserted in PostgreSQL itself"""
+        try:
+            for table, key, _ in SYNC_TABLES:
+                self.target.cursor.execute(f"""
+                    SELECT setval(pg_get_serial_sequence('{table}', '{key}'),
+                                  GREATEST((SELECT MAX({key}) FROM {table}), 1))
+                """)
+            self.target.conn.commit()
+        except Exception as e:
+            logging.error(f"Error resetting sequences: {e}")
+            self.target.conn.rollback()
+            raise
+
+    # Source reads, in T-SQL for the Azure SQL database
+
+    def _source_cutoff(self):
+        self.source.cursor.execute("SELECT DATEADD(second, -?, GETDATE())", (self.settle_seconds,))
+        return self.source.cursor.fetchone()[0]
+
+    def _source_bound(self, table: str, key: str, cutoff) -> int:
+        """Highest key of a row created before cutoff, found by walking back from the newest row"""
+        self.source.cursor.execute(
+            f"SELECT TOP 1 [{key}] FROM [{table}] WHERE [created_at] <= ? ORDER BY [{key}] DESC",
+            (cutoff,)
+        )
+        row = self.source.cursor.fetchone()
+        return row[0] if row else 0
+
+    def _read_batch(self, table: str, key: str, columns: Tuple[str, ...],
+                    after: int, bound: int) -> List[tuple]:
+        self.source.cursor.execute(f"""
+            SELECT TOP (?) {', '.join(f'[{column}]' for column in columns)} FROM [{table}]
+            WHERE [{key}] > ? AND [{key}] <= ? ORDER BY [{key}]
+        """, (self.batch_size, after, bound))
+        return [tuple(row) for row in self.source.cursor.fetchall()]
+
+    def _read_product_updates(self, after: int, bound: int) -> List[Tuple[int, int]]:
+        self.source.cursor.execute("""
+            SELECT TOP (?) [seq], [product_id] FROM [catalog_changes]
+            WHERE [seq] > ? AND [seq] <= ? AND [change_kind] IN ('updated', 'price') ORDER BY [seq]
+        """, (self.batch_size, after, bound))
+        return [tuple(row) for row in self.source.cursor.fetchall()]
+
+    def _read_products(self, columns: Tuple[str, ...], product_ids: List[int]) -> List[tuple]:
+        rows = []
+        # SQL Server takes at most 2100 parameters per statement
+        for start in range(0, len(product_ids), 2000):
+            chunk = product_ids[start:start + 2000]
+            self.source.cursor.execute(f"""
+                SELECT {', '.join(f'[{column}]' for column in columns)} FROM [products]
+                WHERE [id] IN ({', '.join(['?'] * len(chunk))})
+            """, chunk)
+            rows.extend(tuple(row) for row in self.source.cursor.fetchall())
+        return rows
+
+
+def sync_summary(results: List[Tuple[str, int, float]]) -> List[str]:
+    """One line per step with its rows and rows/sec, and a total"""
+    lines = []
+    for table, rows, seconds in results:
+        lines.append(f"{table:>18}: {rows:9d} rows in {seconds:7.2f}s "
+                     f"({rows / seconds if seconds else 0:9.0f} rows/sec)")
+    total_rows = sum(rows for _, rows, _ in results)
+    total_seconds = sum(seconds for _, _, seconds in results)
+    lines.append(f"{'total':>18}: {total_rows:9d} rows in {total_seconds:7.2f}s "
+                 f"({total_rows / total_seconds if total_seconds else 0:9.0f} rows/sec)")
+    return lines
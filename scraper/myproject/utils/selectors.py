@@ -0,0 +1,74 @@
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+
+_translator = HTMLTranslator()
+
+
+class SelectorEngine:
+    """Retailer selector tables compiled once into lxml XPath objects.
+
+    Takes tables shaped like ``GrocerySpider.SELECTORS``: each field maps to
+    one CSS selector or a list of them, and parsel's ``::text`` and
+    ``::attr()`` pseudo-elements are supported. Fields are evaluated directly
+    against the page's parsed lxml tree, with the same semantics as
+    ``GrocerySpider.extract_data``: the first match of each selector is taken,
+    stripped and joined with spaces.
+    """
+
+    def __init__(self, tables: Dict[str, Dict[str, Union[str, List[str]]]]):
+        self.tables = {
+            retailer: {field: self._compile(css) for field, css in table.items()}
+            for retailer, table in tables.items()
+        }
+
+    @staticmethod
+    def _compile(css: Union[str, List[str]]) -> List[etree.XPath]:
+        selectors = css if isinstance(css, list) else [css]
+        return [etree.XPath(_translator.css_to_xpath(selector)) for selector in selectors]
+
+    @staticmethod
+    def _root(node: Any):
+        # Accept parsel Selectors and Scrapy responses as well as lxml elements
+        if hasattr(node, 'selector'):
+            node = node.selector
+        return getattr(node, 'root', node)
+
+    @staticmethod
+    def _text(result: Any) -> str:
+        if isinstance(result, str):
+            return str(result)
+        return etree.tostring(result, encoding='unicode', method='html', with_tail=False)
+
+    def extract(self, node: Any, retailer: str, field: str) -> Optional[str]:
+        """First match of each of the field's selectors, stripped and joined with spaces"""
+        root = self._root(node)
+        data = []
+        for xpath in self.tables[retailer][field]:
+            results = xpath(root)
+            if results:
+                extracted = self._text(results[0])
+                if extracted:
+                    data.append(extracted.strip())
+        return ' '.join(data) if data else None
+
+    def first(self, node: Any, retailer: str, field: str) -> Optional[str]:
+        """First match of the field's selectors, unstripped, like ``.css(...).get()``"""
+        results = self.extract_all(node, retailer, field)
+        return results[0] if results else None
+
+    def extract_fields(self, node: Any, retailer: str, fields: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Extract several fields from one parsed tree in a single pass"""
+        root = self._root(node)
+        return {field: self.extract(root, retailer, field) for field in fields}
+
+    def extract_all(self, node: Any, retailer: str, field: str) -> List[str]:
+        """Every match of the field's selectors, like ``.css(...).getall()``"""
+        root = self._root(node)
+        return [self._text(result) for xpath in self.tables[retailer][field] for result in xpath(root)]
+
+    def select(self, node: Any, retailer: str, field: str) -> list:
+        """Elements matched by the field's selectors, for extracting fields relative to them"""
+        root = self._root(node)
+        return [element for xpath in self.tables[retailer][field] for element in xpath(root)]
@@ -0,0 +1,120 @@
+import json
+from functools import partial
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+# Hybris storefronts tag product divs with their analytics payload in this
+# attribute. Walking the divs with lxml's iter() is several times faster than
+# an XPath scan of every attribute on the page.
+DATA_LAYER_ATTRIBUTE = 'data-product-ga'
+DATA_LAYER_TAGS = ('div',)
+
+
+def _root(node: Any):
+    if hasattr(node, 'selector'):
+        node = node.selector
+    return getattr(node, 'root', node)
+
+
+def _json_ld_nodes(value: Any) -> Iterator[Dict[str, Any]]:
+    """Every object in a JSON-LD document, including those inside @graph and lists"""
+    if isinstance(value, list):
+        for entry in value:
+            yield from _json_ld_nodes(entry)
+    elif isinstance(value, dict):
+        yield value
+        if '@graph' in value:
+            yield from _json_ld_nodes(value['@graph'])
+
+
+def _is_product(node: Dict[str, Any]) -> bool:
+    kind = node.get('@type')
+    return kind == 'Product' or (isinstance(kind, list) and 'Product' in kind)
+
+
+def _first(value: Any) -> Any:
+    while isinstance(value, list):
+        value = value[0] if value else None
+    return value
+
+
+def _price(value: Any) -> Any:
+    # DataCleaner.clean_price takes floats and strings
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def json_ld_product(node: Any) -> Optional[Dict[str, Any]]:
+    """Raw product fields from the page's first JSON-LD Product object"""
+    for script in _root(node).iter('script'):
+        if script.get('type') != 'application/ld+json' or not script.text:
+            continue
+        try:
+            document = json.loads(script.text)
+        except ValueError:
+            continue
+        for entry in _json_ld_nodes(document):
+            if not _is_product(entry):
+                continue
+            # offers may also be given as a URL, which carries no price
+            offers = _first(entry.get('offers'))
+            if not isinstance(offers, dict):
+                offers = {}
+            image = _first(entry.get('image'))
+            if isinstance(image, dict):
+                image = image.get('url') or image.get('contentUrl')
+            return {
+                'product_name': entry.get('name'),
+                'price': _price(offers.get('price') or offers.get('lowPrice')),
+                'image_url': image,
+                'product_description': entry.get('description'),
+            }
+    return None
+
+
+def _url_segments(url: Optional[str]) -> set:
+    return {unquote(segment).lower() for segment in urlsplit(url or '').path.split('/') if segment}
+
+
+def data_layer_product(node: Any, url: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Raw product fields from the data-product-ga payload of the product at url.
+
+    Product pages also carry payloads for related product tiles, so a payload
+    is only taken when its id is a segment of the page's URL path, as in
+    ``/p/10000000000EA``. Without a url no payload is taken.
+    """
+    segments = _url_segments(url)
+    if not segments:
+        return None
+    for element in _root(node).iter(*DATA_LAYER_TAGS):
+        text = element.get(DATA_LAYER_ATTRIBUTE)
+        if text is None:
+            continue
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            continue
+        if not isinstance(payload, dict) or str(payload.get('id') or '').lower() not in segments:
+            continue
+        return {
+            'product_name': payload.get('name'),
+            'price': _price(payload.get('price')),
+        }
+    return None
+
+
+def structured_product(node: Any, url: Optional[str] = None) -> Tuple[Optional[str], Dict[str, Any]]:
+    """Product fields from embedded JSON, as (source, fields) with empty values left out.
+
+    JSON-LD is tried before the analytics data layer; source is None when
+    the page carries neither. url defaults to the node's, when it is a response.
+    """
+    url = url or getattr(node, 'url', None)
+    for source, extract in (('json_ld', json_ld_product), ('data_layer', partial(data_layer_product, url=url))):
+        fields = extract(node)
+        if fields:
+            fields = {field: value for field, value in fields.items() if value not in (None, '')}
+            if fields:
+                return source, fields
+    return None, {}
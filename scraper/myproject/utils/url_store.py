@@ -0,0 +1,301 @@
+import bisect
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import sqlite3
+import struct
+from array import array
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only track where a visitor came from
+TRACKING_PARAMS = {
+    'gclid', 'fbclid', 'msclkid', 'dclid', 'yclid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', 'ref', 'referrer', 'cmpid', 'sessionid', 'jsessionid',
+}
+TRACKING_PREFIXES = ('utm_', 'pk_', 'mtm_')
+
+
+def canonicalize_url(url: str) -> str:
+    """Normalize url so that equivalent product and pagination URLs compare equal.
+
+    Lowercases the scheme and host, drops the fragment, default ports, tracking
+    parameters and empty parameters, sorts the remaining query and strips
+    trailing slashes from the path.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parts.port}"
+
+    path = parts.path.rstrip('/') or '/'
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if value and key.lower() not in TRACKING_PARAMS
+        and not key.lower().startswith(TRACKING_PREFIXES)
+    ))
+    return urlunsplit((scheme, host, path, query, ''))
+
+
+def url_digest(url: str) -> bytes:
+    """16-byte digest of the canonical form of url"""
+    return hashlib.blake2b(canonicalize_url(url).encode('utf-8'), digest_size=16).digest()
+
+
+class URLStore:
+    """Interface for the spider's seen-URL stores"""
+
+    def add(self, url: str) -> bool:
+        """Mark url as seen, returning True if it had not been seen before"""
+        raise NotImplementedError
+
+    def __contains__(self, url: str) -> bool:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def close(self, keep: bool = True) -> None:
+        """Release the store; with a path, save it if keep is set and delete the file otherwise"""
+
+
+def remove_file(path: Optional[str]) -> None:
+    """Delete a saved store and any SQLite journal files beside it"""
+    if not path or path == ':memory:':
+        return
+    for name in (path, path + '-wal', path + '-shm'):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+class FingerprintURLStore(URLStore):
+    """Exact store of 64-bit URL fingerprints, saved to path as a packed sorted array.
+
+    A saved store is memory-mapped when it is reopened and searched in place,
+    like BloomURLStore's bit array, so a restart reads no more of it than it
+    needs. Fingerprints added since are held in a sorted array('Q') at 8 bytes
+    each. New ones go to a small set first, which is merged into that array
+    once it reaches 1/16th of its size, so adds stay cheap and the set never
+    dominates memory.
+    """
+
+    MIN_PENDING = 4096
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.file = None
+        self.mapped = None
+        self.saved = memoryview(b'').cast('Q')
+        self.fingerprints = array('Q')
+        self.pending = set()
+        if path and os.path.exists(path) and os.path.getsize(path):
+            if os.path.getsize(path) % self.fingerprints.itemsize:
+                raise ValueError(f"{path} is not a URL store file")
+            # close() always writes the fingerprints merged and sorted
+            self.file = open(path, 'rb')
+            self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.saved = memoryview(self.mapped).cast('Q')
+
+    @staticmethod
+    def _fingerprint(url: str) -> int:
+        return int.from_bytes(url_digest(url)[:8], 'little')
+
+    @staticmethod
+    def _in(fingerprints, fingerprint: int) -> bool:
+        position = bisect.bisect_left(fingerprints, fingerprint)
+        return position < len(fingerprints) and fingerprints[position] == fingerprint
+
+    def _stored(self, fingerprint: int) -> bool:
+        return self._in(self.fingerprints, fingerprint) or self._in(self.saved, fingerprint)
+
+    def _merge(self) -> None:
+        self.fingerprints = array('Q', heapq.merge(self.fingerprints, sorted(self.pending)))
+        self.pending = set()
+
+    def add(self, url: str) -> bool:
+        fingerprint = self._fingerprint(url)
+        if fingerprint in self.pending or self._stored(fingerprint):
+            return False
+        self.pending.add(fingerprint)
+        if len(self.pending) >= max(self.MIN_PENDING, len(self.fingerprints) >> 4):
+            self._merge()
+        return True
+
+    def __contains__(self, url: str) -> bool:
+        fingerprint = self._fingerprint(url)
+        return fingerprint in self.pending or self._stored(fingerprint)
+
+    def __len__(self) -> int:
+        return len(self.saved) + len(self.fingerprints) + len(self.pending)
+
+    def _unmap(self) -> None:
+        self.saved.release()
+        self.saved = memoryview(b'').cast('Q')
+        if self.file is not None:
+            self.mapped.close()
+            self.file.close()
+            self.file = self.mapped = None
+
+    def close(self, keep: bool = True) -> None:
+        if not self.path:
+            return
+        if not keep:
+            self._unmap()
+            remove_file(self.path)
+            return
+        self._merge()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            # Streamed in chunks, so saving does not copy the mapped fingerprints into memory
+            chunk = array('Q')
+            for fingerprint in heapq.merge(self.saved, self.fingerprints):
+                chunk.append(fingerprint)
+                if len(chunk) >= 65536:
+                    chunk.tofile(f)
+                    chunk = array('Q')
+            chunk.tofile(f)
+        self._unmap()
+        os.replace(tmp_path, self.path)
+
+
+class BloomURLStore(URLStore):
+    """Bloom filter sized for capacity URLs at error_rate false positives.
+
+    With a path the bit array lives in a memory-mapped file, so a restarted
+    crawl reopens it without reading it into memory. A false positive means
+    a URL is skipped as already seen, so error_rate bounds the share of new
+    URLs a crawl can miss.
+    """
+
+    HEADER = struct.Struct('<4sIQQ')
+    MAGIC = b'SWBF'
+
+    def __init__(self, capacity: int = 1000000, error_rate: float = 0.0001,
+                 path: Optional[str] = None):
+        self.path = path
+        self.file = None
+
+        if path and os.path.exists(path):
+            self.file = open(path, 'r+b')
+            self.bits = mmap.mmap(self.file.fileno(), 0)
+            magic, self.hashes, self.size, self.count = self.HEADER.unpack_from(self.bits)
+            if magic != self.MAGIC:
+                raise ValueError(f"{path} is not a URL store file")
+            return
+
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        length = self.HEADER.size + (self.size + 7) // 8
+        if path:
+            self.file = open(path, 'w+b')
+            self.file.truncate(length)
+            self.bits = mmap.mmap(self.file.fileno(), length)
+        else:
+            self.bits = bytearray(length)
+
+    def _positions(self, url: str):
+        digest = url_digest(url)
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, url: str) -> bool:
+        added = False
+        offset = self.HEADER.size
+        for position in self._positions(url):
+            index, mask = offset + (position >> 3), 1 << (position & 7)
+            if not self.bits[index] & mask:
+                self.bits[index] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, url: str) -> bool:
+        offset = self.HEADER.size
+        return all(
+            self.bits[offset + (position >> 3)] & (1 << (position & 7))
+            for position in self._positions(url)
+        )
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self, keep: bool = True) -> None:
+        if self.file is None:
+            return
+        self.HEADER.pack_into(self.bits, 0, self.MAGIC, self.hashes, self.size, self.count)
+        self.bits.flush()
+        self.bits.close()
+        self.file.close()
+        self.file = None
+        if not keep:
+            remove_file(self.path)
+
+
+class SQLiteURLStore(URLStore):
+    """64-bit URL fingerprints in a SQLite file that several crawler processes share.
+
+    add() claims a URL for the calling process: it returns True in exactly one
+    of the processes that add the same URL.
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen_urls (fingerprint INTEGER PRIMARY KEY)")
+
+    @staticmethod
+    def _fingerprint(url: str) -> int:
+        # SQLite integers are signed 64-bit
+        return int.from_bytes(url_digest(url)[:8], 'little', signed=True)
+
+    def add(self, url: str) -> bool:
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO seen_urls (fingerprint) VALUES (?)", (self._fingerprint(url),)
+        )
+        return cursor.rowcount == 1
+
+    def __contains__(self, url: str) -> bool:
+        return self.conn.execute(
+            "SELECT 1 FROM seen_urls WHERE fingerprint = ?", (self._fingerprint(url),)
+        ).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM seen_urls").fetchone()[0]
+
+    def close(self, keep: bool = True) -> None:
+        self.conn.close()
+        if not keep:
+            remove_file(self.path)
+
+
+def open_url_store(settings) -> URLStore:
+    """Build the URL store selected by the URL_STORE setting.
+
+    A store saved at URL_STORE_PATH is only reopened when the crawl can
+    resume the requests it had queued: with JOBDIR, or as a worker of a
+    sharded run. Otherwise its URLs were marked seen when they were queued,
+    possibly never fetched, so the crawl starts from an empty store.
+    """
+    kind = settings.get('URL_STORE', 'fingerprints')
+    path = settings.get('URL_STORE_PATH')
+    if path and not (settings.get('JOBDIR') or settings.get('SHARD_RUN')):
+        remove_file(path)
+    if kind == 'fingerprints':
+        return FingerprintURLStore(path)
+    if kind == 'sqlite':
+        return SQLiteURLStore(path or ':memory:')
+    if kind == 'bloom':
+        return BloomURLStore(
+            capacity=settings.getint('URL_STORE_CAPACITY', 1000000),
+            error_rate=settings.getfloat('URL_STORE_ERROR_RATE', 0.0001),
+            path=path,
+        )
+    raise ValueError(f"Unknown URL_STORE {kind!r}, expected 'fingerprints', 'bloom' or 'sqlite'")
@@ -0,0 +1,93 @@
+import json
+import subprocess
+import sys
+import unittest
+
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+
+from myproject import settings as project_settings
+from myproject.middlewares import RetailerThrottleMiddleware
+
+THROTTLE = 'myproject.middlewares.RetailerThrottleMiddleware'
+CONDITIONAL = 'myproject.middlewares.ConditionalRequestMiddleware'
+
+
+class RetailerThrottleTest(unittest.TestCase):
+    """Test RetailerThrottleMiddleware's budgets."""
+
+    def middleware(self, **settings):
+        crawler = get_crawler(settings_dict={
+            'RETAILER_THROTTLE_ENABLED': True, 'DOWNLOAD_DELAY': 1.0,
+            'RETAILER_THROTTLE_WINDOW': 4, 'RETAILER_THROTTLE_TARGET_LATENCY': 1.0, **settings,
+        })
+        middleware = RetailerThrottleMiddleware(crawler)
+        # No engine outside a crawl, so budgets are not copied onto downloader slots
+        middleware._apply = lambda retailer: None
+        return middleware
+
+    def respond(self, middleware, retailer, status=200, latency=0.1):
+        request = Request(f'https://{retailer}.example/p', meta={'retailer': retailer, 'download_latency': latency})
+        middleware.process_response(request, Response(request.url, status=status, request=request), None)
+
+    def test_sees_responses_the_conditional_middleware_drops(self):
+        """Test that the throttle handles responses before ConditionalRequestMiddleware raises on 304s."""
+        order = project_settings.DOWNLOADER_MIDDLEWARES
+        # process_response runs from the highest order down
+        self.assertGreater(order[THROTTLE], order[CONDITIONAL])
+
+    def test_backoff_status_halves_concurrency_and_doubles_delay(self):
+        """Test that a 503 backs the retailer off and leaves the others alone."""
+        middleware = self.middleware()
+        for retailer in ('slow', 'fast'):
+            budget = middleware._budget(retailer)
+            budget['concurrency'], budget['delay'] = 4, 1.0
+        self.respond(middleware, 'slow', status=503)
+        self.respond(middleware, 'fast')
+
+        self.assertEqual(middleware.budgets['slow']['concurrency'], 2)
+        self.assertEqual(middleware.budgets['slow']['delay'], 2.0)
+        self.assertEqual(middleware.budgets['fast']['concurrency'], 4)
+        self.assertEqual(middleware.budgets['fast']['delay'], 1.0)
+
+    def test_high_latency_backs_off_once_per_window(self):
+        """Test that latency above twice the target halves concurrency and doubles delay, once a window."""
+        middleware = self.middleware()
+        budget = middleware._budget('slow')
+        budget['concurrency'], budget['delay'] = 4, 1.0
+        for _ in range(4):
+            self.respond(middleware, 'slow', latency=5.0)
+
+        self.assertEqual(budget['concurrency'], 2)
+        self.assertEqual(budget['delay'], 2.0)
+        self.assertEqual(middleware.stats.get_value('throttle/slow/backoffs'), 1)
+
+
+class RetailerThrottleCrawlTest(unittest.TestCase):
+    """Test the throttle in a crawl against the mock retailers of benchmarks.retailer_throttle."""
+
+    def test_slow_retailer_backs_off_and_fast_one_is_not_slowed(self):
+        """Test that only the retailer answering 503 backs off."""
+        # Each crawl needs a fresh reactor, so it runs in its own process
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.retailer_throttle', '--mode', 'retailer',
+             '--pages', '60', '--delay', '0.2', '--window', '4'],
+            check=True, capture_output=True, text=True, timeout=300,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        slow, fast = result['slow'], result['fast']
+
+        self.assertEqual(slow['pages'], 60)
+        self.assertEqual(fast['pages'], 60)
+        self.assertGreater(slow['throttled'], 0)
+        self.assertGreater(slow['backoffs'], 0)
+        self.assertEqual(fast['throttled'], 0)
+        self.assertEqual(fast['backoffs'], 0)
+        # The fast retailer sped up past its starting budget while the slow one was held back
+        self.assertLess(fast['delay'], 0.2)
+        self.assertGreater(fast['concurrency'], slow['concurrency'])
+        self.assertLess(fast['seconds'], slow['seconds'])
+
+
+if __name__ == '__main__':
+    unittest.main()
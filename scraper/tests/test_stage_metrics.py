@@ -0,0 +1,88 @@
+import json
+import subprocess
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scrapy import Request, Spider
+from scrapy.crawler import CrawlerProcess
+
+from myproject import settings as project_settings
+
+PAGES = 5
+
+
+class ProductSpider(Spider):
+    """Follows PAGES pages of a local site, with a sync and an async callback"""
+
+    name = 'stage_metrics_test'
+
+    def __init__(self, base=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.base = base
+
+    async def start(self):
+        for page in range(PAGES):
+            yield Request(f'{self.base}/{page}', callback=self.parse_page)
+
+    def parse_page(self, response):
+        yield {'url': response.url}
+        yield Request(response.url + '/product', callback=self.parse_product)
+
+    async def parse_product(self, response):
+        yield {'url': response.url}
+
+
+def crawl():
+    """Crawl a local site with the project's spider middlewares and print the stats as JSON"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.end_headers()
+            self.wfile.write(f'<h1>{self.path}</h1>'.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    process = CrawlerProcess({
+        'SPIDER_MIDDLEWARES': project_settings.SPIDER_MIDDLEWARES,
+        'EXTENSIONS': {'myproject.metrics.StageMetricsExtension': 500},
+        'METRICS_ENABLED': True,
+        'TWISTED_REACTOR': project_settings.TWISTED_REACTOR,
+        'ROBOTSTXT_OBEY': False,
+        'LOG_LEVEL': 'ERROR',
+    })
+    crawler = process.create_crawler(ProductSpider)
+    process.crawl(crawler, base=f'http://127.0.0.1:{server.server_port}')
+    process.start()
+    server.shutdown()
+    print(json.dumps(crawler.stats.get_stats(), default=str))
+
+
+class StageTimingCrawlTest(unittest.TestCase):
+    """Test StageTimingMiddleware in a crawl of a local site."""
+
+    def test_times_sync_and_async_callbacks(self):
+        """Test that the crawl runs to the end and both kinds of callback are timed."""
+        # Each crawl needs a fresh reactor, so it runs in its own process
+        output = subprocess.run(
+            [sys.executable, '-c', 'from tests.test_stage_metrics import crawl; crawl()'],
+            check=True, capture_output=True, text=True, timeout=120,
+        ).stdout
+        stats = json.loads(output.strip().splitlines()[-1])
+
+        self.assertEqual(stats['finish_reason'], 'finished')
+        self.assertEqual(stats.get('item_scraped_count'), 2 * PAGES)
+        self.assertEqual(stats.get('metrics/parse/parse_page/count'), PAGES)
+        self.assertEqual(stats.get('metrics/parse/parse_product/count'), PAGES)
+        self.assertNotIn('log_count/ERROR', stats)
+
+
+if __name__ == '__main__':
+    unittest.main()